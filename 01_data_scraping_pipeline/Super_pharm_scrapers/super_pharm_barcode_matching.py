@@ -22,6 +22,22 @@ import psycopg2
 from psycopg2.extras import execute_values, Json
 from bs4 import BeautifulSoup
 
+# Slow statement capture is shared with the API (02_backend_api/slow_queries.py)
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), '02_backend_api'))
+from slow_queries import SlowQueryLog
+from catalog_snapshot import write_catalog_snapshot
+
+# Statements slower than this are recorded in slow_queries with their plans
+SLOW_QUERY_MS = float(os.getenv("ETL_SLOW_QUERY_MS", "2000"))
+
+# Where the memory-mapped catalog snapshot for the API workers is published
+# after each run (the API's CATALOG_SNAPSHOT_DIR); unset skips it
+CATALOG_SNAPSHOT_DIR = os.getenv("CATALOG_SNAPSHOT_DIR") or None
+
+# Price drops recorded in price_changes (for the API's /api/price-drops) are
+# kept this long
+PRICE_CHANGE_RETENTION_DAYS = int(os.getenv("PRICE_CHANGE_RETENTION_DAYS", "14"))
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -67,13 +83,23 @@ class SuperPharmBarcodeETL:
 
         # Database connection
         try:
-            self.conn = psycopg2.connect(
+            db_settings = dict(
                 host="localhost",
                 port=5432,
                 database="price_comparison_app_v2",
                 user="postgres",
                 password="025655358"
             )
+            # Slow statements are explained on a second connection, so the ETL never waits on it
+            self.slow_query_log = SlowQueryLog(
+                source='super_pharm_etl',
+                connect=lambda: psycopg2.connect(**db_settings),
+                release=lambda conn: conn.close(),
+                threshold_ms=SLOW_QUERY_MS,
+                persist=True,
+            )
+            self.slow_query_log.start()
+            self.conn = psycopg2.connect(cursor_factory=self.slow_query_log.cursor_factory(), **db_settings)
             self.cursor = self.conn.cursor()
             logger.info("Connected to database successfully")
         except Exception as e:
@@ -93,6 +119,7 @@ class SuperPharmBarcodeETL:
             'products_matched_existing': 0,
             'products_created_new': 0,
             'prices_inserted': 0,
+            'price_drops': 0,
             'stores_created': 0,
             'batch_inserts': 0,
             'errors': 0
@@ -557,6 +584,52 @@ class SuperPharmBarcodeETL:
 
                     self.stats['prices_inserted'] += len(prices_data)
 
+                    # Step 4: UPSERT the latest price per (product, store) into current_prices
+                    # Only positive prices count, and an older file never overwrites a newer price.
+                    # Deduplicate first: ON CONFLICT cannot touch the same row twice in one statement.
+                    latest_by_key = {}
+                    for row in prices_data:
+                        if row[2] and row[2] > 0:
+                            key = (row[0], row[1])
+                            if key not in latest_by_key or row[3] >= latest_by_key[key][3]:
+                                latest_by_key[key] = row
+
+                    if latest_by_key:
+                        # The same statement compares each new price with the current one it
+                        # replaces and returns the drops (all CTEs see the pre-upsert rows)
+                        price_drops = execute_values(
+                            self.cursor,
+                            """
+                            WITH incoming (retailer_product_id, store_id, price, price_timestamp) AS (
+                                VALUES %s
+                            ),
+                            previous AS (
+                                SELECT cur.retailer_product_id, cur.store_id, cur.price
+                                FROM current_prices cur
+                                JOIN incoming USING (retailer_product_id, store_id)
+                            ),
+                            upserted AS (
+                                INSERT INTO current_prices (retailer_product_id, store_id, price, price_timestamp)
+                                SELECT retailer_product_id, store_id, price, price_timestamp FROM incoming
+                                ON CONFLICT (retailer_product_id, store_id)
+                                DO UPDATE SET
+                                    price = EXCLUDED.price,
+                                    price_timestamp = EXCLUDED.price_timestamp,
+                                    scraped_at = NOW()
+                                WHERE EXCLUDED.price_timestamp >= current_prices.price_timestamp
+                                RETURNING retailer_product_id, store_id, price, price_timestamp
+                            )
+                            SELECT u.retailer_product_id, u.store_id, previous.price, u.price, u.price_timestamp
+                            FROM upserted u
+                            JOIN previous USING (retailer_product_id, store_id)
+                            WHERE u.price < previous.price
+                            """,
+                            list(latest_by_key.values()),
+                            template="(%s::int, %s::int, %s::numeric, %s::timestamptz)",
+                            fetch=True
+                        )
+                        self.record_price_drops(price_drops)
+
                 self.stats['batch_inserts'] += 1
 
             # Record file as processed
@@ -584,6 +657,11 @@ class SuperPharmBarcodeETL:
                 'SUCCESS'
             ))
 
+            # Tell the API which products changed, in the same transaction as the prices
+            self.record_changed_barcodes(
+                {p['barcode'] for p in products if p.get('barcode')}
+            )
+
             # Commit the batch
             self.conn.commit()
             self.stats['files_processed'] += 1
@@ -839,6 +917,108 @@ class SuperPharmBarcodeETL:
             self.conn.rollback()
             self.stats['errors'] += 1
 
+    def record_changed_barcodes(self, barcodes):
+        """
+        Add a data_versions row listing the barcodes this batch touched, inside the
+        batch transaction, so the API drops their cached product details once it commits.
+        Runs under a savepoint: a missing table or column must never cost us the batch.
+        """
+        if not barcodes:
+            return
+        self.cursor.execute("SAVEPOINT data_version")
+        try:
+            self.cursor.execute("""
+                INSERT INTO data_versions (source, retailer_id, barcodes)
+                VALUES (%s, %s, %s)
+            """, ('super_pharm_etl', self.RETAILER_ID, sorted(barcodes)))
+            self.cursor.execute("RELEASE SAVEPOINT data_version")
+        except Exception as e:
+            logger.warning(f"Could not record changed barcodes: {e}")
+            self.cursor.execute("ROLLBACK TO SAVEPOINT data_version")
+
+    def record_price_drops(self, price_drops):
+        """
+        Add the batch's price drops, as returned by the current_prices upsert
+        (retailer_product_id, store_id, old price, new price, price timestamp),
+        to price_changes for the API's /api/price-drops.
+        Runs under a savepoint: a missing table must never cost us the batch.
+        """
+        if not price_drops:
+            return
+        self.cursor.execute("SAVEPOINT price_changes")
+        try:
+            execute_values(
+                self.cursor,
+                """
+                INSERT INTO price_changes (
+                    retailer_id, retailer_product_id, store_id, old_price, new_price, price_timestamp
+                )
+                VALUES %s
+                """,
+                [(self.RETAILER_ID, *drop) for drop in price_drops]
+            )
+            self.cursor.execute("RELEASE SAVEPOINT price_changes")
+            self.stats['price_drops'] += len(price_drops)
+        except Exception as e:
+            logger.warning(f"Could not record price drops: {e}")
+            self.cursor.execute("ROLLBACK TO SAVEPOINT price_changes")
+
+    def prune_price_changes(self):
+        """Drop price_changes rows past PRICE_CHANGE_RETENTION_DAYS, under a savepoint like record_price_drops()."""
+        self.cursor.execute("SAVEPOINT price_changes")
+        try:
+            self.cursor.execute("""
+                DELETE FROM price_changes
+                WHERE detected_at < NOW() - make_interval(days => %s)
+            """, (PRICE_CHANGE_RETENTION_DAYS,))
+            self.cursor.execute("RELEASE SAVEPOINT price_changes")
+        except Exception as e:
+            logger.warning(f"Could not prune price changes: {e}")
+            self.cursor.execute("ROLLBACK TO SAVEPOINT price_changes")
+
+    def bump_data_version(self):
+        """
+        Record a new row in data_versions at the end of the run. The API polls this
+        table and rebuilds its in-memory indexes (search suggestions, etc.) and clears
+        its caches when a run-level version (one without barcodes) appears.
+        """
+        try:
+            self.cursor.execute("""
+                INSERT INTO data_versions (source, retailer_id)
+                VALUES (%s, %s)
+                RETURNING version
+            """, ('super_pharm_etl', self.RETAILER_ID))
+            version = self.cursor.fetchone()[0]
+
+            # Per-batch barcode rows are only needed until the API has polled them
+            self.cursor.execute("""
+                DELETE FROM data_versions
+                WHERE barcodes IS NOT NULL AND created_at < NOW() - INTERVAL '7 days'
+            """)
+            self.prune_price_changes()
+            self.conn.commit()
+            logger.info(f"Published data version {version}")
+        except Exception as e:
+            logger.error(f"Failed to publish data version: {e}")
+            self.conn.rollback()
+            return
+
+        self.publish_catalog_snapshot(version)
+
+    def publish_catalog_snapshot(self, version: int):
+        """
+        Write the catalog snapshot the API workers mmap (see
+        02_backend_api/catalog_snapshot.py) for this data version.
+        """
+        if not CATALOG_SNAPSHOT_DIR:
+            return
+        try:
+            path = write_catalog_snapshot(self.conn, CATALOG_SNAPSHOT_DIR, version)
+            logger.info(f"Published catalog snapshot {path}")
+        except Exception as e:
+            logger.error(f"Failed to publish catalog snapshot: {e}")
+            self.conn.rollback()
+
     def run(self, limit: Optional[int] = None):
         """Main ETL execution"""
         logger.info("="*80)
@@ -907,6 +1087,9 @@ class SuperPharmBarcodeETL:
                     self.process_promotion_file(filepath, file_info['filename'])
                     os.remove(filepath)
 
+            # Publish a new data version so the API refreshes its indexes
+            self.bump_data_version()
+
             # Print summary
             self.print_summary()
 
@@ -936,6 +1119,7 @@ class SuperPharmBarcodeETL:
         logger.info(f"Products matched to existing: {self.stats['products_matched_existing']}")
         logger.info(f"New products created: {self.stats['products_created_new']}")
         logger.info(f"Prices inserted: {self.stats['prices_inserted']}")
+        logger.info(f"Price drops recorded: {self.stats['price_drops']}")
         logger.info(f"Stores created/updated: {self.stats['stores_created']}")
         logger.info(f"Promotions processed: {self.stats.get('promotions_processed', 0)}")
         logger.info(f"Promotion-product links created: {self.stats.get('promotion_links_created', 0)}")
@@ -1002,6 +1186,10 @@ class SuperPharmBarcodeETL:
         except:
             pass
 
+        # Let queued slow query plans finish
+        if hasattr(self, 'slow_query_log'):
+            self.slow_query_log.stop()
+
         # Close database connection
         if hasattr(self, 'conn') and self.conn:
             self.conn.close()
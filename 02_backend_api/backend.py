@@ -1,20 +1,62 @@
 import os
+import json
+import logging
+import base64
+import hmac
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
 from typing import List, Optional
 from urllib.parse import urlparse
 from dotenv import load_dotenv
-import psycopg2
 from psycopg2.extras import RealDictCursor
-from fastapi import FastAPI, Depends, HTTPException, Query, Header
+from fastapi import FastAPI, Depends, HTTPException, Query, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from fastapi.routing import APIRoute
 from pydantic import BaseModel, Field
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation
 import uvicorn
 import jwt
 import bcrypt
 
+from db_pool import DatabasePool, PoolTimeoutError
+from queries import (
+    CART_STORE_PRICES_QUERY, PRICE_DROPS_QUERY, PRICE_HISTORY_QUERY, PRODUCT_BATCH_QUERY, PRODUCT_DETAIL_QUERY,
+    RECOMMENDATION_CANDIDATES_QUERY, RECOMMENDED_PRODUCTS_QUERY, USER_HELD_BARCODES_QUERY,
+    build_search_count_query, build_search_page_query, cart_store_prices_params, price_drops_params,
+    price_history_params, product_batch_params, to_asyncpg_sql
+)
+from cache import SingleFlight, TTLCache, VersionedCache
+from data_version import DataVersionWatcher
+from search_suggest import SuggestService
+from deal_pool import DealPool
+from product_pool import ProductPool
+from catalog_snapshot import CatalogSnapshots
+from item_similarity import DEFAULT_MODEL_PATH, ItemSimilarity
+from store_index import StoreIndex
+from preference_queue import PreferenceQueue
+from recommendation_candidates import CandidateRefresher
+from basket_optimizer import BasketOptimizer
+import request_timing
+from request_timing import RouteMetrics, TimedCursor
+from slow_queries import SlowQueryLog
+from profiler import ProfileStore, RequestProfiler
+import fast_json
+from fast_json import FastJSONResponse, RowEncoder
+from compression import CompressionMiddleware
+from conditional import EntityVersions, ExpiryClock, cache_headers, content_etag, etag_matches, not_modified, weak_etag
+
 # --- Configuration ---
 load_dotenv()  # Load environment variables from .env
 
+# LOG_LEVEL=DEBUG shows per-request auth decisions
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
 # Get the database URL from the environment
 DATABASE_URL = os.getenv("DATABASE_URL")
 
@@ -39,6 +81,217 @@ JWT_SECRET = os.getenv("JWT_SECRET", "your-secret-key-change-in-production")
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = 24
 
+# Comma-separated tokens accepted in X-Admin-Token for operator endpoints
+# (slow query log, profiles) and for profiling a request with X-Profile: 1;
+# none configured disables all of them
+ADMIN_TOKENS = {token.strip() for token in os.getenv("ADMIN_TOKENS", "").split(",") if token.strip()}
+
+# Users known to exist are trusted from their signed token for this long, so
+# authenticated requests do not look the user up on every call
+AUTH_USER_CACHE_TTL = float(os.getenv("AUTH_USER_CACHE_TTL", "600"))  # seconds
+known_users_cache = TTLCache(max_entries=10000, ttl_seconds=AUTH_USER_CACHE_TTL)
+
+# Connection pool configuration
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_CHECKOUT_TIMEOUT = float(os.getenv("DB_POOL_CHECKOUT_TIMEOUT", "5"))  # seconds
+DB_POOL_HEALTH_CHECK_INTERVAL = float(os.getenv("DB_POOL_HEALTH_CHECK_INTERVAL", "30"))  # seconds
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "15000"))
+
+# "sync" serves everything from psycopg2 on the threadpool; "async" switches the
+# product detail, batch and search endpoints to asyncpg (see "Async Request Path" below)
+API_DB_MODE = os.getenv("API_DB_MODE", "sync").lower()
+
+# Search result counts are cached per (q, category) so paging does not re-count
+SEARCH_COUNT_CACHE_TTL = float(os.getenv("SEARCH_COUNT_CACHE_TTL", "300"))  # seconds
+search_count_cache = TTLCache(max_entries=2048, ttl_seconds=SEARCH_COUNT_CACHE_TTL)
+
+# Product detail responses, invalidated per barcode as ETL batches commit.
+# The TTL only bounds staleness if the data_versions watcher falls behind.
+PRODUCT_CACHE_MAX_ENTRIES = int(os.getenv("PRODUCT_CACHE_MAX_ENTRIES", "5000"))
+PRODUCT_CACHE_TTL = float(os.getenv("PRODUCT_CACHE_TTL", "3600"))  # seconds
+product_detail_cache = VersionedCache(max_entries=PRODUCT_CACHE_MAX_ENTRIES, ttl_seconds=PRODUCT_CACHE_TTL)
+
+# Product details leave out promotions that have ended, which no ETL write
+# reports: their ETags change and their cache is cleared every
+# PROMOTION_EXPIRY_SECONDS, so an ended promotion is shown at most that long
+PROMOTION_EXPIRY_SECONDS = float(os.getenv("PROMOTION_EXPIRY_SECONDS", "900"))
+promotion_clock = ExpiryClock(PROMOTION_EXPIRY_SECONDS)
+promotion_clock.on_rollover(lambda: product_detail_cache.clear(product_detail_cache.version))
+
+# Cart recommendations, keyed by the cart as a barcode multiset plus its scope
+# and options. Dropped when an ETL batch touches one of the cart's barcodes and
+# after every run (stores can change); identical concurrent misses share one
+# computation.
+CART_CACHE_MAX_ENTRIES = int(os.getenv("CART_CACHE_MAX_ENTRIES", "2000"))
+CART_CACHE_TTL = float(os.getenv("CART_CACHE_TTL", "600"))  # seconds
+cart_recommendation_cache = VersionedCache(max_entries=CART_CACHE_MAX_ENTRIES, ttl_seconds=CART_CACHE_TTL)
+cart_recommendation_flights = SingleFlight()
+
+# Calendar days (price history buckets, "today" for price drops) are in this time zone.
+# The ETLs write prices.price_timestamp as naive local time, so it must match the zone they run in.
+CATALOG_TIMEZONE = os.getenv("CATALOG_TIMEZONE", "Asia/Jerusalem")
+
+# Price history (/api/products/{barcode}/history) is bucketed by calendar day,
+# week or month. Each granularity caps the buckets a request may ask for, so
+# responses stay small however much history exists. Responses are cached like
+# product details.
+PRICE_HISTORY_DEFAULT_BUCKETS = {"day": 30, "week": 26, "month": 12}
+PRICE_HISTORY_MAX_BUCKETS = {"day": 90, "week": 104, "month": 60}
+price_history_cache = VersionedCache(max_entries=PRODUCT_CACHE_MAX_ENTRIES, ttl_seconds=PRODUCT_CACHE_TTL)
+
+# /api/price-drops results per filter; ETL batches add drops all the time, so
+# they are only kept briefly (and dropped after runs)
+PRICE_DROPS_CACHE_TTL = float(os.getenv("PRICE_DROPS_CACHE_TTL", "60"))  # seconds
+price_drops_cache = TTLCache(max_entries=512, ttl_seconds=PRICE_DROPS_CACHE_TTL)
+
+# Conditional requests (see conditional.py): catalog responses carry an ETag
+# and these Cache-Control hints, so clients and a CDN or reverse proxy can
+# revalidate cheaply. Product details and deals change with ETL batches; the
+# store list mostly with runs and geocoding, and is rebuilt in memory at most
+# every STORE_INDEX_REFRESH_SECONDS.
+CATALOG_CACHE_MAX_AGE = int(os.getenv("CATALOG_CACHE_MAX_AGE", "60"))  # seconds
+STORES_CACHE_MAX_AGE = int(os.getenv("STORES_CACHE_MAX_AGE", "300"))  # seconds
+CATALOG_CACHE_CONTROL = f"public, max-age={CATALOG_CACHE_MAX_AGE}"
+STORES_CACHE_CONTROL = f"public, max-age={STORES_CACHE_MAX_AGE}"
+entity_versions = EntityVersions()
+
+# Popular/cold-start recommendations also refresh on this schedule, since
+# popularity (cart and favorite counts) changes without any ETL run (with
+# catalog snapshots, a worker republishes a snapshot older than this)
+PRODUCT_POOL_REFRESH_SECONDS = float(os.getenv("PRODUCT_POOL_REFRESH_SECONDS", "600"))
+
+# Directory the ETLs publish memory-mapped catalog snapshots to (see
+# catalog_snapshot.py; unset disables them). With a snapshot mapped, popular
+# picks are served from it instead of a per-worker pool. Workers check for a
+# newer snapshot after runs and on this schedule. The API user needs write
+# access to it too, to republish stale snapshots.
+CATALOG_SNAPSHOT_DIR = os.getenv("CATALOG_SNAPSHOT_DIR") or None
+CATALOG_SNAPSHOT_REFRESH_SECONDS = float(os.getenv("CATALOG_SNAPSHOT_REFRESH_SECONDS", "30"))
+
+# Item similarity model written by 04_utilities/build_item_similarity.py; the
+# file is checked for a new model on this schedule. Personalized
+# recommendations ask the model for RECOMMENDATION_OVERFETCH candidates per
+# product requested, since some may be inactive or lack an image.
+ITEM_SIMILARITY_PATH = os.getenv("ITEM_SIMILARITY_PATH", DEFAULT_MODEL_PATH)
+ITEM_SIMILARITY_REFRESH_SECONDS = float(os.getenv("ITEM_SIMILARITY_REFRESH_SECONDS", "300"))
+RECOMMENDATION_OVERFETCH = 3
+
+# Each user's ranked candidates are materialized in user_recommendation_candidates
+# (RECOMMENDATION_CANDIDATES per user), refreshed once their cart, favorites or
+# preferences have been quiet for RECOMMENDATION_SETTLE_SECONDS, and when read
+# after an ETL run or once older than RECOMMENDATION_CANDIDATE_MAX_AGE.
+RECOMMENDATION_CANDIDATES = int(os.getenv("RECOMMENDATION_CANDIDATES", "100"))
+RECOMMENDATION_SETTLE_SECONDS = float(os.getenv("RECOMMENDATION_SETTLE_SECONDS", "5"))
+RECOMMENDATION_CANDIDATE_MAX_AGE = float(os.getenv("RECOMMENDATION_CANDIDATE_MAX_AGE", "86400"))  # seconds
+
+# Preference score updates are written behind the request; this bounds how
+# long an interaction can take to show up in /api/recommendations
+PREFERENCE_FLUSH_SECONDS = float(os.getenv("PREFERENCE_FLUSH_SECONDS", "2"))
+
+# Geocoding scripts update store coordinates outside the ETLs; the store
+# index picks those changes up on this schedule
+STORE_INDEX_REFRESH_SECONDS = float(os.getenv("STORE_INDEX_REFRESH_SECONDS", "300"))
+
+# The encoded /api/stores body and its ETag, rebuilt after runs and on the
+# store index's schedule
+store_list_cache = VersionedCache(max_entries=1, ttl_seconds=STORE_INDEX_REFRESH_SECONDS)
+
+# Upper bound on the stores a cart recommendation restricted to lat/lon and
+# radius_km is optimized over
+CART_NEARBY_STORE_LIMIT = int(os.getenv("CART_NEARBY_STORE_LIMIT", "1000"))
+
+# How often the API checks data_versions for committed ETL batches and runs
+DATA_VERSION_POLL_SECONDS = float(os.getenv("DATA_VERSION_POLL_SECONDS", "15"))
+
+# Statements slower than this are captured and (sampled) explained in the
+# background; see /api/metrics/slow-queries. SLOW_QUERY_PERSIST=true also
+# writes them to the slow_queries table next to the ETLs' entries.
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+SLOW_QUERY_EXPLAIN_SAMPLE_RATE = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE_RATE", "1.0"))
+SLOW_QUERY_PERSIST = os.getenv("SLOW_QUERY_PERSIST", "false").lower() == "true"
+
+slow_query_log = SlowQueryLog(
+    source="api",
+    connect=lambda: db_pool.getconn(),
+    release=lambda conn: db_pool.putconn(conn),
+    threshold_ms=SLOW_QUERY_MS,
+    explain_sample_rate=SLOW_QUERY_EXPLAIN_SAMPLE_RATE,
+    persist=SLOW_QUERY_PERSIST,
+    context=request_timing.current_label,
+)
+
+db_pool = DatabasePool(
+    dsn_kwargs={
+        "dbname": DB_NAME, "user": DB_USER, "password": DB_PASSWORD,
+        "host": DB_HOST, "port": DB_PORT,
+    },
+    min_size=DB_POOL_MIN_SIZE,
+    max_size=DB_POOL_MAX_SIZE,
+    checkout_timeout=DB_POOL_CHECKOUT_TIMEOUT,
+    statement_timeout_ms=DB_STATEMENT_TIMEOUT_MS,
+    health_check_interval=DB_POOL_HEALTH_CHECK_INTERVAL,
+    cursor_factory=slow_query_log.cursor_factory(TimedCursor),
+    on_checkout=request_timing.record_checkout,
+)
+
+# In-memory indexes and caches refreshed whenever the ETLs bump the data version
+data_version_watcher = DataVersionWatcher(db_pool, poll_interval=DATA_VERSION_POLL_SECONDS)
+suggest_service = SuggestService(db_pool)
+deal_pool = DealPool(db_pool)
+product_pool = ProductPool(db_pool, refresh_seconds=PRODUCT_POOL_REFRESH_SECONDS)
+catalog_snapshots = CatalogSnapshots(
+    CATALOG_SNAPSHOT_DIR,
+    refresh_seconds=CATALOG_SNAPSHOT_REFRESH_SECONDS,
+    db_pool=db_pool,
+    publish_seconds=PRODUCT_POOL_REFRESH_SECONDS,
+)
+item_similarity = ItemSimilarity(ITEM_SIMILARITY_PATH, refresh_seconds=ITEM_SIMILARITY_REFRESH_SECONDS)
+store_index = StoreIndex(db_pool, refresh_seconds=STORE_INDEX_REFRESH_SECONDS)
+recommendation_candidates = CandidateRefresher(
+    db_pool,
+    compute=lambda db, user_id: compute_recommendation_candidates(db, user_id),  # Defined with the endpoint
+    settle_seconds=RECOMMENDATION_SETTLE_SECONDS,
+    max_age_seconds=RECOMMENDATION_CANDIDATE_MAX_AGE,
+)
+preference_queue = PreferenceQueue(
+    db_pool, flush_interval=PREFERENCE_FLUSH_SECONDS, on_flush=recommendation_candidates.mark_many
+)
+
+def clear_search_counts(version: int):
+    search_count_cache.clear()
+
+def clear_price_drops(version: int):
+    price_drops_cache.clear()
+
+def invalidate_cart_recommendations(version: int, barcodes):
+    # Cache keys start with the cart's sorted barcodes
+    cart_recommendation_cache.invalidate_where(version, lambda key: not barcodes.isdisjoint(key[0]))
+
+def invalidate_price_histories(version: int, barcodes):
+    # Cache keys are (barcode, bucket, buckets)
+    price_history_cache.invalidate_where(version, lambda key: key[0] in barcodes)
+
+data_version_watcher.subscribe(suggest_service.rebuild)
+data_version_watcher.subscribe(deal_pool.rebuild)
+if CATALOG_SNAPSHOT_DIR is None:
+    data_version_watcher.subscribe(product_pool.rebuild)  # Otherwise only built if no snapshot is mapped
+data_version_watcher.subscribe(catalog_snapshots.rebuild)
+data_version_watcher.subscribe(item_similarity.rebuild)
+data_version_watcher.subscribe(recommendation_candidates.on_run)
+data_version_watcher.subscribe(store_index.rebuild)
+data_version_watcher.subscribe(product_detail_cache.clear)
+data_version_watcher.subscribe(price_history_cache.clear)
+data_version_watcher.subscribe(clear_search_counts)
+data_version_watcher.subscribe(clear_price_drops)
+data_version_watcher.subscribe(cart_recommendation_cache.clear)
+data_version_watcher.subscribe(store_list_cache.clear)
+data_version_watcher.subscribe(entity_versions.on_run)
+data_version_watcher.subscribe_barcodes(product_detail_cache.invalidate)
+data_version_watcher.subscribe_barcodes(invalidate_cart_recommendations)
+data_version_watcher.subscribe_barcodes(invalidate_price_histories)
+data_version_watcher.subscribe_barcodes(entity_versions.on_barcodes)
+
 # --- FastAPI App Initialization ---
 app = FastAPI(
     title="PharmMate API",
@@ -54,6 +307,89 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# gzip or brotli, as the client accepts, for JSON bodies of at least this size
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MIN_BYTES)
+
+@app.on_event("startup")
+def open_db_pool():
+    db_pool.open()
+    data_version_watcher.start()
+    preference_queue.start()
+    recommendation_candidates.start()
+    slow_query_log.start()
+
+@app.on_event("shutdown")
+def close_db_pool():
+    data_version_watcher.stop()
+    preference_queue.stop()  # Flushes pending preference updates
+    recommendation_candidates.stop()  # Refreshes users still pending
+    slow_query_log.stop(timeout=5)
+    db_pool.close()
+
+# --- Request Timing ---
+# Every response carries a Server-Timing header (total, app, db, db-checkout)
+# and is logged as one JSON line on the "request_timing" logger; per-route
+# percentiles are served on /api/metrics.
+# An admin can also ask for one request to be profiled (see profiler.py).
+route_metrics = RouteMetrics()
+timing_logger = logging.getLogger("request_timing")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "2"))
+profile_store = ProfileStore(max_profiles=20)
+requests_in_flight = 0
+
+def profiling_requested(request: Request) -> bool:
+    if request.headers.get("x-profile") != "1" and request.query_params.get("_profile") != "1":
+        return False
+    return is_admin_token(request.headers.get("x-admin-token"))
+
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    global requests_in_flight
+    label = f"{request.method} {request.url.path}"
+    timing, token = request_timing.start_request(label)
+    profiler = None
+    if profiling_requested(request):
+        profiler = RequestProfiler(label, interval_ms=PROFILE_INTERVAL_MS, in_flight=lambda: requests_in_flight).start()
+    requests_in_flight += 1
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        requests_in_flight -= 1
+        if profiler is not None:
+            profile_store.add(profiler.stop())
+        total_ms = timing.elapsed_ms()
+        request_timing.finish_request(token)
+        route = request.scope.get("route")
+        # Unmatched paths share one bucket so scanners cannot grow the metrics
+        route_path = route.path if route is not None else "<unmatched>"
+        route_metrics.record(request.method, route_path, status_code, total_ms, timing)
+
+        slowest = timing.slowest_statement()
+        timing_logger.info(json.dumps({
+            "method": request.method,
+            "route": route_path,
+            "path": request.url.path,
+            "status": status_code,
+            "total_ms": round(total_ms, 2),
+            "db_ms": round(timing.db_ms, 2),
+            "db_checkout_ms": round(timing.db_checkout_ms, 2),
+            "queries": timing.queries,
+            "slowest_query_ms": round(slowest[0], 2) if slowest else None,
+            "slowest_query": " ".join(slowest[1].split())[:200] if slowest else None,
+        }))
+
+    response.headers["Server-Timing"] = timing.server_timing(total_ms)
+    if profiler is not None:
+        response.headers["X-Profile-Id"] = profiler.id
+    return response
+
+@app.exception_handler(PoolTimeoutError)
+def pool_timeout_handler(request: Request, exc: PoolTimeoutError):
+    return JSONResponse(status_code=503, content={"detail": "Database busy, please retry"})
+
 # --- Pydantic Models (Defines the JSON response structures) ---
 
 class PricePoint(BaseModel):
@@ -85,6 +421,14 @@ class ProductSearchResult(BaseModel):
         orm_mode = True
         allow_population_by_field_name = True
 
+class ProductBatchRequest(BaseModel):
+    barcodes: List[str] = Field(..., min_length=1, max_length=500)
+    store_ids: Optional[List[int]] = Field(None, min_length=1, max_length=500)  # Only prices from these stores
+
+class ProductBatchResponse(BaseModel):
+    products: List[ProductSearchResult]  # In request order
+    not_found: List[str]  # Unknown, inactive, or without prices (in the requested stores)
+
 class ProductSummary(BaseModel):
     """Simplified product model for list views with lowest price"""
     product_id: str
@@ -101,6 +445,16 @@ class PaginatedProductResponse(BaseModel):
     page_size: int
     total_pages: int
     results: List[ProductSummary]
+    next_cursor: Optional[str] = None  # Pass as ?cursor= to fetch the following page
+
+class SearchSuggestion(BaseModel):
+    text: str
+    type: str  # "product", "brand" or "category"
+    barcode: Optional[str] = None  # Set for product suggestions
+
+class SuggestResponse(BaseModel):
+    query: str
+    suggestions: List[SearchSuggestion]
 
 class NearbyStore(BaseModel):
     store_id: int
@@ -130,6 +484,39 @@ class StoreLocation(BaseModel):
     latitude: Optional[float] = None
     longitude: Optional[float] = None
 
+class PriceHistoryPoint(BaseModel):
+    bucket_start: date  # First day of the day/week/month
+    min_price: float
+    avg_price: float
+    max_price: float
+    observations: int  # Price rows (files x stores) in the bucket
+
+class RetailerPriceHistory(BaseModel):
+    retailer_id: int
+    retailer_name: str
+    points: List[PriceHistoryPoint]  # Oldest first; buckets without prices are omitted
+
+class PriceHistoryResponse(BaseModel):
+    barcode: str
+    bucket: str
+    buckets: int
+    retailers: List[RetailerPriceHistory]
+
+class PriceDrop(BaseModel):
+    product_id: str  # Barcode for navigation
+    barcode: str
+    name: str
+    brand: Optional[str] = None
+    image_url: Optional[str] = None
+    retailer_id: int
+    retailer_name: str
+    store_id: int
+    store_name: Optional[str] = None
+    old_price: float
+    new_price: float
+    drop_percent: float
+    changed_at: datetime  # Timestamp of the price file that lowered the price
+
 # --- Authentication Models ---
 
 class RegisterRequest(BaseModel):
@@ -157,11 +544,17 @@ class SyncRequest(BaseModel):
     favorites: List[str] = []
     cart: List[CartItem] = []
 
+class SyncItemResult(BaseModel):
+    barcode: str
+    status: str  # "added", "updated" (cart quantity increased), "already_exists" (favorite) or "not_found"
+
 class SyncResponse(BaseModel):
     status: str
     favorites_added: int
     cart_items_added: int
     message: str
+    favorites: List[SyncItemResult] = []  # One entry per requested favorite, in request order
+    cart: List[SyncItemResult] = []  # One entry per requested cart item, in request order
 
 class CartItemResponse(BaseModel):
     """Cart item with full product details and quantity"""
@@ -172,7 +565,14 @@ class CartItemResponse(BaseModel):
 
 class CartRecommendationRequest(BaseModel):
     """Request model for cart recommendation endpoint"""
-    barcodes: List[str]
+    barcodes: List[str] = Field(..., max_length=500)  # Repeat a barcode to buy more than one
+    max_stores: int = Field(3, ge=1, le=5)  # Most stores best_split may send the user to
+    trip_penalty: float = Field(0.0, ge=0)  # Added to best_split per store visited
+    retailer_ids: Optional[List[int]] = None  # Default: every chain with prices
+    store_ids: Optional[List[int]] = None
+    lat: Optional[float] = Field(None, ge=-90, le=90)  # With lon: only stores within radius_km
+    lon: Optional[float] = Field(None, ge=-180, le=180)
+    radius_km: float = Field(10.0, gt=0, le=200)
 
 class MissingProduct(BaseModel):
     """Product that is not available at a retailer"""
@@ -185,21 +585,64 @@ class RetailerRecommendation(BaseModel):
     total_price: float
     missing_products: List[MissingProduct]
 
+class BasketItem(BaseModel):
+    """One cart line priced at a store"""
+    barcode: str
+    name: str
+    quantity: int
+    price: float  # Unit price
+
+class StoreBasket(BaseModel):
+    """The part of a cart bought at one store"""
+    store_id: int
+    store_name: Optional[str] = None
+    retailer_name: str
+    address: Optional[str] = None
+    total_price: float
+    items: List[BasketItem]
+
+class StoreRecommendation(BaseModel):
+    """Cheapest single store for the whole cart"""
+    store: StoreBasket
+    missing_products: List[MissingProduct]
+
+class SplitRecommendation(BaseModel):
+    """Cheapest way to split the cart across at most max_stores stores"""
+    stores: List[StoreBasket]
+    total_price: float  # Products only
+    trip_penalty: float  # trip_penalty x stores visited
+    missing_products: List[MissingProduct]
+
 class CartRecommendationResponse(BaseModel):
     """Response model for cart recommendation endpoint"""
     recommendation: RetailerRecommendation
     alternatives: List[RetailerRecommendation]
+    best_store: Optional[StoreRecommendation] = None
+    best_split: Optional[SplitRecommendation] = None
 
 # --- Database Connection Dependency ---
 def get_db():
-    conn = psycopg2.connect(
-        dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT,
-        cursor_factory=RealDictCursor
-    )
+    """
+    Checks a connection out of the shared pool for the duration of the request.
+    Uncommitted work is rolled back when it is returned.
+    """
+    conn = db_pool.getconn()
+    cursor = conn.cursor()
+    try:
+        yield cursor
+    finally:
+        cursor.close()
+        db_pool.putconn(conn)
+
+@contextmanager
+def pooled_cursor():
+    """get_db for endpoints that only need the database on some paths (cache misses)."""
+    conn = db_pool.getconn()
     try:
-        yield conn.cursor()
+        with conn.cursor() as cursor:
+            yield cursor
     finally:
-        conn.close()
+        db_pool.putconn(conn)
 
 # --- Authentication Utilities ---
 def create_access_token(data: dict) -> str:
@@ -220,97 +663,78 @@ def verify_token(token: str) -> dict:
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Could not validate credentials")
 
-def get_current_user(authorization: Optional[str] = Header(None), db: RealDictCursor = Depends(get_db)) -> int:
+def user_exists(user_id: int) -> bool:
+    """
+    Whether user_id is a real user. Cached: only the first request of a user
+    (per AUTH_USER_CACHE_TTL) pays for the lookup, on its own pooled connection
+    so the dependency does not force a database checkout on every request.
+    """
+    if known_users_cache.get(user_id):
+        return True
+
+    conn = db_pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1 FROM users WHERE user_id = %s", (user_id,))
+            exists = cur.fetchone() is not None
+    finally:
+        db_pool.putconn(conn)
+
+    if exists:
+        known_users_cache.set(user_id, True)
+    return exists
+
+def get_current_user(authorization: Optional[str] = Header(None)) -> int:
     """
     Dependency to get the current authenticated user from JWT token.
     Returns user_id.
-    """
-    print(f"[AUTH DEBUG] Received authorization header: {authorization[:50] if authorization else 'None'}...")
 
+    The token's signature and expiry are trusted; the user's existence is
+    checked against the database at most once per AUTH_USER_CACHE_TTL.
+    """
     if not authorization:
-        print("[AUTH DEBUG] Authorization header is missing")
+        logger.debug("Authorization header is missing")
         raise HTTPException(status_code=401, detail="Authorization header missing")
 
     try:
         # Expected format: "Bearer <token>"
         scheme, token = authorization.split()
-        print(f"[AUTH DEBUG] Scheme: {scheme}, Token preview: {token[:20]}...")
-
-        if scheme.lower() != "bearer":
-            print(f"[AUTH DEBUG] Invalid scheme: {scheme}")
-            raise HTTPException(status_code=401, detail="Invalid authentication scheme")
-    except ValueError as e:
-        print(f"[AUTH DEBUG] Failed to split authorization header: {e}")
+    except ValueError:
+        logger.debug("Malformed authorization header")
         raise HTTPException(status_code=401, detail="Invalid authorization header format")
 
-    # Verify token
+    if scheme.lower() != "bearer":
+        logger.debug(f"Invalid authentication scheme: {scheme}")
+        raise HTTPException(status_code=401, detail="Invalid authentication scheme")
+
     try:
         payload = verify_token(token)
-        print(f"[AUTH DEBUG] Token verified successfully. Payload: {payload}")
     except HTTPException as e:
-        print(f"[AUTH DEBUG] Token verification failed: {e.detail}")
+        logger.debug(f"Token verification failed: {e.detail}")
         raise
 
     user_id = payload.get("user_id")
 
     if user_id is None:
-        print("[AUTH DEBUG] user_id not found in token payload")
+        logger.debug("user_id not found in token payload")
         raise HTTPException(status_code=401, detail="Invalid token payload")
 
-    # Verify user exists in database
-    db.execute("SELECT user_id FROM users WHERE user_id = %s", (user_id,))
-    user = db.fetchone()
-
-    if not user:
-        print(f"[AUTH DEBUG] User {user_id} not found in database")
+    if not user_exists(user_id):
+        logger.info(f"Token for unknown user_id {user_id} rejected")
         raise HTTPException(status_code=401, detail="User not found")
 
-    print(f"[AUTH DEBUG] Successfully authenticated user_id: {user_id}")
+    logger.debug(f"Authenticated user_id {user_id}")
     return user_id
 
-# --- Helper Functions for User Preferences ---
-def track_user_interaction(user_id: int, product_barcode: str, db: RealDictCursor):
-    """
-    Track user interaction and update user preferences based on product category and brand.
-    This function is called when a user adds a product to favorites or cart.
-    """
-    # Get product details
-    db.execute("""
-        SELECT category, brand
-        FROM canonical_products
-        WHERE barcode = %s AND is_active = true
-    """, (product_barcode,))
-
-    product = db.fetchone()
+def is_admin_token(token: Optional[str]) -> bool:
+    return bool(token) and any(hmac.compare_digest(token, admin_token) for admin_token in ADMIN_TOKENS)
 
-    if not product:
-        return  # Product not found or inactive
-
-    category = product.get('category')
-    brand = product.get('brand')
-
-    # Update category preference
-    if category:
-        db.execute("""
-            INSERT INTO user_preferences (user_id, preference_type, preference_value, interaction_score, last_updated)
-            VALUES (%s, 'category', %s, 1, NOW())
-            ON CONFLICT (user_id, preference_type, preference_value)
-            DO UPDATE SET
-                interaction_score = user_preferences.interaction_score + 1,
-                last_updated = NOW()
-        """, (user_id, category))
-
-    # Update brand preference
-    if brand:
-        db.execute("""
-            INSERT INTO user_preferences (user_id, preference_type, preference_value, interaction_score, last_updated)
-            VALUES (%s, 'brand', %s, 1, NOW())
-            ON CONFLICT (user_id, preference_type, preference_value)
-            DO UPDATE SET
-                interaction_score = user_preferences.interaction_score + 1,
-                last_updated = NOW()
-        """, (user_id, brand))
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Dependency for operator endpoints: X-Admin-Token must be one of ADMIN_TOKENS."""
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required")
 
+# --- Helper Functions ---
 def get_full_cart(user_id: int, db: RealDictCursor) -> List[dict]:
     """
     Helper function to fetch the user's complete cart with full product details.
@@ -353,14 +777,163 @@ def get_full_cart(user_id: int, db: RealDictCursor) -> List[dict]:
 
     return cart_items
 
+def product_detail_response(result: Optional[dict], not_found_detail: str) -> dict:
+    """
+    Shared post-processing for the product detail queries (sync and async paths).
+    Raises 404 when the product is missing or has no valid prices.
+    """
+    if not result:
+        raise HTTPException(status_code=404, detail=not_found_detail)
+
+    # Convert None prices and promotions to empty lists
+    if result['prices'] is None:
+        # If no valid prices, don't return the product
+        raise HTTPException(status_code=404, detail="Product has no valid prices available.")
+    if result['promotions'] is None:
+        result['promotions'] = []
+
+    return result
+
+def product_etag(barcode: str, *variant) -> Optional[str]:
+    """
+    ETag for a per-product response, or None before the data version is known.
+    `variant` tells responses apart: product details pass the promotion clock
+    period, price history its parameters.
+    """
+    version = entity_versions.version_of(barcode)
+    if version is None or not (barcode.isascii() and barcode.isalnum()):
+        return None
+    return weak_etag("product", barcode, version, *variant)
+
+def product_batch_response(barcodes: List[str], products_by_barcode: dict) -> ProductBatchResponse:
+    """Orders batch results like the request and lists the barcodes that had no product."""
+    products = []
+    not_found = []
+    for barcode in dict.fromkeys(barcodes):  # Drop duplicates, keep order
+        product = products_by_barcode.get(barcode)
+        if product is None:
+            not_found.append(barcode)
+        else:
+            products.append(product)
+    return ProductBatchResponse(products=products, not_found=not_found)
+
+def collect_batch_rows(rows: List[dict], products_by_barcode: dict, cache_version: Optional[int]):
+    """
+    Adds priced rows from PRODUCT_BATCH_QUERY to products_by_barcode. With a
+    cache_version (unfiltered lookups) they also fill the product detail cache.
+    """
+    for row in rows:
+        if row['prices'] is None:
+            continue
+        if row['promotions'] is None:
+            row['promotions'] = []
+        products_by_barcode[row['barcode']] = row
+        if cache_version is not None:
+            product_detail_cache.set(row['barcode'], row, cache_version)
+
+def encode_search_cursor(row: dict) -> str:
+    """Opaque keyset cursor holding the (score, name, barcode) of the last row on a page."""
+    payload = json.dumps([str(row['score']), row['name'], row['barcode']], ensure_ascii=False)
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+def decode_search_cursor(cursor: str) -> tuple:
+    try:
+        score, name, barcode = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return Decimal(score), name, barcode
+    except (ValueError, TypeError, InvalidOperation):
+        raise HTTPException(status_code=400, detail="Invalid search cursor")
+
+# Encoders for list endpoints that skip per-row Pydantic validation (see fast_json.py)
+product_summary_encoder = RowEncoder(ProductSummary)
+store_location_encoder = RowEncoder(StoreLocation)
+nearby_store_encoder = RowEncoder(NearbyStore)
+deal_encoder = RowEncoder(Deal)
+
+def search_page_response(page: int, page_size: int, total_results: int, rows: List[dict]) -> FastJSONResponse:
+    """Builds the /api/search response (PaginatedProductResponse), including the cursor for the next page."""
+    total_pages = (total_results + page_size - 1) // page_size  # Ceiling division
+    next_cursor = encode_search_cursor(rows[-1]) if len(rows) == page_size else None
+    return FastJSONResponse({
+        "total_results": total_results,
+        "page": page,
+        "page_size": page_size,
+        "total_pages": total_pages,
+        "results": product_summary_encoder.rows(rows),
+        "next_cursor": next_cursor,
+    })
+
 # --- API Endpoints ---
 
+@app.get("/api/metrics")
+def get_metrics():
+    """
+    Request latency per route since startup: total time, time in SQL and time
+    waiting for a pooled connection, each as p50/p95/p99/mean/max in ms.
+    """
+    return route_metrics.snapshot()
+
+@app.get("/api/metrics/slow-queries", dependencies=[Depends(require_admin)])
+def get_slow_queries(
+    limit: int = Query(50, ge=1, le=200),
+    flagged_only: bool = False
+):
+    """
+    Most recent statements slower than SLOW_QUERY_MS, newest first, with the
+    request that ran them and, once the background EXPLAIN has finished, the
+    plan and its flags (seq_scan:<table>, disk_sort:<method>, hash_spill:<n>_batches).
+    Requires X-Admin-Token, since captured parameters can include user data.
+    """
+    return slow_query_log.snapshot(limit=limit, flagged_only=flagged_only)
+
+@app.get("/api/metrics/profiles", dependencies=[Depends(require_admin)])
+def list_profiles():
+    """Recent request profiles, newest first, with their heaviest frames."""
+    return {"profiles": profile_store.summaries()}
+
+@app.get("/api/metrics/profiles/{profile_id}", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+def get_profile(profile_id: str):
+    """
+    One request profile as folded stacks, e.g.:
+        curl -H "X-Admin-Token: $TOKEN" .../api/metrics/profiles/<id> | flamegraph.pl > profile.svg
+    or load the file in https://www.speedscope.app.
+    """
+    profiler = profile_store.get(profile_id)
+    if profiler is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(profiler.folded())
+
 @app.get("/health")
 def health_check():
     """
     Health check endpoint to test backend connectivity.
+    Includes connection pool statistics.
     """
-    return {"status": "healthy", "timestamp": datetime.now().isoformat()}
+    health = {
+        "status": "healthy",
+        "timestamp": datetime.now().isoformat(),
+        "db_mode": API_DB_MODE,
+        "db_pool": db_pool.snapshot(),
+        "data_version": data_version_watcher.version,
+        "suggest_index": suggest_service.stats(),
+        "product_cache": product_detail_cache.stats(),
+        "cart_cache": dict(cart_recommendation_cache.stats(), single_flight=cart_recommendation_flights.stats()),
+        "etags": entity_versions.stats(),
+        "deal_pool": deal_pool.stats(),
+        "product_pool": product_pool.stats(),
+        "catalog_snapshot": catalog_snapshots.stats(),
+        "item_similarity": item_similarity.stats(),
+        "store_index": store_index.stats(),
+        "preference_queue": preference_queue.stats(),
+        "recommendation_candidates": recommendation_candidates.stats()
+    }
+    if async_db_pool is not None:
+        health["async_db_pool"] = {
+            "min_size": async_db_pool.get_min_size(),
+            "max_size": async_db_pool.get_max_size(),
+            "open_connections": async_db_pool.get_size(),
+            "idle_connections": async_db_pool.get_idle_size()
+        }
+    return health
 
 # --- Authentication Endpoints ---
 
@@ -409,6 +982,7 @@ def register_user(request: RegisterRequest, db: RealDictCursor = Depends(get_db)
 
         # Generate JWT token
         token = create_access_token({"user_id": user['user_id'], "username": user['username']})
+        known_users_cache.set(user['user_id'], True)
 
         return AuthResponse(
             access_token=token,
@@ -452,6 +1026,7 @@ def login_user(request: LoginRequest, db: RealDictCursor = Depends(get_db)):
 
         # Generate JWT token
         token = create_access_token({"user_id": user['user_id'], "username": user['username']})
+        known_users_cache.set(user['user_id'], True)
 
         return AuthResponse(
             access_token=token,
@@ -471,6 +1046,7 @@ def search_products(
     category: Optional[str] = None,
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
     db: RealDictCursor = Depends(get_db)
 ):
     """
@@ -482,12 +1058,19 @@ def search_products(
     - category: Optional exact category match (use Hebrew category strings)
     - page: Page number (default: 1)
     - page_size: Number of items per page (default: 20, max: 100)
+    - cursor: next_cursor from the previous response; takes precedence over page
+      and stays fast however deep you page
+
+    Text searches are ranked by relevance: exact match, then prefix, then
+    substring, then fuzzy (trigram) matches. Category-only searches are
+    ordered by name.
 
     Returns paginated results with metadata.
 
     Examples:
     - /api/search?q=shampoo - Text search, first page
     - /api/search?q=shampoo&page=2&page_size=10 - Text search, second page with 10 items
+    - /api/search?q=shampoo&cursor=<next_cursor> - Text search, page after the previous response
     - /api/search?category=טיפוח/הגנה מהשמש - Category filter
     - /api/search?q=cream&category=טיפוח/טיפוח פנים/קרם פנים - Combined filter
     """
@@ -502,348 +1085,309 @@ def search_products(
             results=[]
         )
 
-    # Build dynamic query based on parameters
-    query_conditions = [
-        "is_active = true",
-        "lowest_price IS NOT NULL",
-        "image_url IS NOT NULL",
-        "image_url NOT LIKE '%%placeholder%%'"
-    ]
-    count_params = []
-
-    # Add text search condition if q is provided
-    if q:
-        search_query = f"%{q}%"
-        query_conditions.append("(name ILIKE %s OR brand ILIKE %s)")
-        count_params.extend([search_query, search_query])
-
-    # Add category filter if category is provided
-    # Use LIKE for prefix matching to support hierarchical categories (e.g., "טיפוח/הגנה מהשמש")
-    if category:
-        query_conditions.append("category LIKE %s")
-        count_params.append(f"{category}%")
-
-    # Construct WHERE clause
-    where_clause = " AND ".join(query_conditions)
-
-    # Get total count
-    count_query = f"""
-        SELECT COUNT(*) as total
-        FROM canonical_products
-        WHERE {where_clause};
-    """
-    db.execute(count_query, tuple(count_params))
-    total_results = db.fetchone()['total']
+    after = decode_search_cursor(cursor) if cursor else None
+
+    # Get total count (cached per query, so later pages skip the count)
+    count_key = (q, category)
+    total_results = search_count_cache.get(count_key)
+    if total_results is None:
+        count_query, count_params = build_search_count_query(q, category)
+        db.execute(count_query, count_params)
+        total_results = db.fetchone()['total']
+        search_count_cache.set(count_key, total_results)
 
-    # Calculate pagination values
-    total_pages = (total_results + page_size - 1) // page_size  # Ceiling division
     offset = (page - 1) * page_size
+    query, query_params = build_search_page_query(q, category, page_size, offset, after)
+    db.execute(query, query_params)
 
-    # Build query parameters for main query
-    query_params = count_params.copy()
-    query_params.extend([page_size, offset])
+    return search_page_response(page, page_size, total_results, db.fetchall())
 
-    # Construct main query with pagination
-    query = f"""
-        SELECT
-            barcode as product_id,
-            barcode,
-            name,
-            brand,
-            COALESCE(image_url, 'https://via.placeholder.com/150?text=No+Image') as image_url,
-            lowest_price
-        FROM canonical_products
-        WHERE {where_clause}
-        ORDER BY name
-        LIMIT %s OFFSET %s;
+
+@app.get("/api/search/suggest", response_model=SuggestResponse, tags=["Products"])
+def search_suggest(q: str = "", limit: int = Query(8, ge=1, le=20)):
     """
+    Autocomplete for the search box, cheap enough to call on every keystroke.
 
-    db.execute(query, tuple(query_params))
-    results = db.fetchall()
+    Served from an in-memory prefix index over product names, brands and
+    category paths; it never queries the database. Matching ignores case,
+    niqqud, final letters and quotes (מ"ל, מ״ל and מל are equivalent), and
+    matches the start of any word. Suggestions are ranked by how many users
+    have the product in their cart or favorites.
 
-    return PaginatedProductResponse(
-        total_results=total_results,
-        page=page,
-        page_size=page_size,
-        total_pages=total_pages,
-        results=results
-    )
+    The index is rebuilt at startup and after every ETL run. Until the first
+    build finishes, the endpoint returns no suggestions.
+
+    Examples:
+    - /api/search/suggest?q=קר
+    - /api/search/suggest?q=nivea&limit=5
+    """
+    suggestions = suggest_service.suggest(q, limit)
+    return SuggestResponse(query=q, suggestions=suggestions)
 
 
 @app.get("/api/products/by-barcode/{barcode}", response_model=ProductSearchResult, tags=["Products"])
-def get_product_by_barcode(barcode: str, db: RealDictCursor = Depends(get_db)):
+def get_product_by_barcode(barcode: str, response: Response, if_none_match: Optional[str] = Header(None)):
     """
     Used by the barcode scanner for an exact product match.
     Returns a single product with full price comparison data.
-    Optimized with CTE and window function for fast performance.
-    """
-    query = """
-        WITH latest_prices AS (
-            SELECT
-                p.*,
-                ROW_NUMBER() OVER(
-                    PARTITION BY p.retailer_product_id, p.store_id
-                    ORDER BY p.price_timestamp DESC
-                ) as rn
-            FROM prices p
-            JOIN retailer_products rp ON p.retailer_product_id = rp.retailer_product_id
-            WHERE rp.barcode = %s
-              AND p.price > 0
-        )
-        SELECT
-            cp.barcode,
-            cp.name,
-            cp.brand,
-            cp.image_url,
-            (
-                SELECT json_agg(
-                    json_build_object(
-                        'retailer_id', r.retailerid,
-                        'retailer_name', r.retailername,
-                        'store_id', s.storeid,
-                        'store_name', s.storename,
-                        'store_address', s.address,
-                        'price', lp.price,
-                        'last_updated', lp.scraped_at,
-                        'in_stock', true
-                    ) ORDER BY lp.price ASC
-                )
-                FROM latest_prices lp
-                JOIN stores s ON lp.store_id = s.storeid
-                JOIN retailer_products rp ON lp.retailer_product_id = rp.retailer_product_id
-                JOIN retailers r ON s.retailerid = r.retailerid
-                WHERE lp.rn = 1
-                  AND s.isactive = true
-            ) as prices,
-            (
-                SELECT json_agg(
-                    json_build_object(
-                        'deal_id', prom.promotion_id,
-                        'title', prom.description,
-                        'description', prom.remarks,
-                        'retailer_name', r.retailername,
-                        'store_id', prom.store_id
-                    )
-                )
-                FROM promotions prom
-                JOIN promotion_product_links ppl ON prom.promotion_id = ppl.promotion_id
-                JOIN retailer_products rp ON ppl.retailer_product_id = rp.retailer_product_id
-                JOIN retailers r ON prom.retailer_id = r.retailerid
-                WHERE rp.barcode = cp.barcode
-                  AND (prom.end_date IS NULL OR prom.end_date >= NOW())
-            ) as promotions
-        FROM canonical_products cp
-        WHERE cp.barcode = %s
-          AND cp.is_active = true;
+    Latest prices are read from the current_prices table; responses are cached
+    until an ETL batch touching this barcode commits.
+    The ETag follows the data version that last changed the barcode; a matching
+    If-None-Match gets an empty 304 without touching the database.
     """
-    db.execute(query, (barcode, barcode))
-    result = db.fetchone()
-
-    if not result:
-        raise HTTPException(status_code=404, detail="Product not found for this barcode or is inactive.")
-
-    # Convert None prices and promotions to empty lists
-    if result['prices'] is None:
-        result['prices'] = []
-        # If no valid prices, don't return the product
-        raise HTTPException(status_code=404, detail="Product has no valid prices available.")
-    if result['promotions'] is None:
-        result['promotions'] = []
-
-    return result
+    etag = product_etag(barcode, promotion_clock.current())
+    if etag is not None and etag_matches(if_none_match, etag):
+        return not_modified(etag, CATALOG_CACHE_CONTROL)
+
+    product = product_detail_cache.get(barcode)
+    if product is None:
+        version = product_detail_cache.version
+        with pooled_cursor() as db:
+            db.execute(PRODUCT_DETAIL_QUERY, (barcode, barcode))
+            product = product_detail_response(db.fetchone(), "Product not found for this barcode or is inactive.")
+        product_detail_cache.set(barcode, product, version)
+
+    if etag is not None:
+        response.headers.update(cache_headers(etag, CATALOG_CACHE_CONTROL))
+    return product
 
 @app.get("/api/products/{product_id}", response_model=ProductSearchResult, tags=["Products"])
-def get_product_by_id(product_id: str, db: RealDictCursor = Depends(get_db)):
+def get_product_by_id(product_id: str, response: Response, if_none_match: Optional[str] = Header(None)):
     """
     Fetches all information about a single product using its barcode as the ID.
     Returns detailed price comparison data from all retailers.
-    Optimized with CTE and window function for fast performance.
+    Latest prices are read from the current_prices table; responses are cached
+    until an ETL batch touching this barcode commits.
+    The ETag follows the data version that last changed the barcode; a matching
+    If-None-Match gets an empty 304 without touching the database.
     """
-    query = """
-        WITH latest_prices AS (
-            SELECT
-                p.*,
-                ROW_NUMBER() OVER(
-                    PARTITION BY p.retailer_product_id, p.store_id
-                    ORDER BY p.price_timestamp DESC
-                ) as rn
-            FROM prices p
-            JOIN retailer_products rp ON p.retailer_product_id = rp.retailer_product_id
-            WHERE rp.barcode = %s
-              AND p.price > 0
+    etag = product_etag(product_id, promotion_clock.current())
+    if etag is not None and etag_matches(if_none_match, etag):
+        return not_modified(etag, CATALOG_CACHE_CONTROL)
+
+    product = product_detail_cache.get(product_id)
+    if product is None:
+        version = product_detail_cache.version
+        with pooled_cursor() as db:
+            db.execute(PRODUCT_DETAIL_QUERY, (product_id, product_id))
+            product = product_detail_response(db.fetchone(), "Product not found or is inactive.")
+        product_detail_cache.set(product_id, product, version)
+
+    if etag is not None:
+        response.headers.update(cache_headers(etag, CATALOG_CACHE_CONTROL))
+    return product
+
+@app.get("/api/products/{barcode}/history", response_model=PriceHistoryResponse, tags=["Products"])
+def get_price_history(
+    barcode: str,
+    response: Response,
+    bucket: str = "day",
+    buckets: Optional[int] = Query(None, ge=1),
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Price trend of a product: min/avg/max price per retailer per bucket.
+
+    Query parameters:
+    - bucket: day, week or month (calendar buckets in CATALOG_TIMEZONE)
+    - buckets: How many buckets back, the current one included (default
+      30 days / 26 weeks / 12 months; at most 90 / 104 / 60)
+
+    Aggregated in SQL, so the response has at most buckets points per retailer
+    however many price rows the ETLs stored. Unknown barcodes and products
+    without prices in the window get an empty retailers list. Cached and
+    ETagged like the product detail endpoints.
+    """
+    if bucket not in PRICE_HISTORY_MAX_BUCKETS:
+        raise HTTPException(status_code=400, detail="bucket must be day, week or month")
+    if buckets is None:
+        buckets = PRICE_HISTORY_DEFAULT_BUCKETS[bucket]
+    elif buckets > PRICE_HISTORY_MAX_BUCKETS[bucket]:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {PRICE_HISTORY_MAX_BUCKETS[bucket]} {bucket} buckets per request"
         )
-        SELECT
-            cp.barcode,
-            cp.name,
-            cp.brand,
-            cp.image_url,
-            (
-                SELECT json_agg(
-                    json_build_object(
-                        'retailer_id', r.retailerid,
-                        'retailer_name', r.retailername,
-                        'store_id', s.storeid,
-                        'store_name', s.storename,
-                        'store_address', s.address,
-                        'price', lp.price,
-                        'last_updated', lp.scraped_at,
-                        'in_stock', true
-                    ) ORDER BY lp.price ASC
-                )
-                FROM latest_prices lp
-                JOIN stores s ON lp.store_id = s.storeid
-                JOIN retailer_products rp ON lp.retailer_product_id = rp.retailer_product_id
-                JOIN retailers r ON s.retailerid = r.retailerid
-                WHERE lp.rn = 1
-                  AND s.isactive = true
-            ) as prices,
-            (
-                SELECT json_agg(
-                    json_build_object(
-                        'deal_id', prom.promotion_id,
-                        'title', prom.description,
-                        'description', prom.remarks,
-                        'retailer_name', r.retailername,
-                        'store_id', prom.store_id
-                    )
-                )
-                FROM promotions prom
-                JOIN promotion_product_links ppl ON prom.promotion_id = ppl.promotion_id
-                JOIN retailer_products rp ON ppl.retailer_product_id = rp.retailer_product_id
-                JOIN retailers r ON prom.retailer_id = r.retailerid
-                WHERE rp.barcode = cp.barcode
-                  AND (prom.end_date IS NULL OR prom.end_date >= NOW())
-            ) as promotions
-        FROM canonical_products cp
-        WHERE cp.barcode = %s
-          AND cp.is_active = true;
+
+    etag = product_etag(barcode, "history", bucket, buckets)
+    if etag is not None and etag_matches(if_none_match, etag):
+        return not_modified(etag, CATALOG_CACHE_CONTROL)
+
+    key = (barcode, bucket, buckets)
+    history = price_history_cache.get(key)
+    if history is None:
+        version = price_history_cache.version
+        with pooled_cursor() as db:
+            db.execute(PRICE_HISTORY_QUERY, price_history_params(barcode, bucket, buckets, CATALOG_TIMEZONE))
+            rows = db.fetchall()
+
+        retailers = {}
+        for row in rows:  # Ordered by retailer, then bucket
+            retailer = retailers.setdefault(row['retailer_id'], {
+                'retailer_id': row['retailer_id'],
+                'retailer_name': row['retailer_name'],
+                'points': [],
+            })
+            retailer['points'].append({
+                'bucket_start': row['bucket_start'],
+                'min_price': row['min_price'],
+                'avg_price': row['avg_price'],
+                'max_price': row['max_price'],
+                'observations': row['observations'],
+            })
+        history = {'barcode': barcode, 'bucket': bucket, 'buckets': buckets, 'retailers': list(retailers.values())}
+        price_history_cache.set(key, history, version)
+
+    if etag is not None:
+        response.headers.update(cache_headers(etag, CATALOG_CACHE_CONTROL))
+    return history
+
+@app.post("/api/products/batch", response_model=ProductBatchResponse, tags=["Products"])
+def get_products_batch(request: ProductBatchRequest, db: RealDictCursor = Depends(get_db)):
     """
-    db.execute(query, (product_id, product_id))
-    result = db.fetchone()
+    Full price comparisons for up to 500 barcodes in one request, for rendering
+    carts, favorites and scanned lists without one call per product.
 
-    if not result:
-        raise HTTPException(status_code=404, detail="Product not found or is inactive.")
+    Request body:
+    - barcodes: Barcodes to look up (duplicates are ignored)
+    - store_ids: Optional; only prices (and store-specific promotions) from these stores
 
-    # Convert None prices and promotions to empty lists
-    if result['prices'] is None:
-        result['prices'] = []
-        # If no valid prices, don't return the product
-        raise HTTPException(status_code=404, detail="Product has no valid prices available.")
-    if result['promotions'] is None:
-        result['promotions'] = []
+    Products come back in request order. Barcodes that are unknown, inactive or
+    have no prices (in the requested stores) are listed in not_found.
+    Without store_ids, products in the product detail cache are not re-queried.
+    """
+    products_by_barcode = {}
+    missing = list(dict.fromkeys(request.barcodes))
+    cache_version = None
 
-    return result
+    if request.store_ids is None:
+        promotion_clock.current()  # Clears the cache once promotions may have ended
+        cached = {barcode: product_detail_cache.get(barcode) for barcode in missing}
+        products_by_barcode.update({b: p for b, p in cached.items() if p is not None})
+        missing = [barcode for barcode in missing if cached[barcode] is None]
+        cache_version = product_detail_cache.version
+
+    if missing:
+        db.execute(PRODUCT_BATCH_QUERY, product_batch_params(missing, request.store_ids))
+        collect_batch_rows(db.fetchall(), products_by_barcode, cache_version)
+
+    return product_batch_response(request.barcodes, products_by_barcode)
 
 @app.get("/api/deals", response_model=List[Deal], tags=["Deals"])
-def get_all_deals(limit: Optional[int] = 50, retailer_id: Optional[int] = None, db: RealDictCursor = Depends(get_db)):
-    """Fetches a list of all currently active promotions with product information.
-
-    Optimized query using CTE to pre-filter random promotions before joining,
-    which dramatically improves performance by reducing the working set size.
-    """
-
-    # Build the WHERE clause for retailer filter
-    retailer_filter = ""
-    params = []
-    if retailer_id:
-        retailer_filter = "AND p.retailer_id = %s"
-        # For the random_promotions CTE filter
-        params.append(retailer_id)
-        # For the main query filter (used in CTE)
-        retailer_filter_cte = "AND retailer_id = %s"
-    else:
-        retailer_filter_cte = ""
-
-    # Fetch 2x the limit to ensure we have enough after filtering for active products
-    random_limit = limit * 2
-    params_cte = []
-    if retailer_id:
-        params_cte.append(retailer_id)
-    params_cte.append(random_limit)
-    params_cte.append(limit)
-
-    query = f"""
-        WITH random_promotions AS (
-            SELECT promotion_id
-            FROM promotions
-            WHERE (end_date IS NULL OR end_date >= NOW())
-              {retailer_filter_cte}
-            ORDER BY RANDOM()
-            LIMIT %s
-        ),
-        deals_with_products AS (
-            SELECT DISTINCT ON (cp.barcode)
-                p.promotion_id AS deal_id,
-                r.retailername AS retailer_name,
-                p.description AS title,
-                p.remarks AS description,
-                cp.barcode AS product_id,
-                cp.name AS product_name,
-                cp.brand AS product_brand,
-                cp.image_url AS product_image_url,
-                cp.lowest_price,
-                NULL::float AS original_price,
-                NULL::float AS discounted_price,
-                NULL AS image_url
-            FROM random_promotions rp
-            JOIN promotions p ON p.promotion_id = rp.promotion_id
-            JOIN retailers r ON p.retailer_id = r.retailerid
-            LEFT JOIN promotion_product_links ppl ON p.promotion_id = ppl.promotion_id
-            LEFT JOIN retailer_products rp2 ON ppl.retailer_product_id = rp2.retailer_product_id
-            LEFT JOIN canonical_products cp ON rp2.barcode = cp.barcode
-            WHERE cp.is_active = true
-              AND cp.barcode IS NOT NULL
-              AND cp.lowest_price IS NOT NULL
-            ORDER BY cp.barcode, p.promotion_id
-        )
-        SELECT * FROM deals_with_products
-        ORDER BY RANDOM()
-        LIMIT %s
+def get_all_deals(
+    limit: int = Query(50, ge=1, le=200),
+    retailer_id: Optional[int] = None,
+    if_none_match: Optional[str] = Header(None)
+):
+    """Fetches a random selection of currently active promotions with product information.
+
+    Deals are drawn uniformly from an in-memory pool (one deal per product) that
+    is rebuilt after every ETL run, so this endpoint does not query the database.
+    With retailer_id, only that retailer's promotions are sampled.
+
+    The ETag changes when the pool does (a rebuild or an expired promotion); a
+    client revalidating with If-None-Match gets a 304 and keeps its selection.
     """
+    deal_pool.ensure_ready()
+    etag = weak_etag("deals", deal_pool.content_tag(), retailer_id, limit)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag, CATALOG_CACHE_CONTROL)
+    return FastJSONResponse(
+        deal_encoder.rows(deal_pool.sample(limit, retailer_id)),
+        headers=cache_headers(etag, CATALOG_CACHE_CONTROL)
+    )
 
-    db.execute(query, tuple(params_cte))
-    results = db.fetchall()
+@app.get("/api/price-drops", response_model=List[PriceDrop], tags=["Deals"])
+def get_price_drops(
+    response: Response,
+    retailer_id: Optional[int] = None,
+    category: Optional[str] = None,
+    days: int = Query(1, ge=1, le=7),
+    limit: int = Query(20, ge=1, le=100)
+):
+    """
+    Biggest price drops today (or over the last `days` calendar days), by
+    percentage, one per product.
 
-    return results
+    Query parameters:
+    - retailer_id: Only this retailer's drops
+    - category: Category prefix, as in /api/search
+    - days: 1 is today (in CATALOG_TIMEZONE), up to 7
+    - limit: Number of products (1-100)
+
+    The ETLs record each drop in price_changes as they load prices, so this is
+    an indexed range read; drops since undone by a higher price are skipped.
+    """
+    key = (retailer_id, category, days, limit)
+    drops = price_drops_cache.get(key)
+    if drops is None:
+        with pooled_cursor() as db:
+            db.execute(PRICE_DROPS_QUERY, price_drops_params(days, CATALOG_TIMEZONE, retailer_id, category, limit))
+            drops = db.fetchall()
+        price_drops_cache.set(key, drops)
+
+    response.headers["Cache-Control"] = CATALOG_CACHE_CONTROL
+    return drops
 
 @app.get("/api/stores", response_model=List[StoreLocation], tags=["Stores"])
-def get_all_stores(db: RealDictCursor = Depends(get_db)):
-    """Returns a list of all stores with their geographic coordinates."""
-    query = """
-        SELECT
-            s.storeid AS store_id,
-            r.retailername AS retailer_name,
-            s.address,
-            s.latitude,
-            s.longitude
-        FROM stores s
-        JOIN retailers r ON s.retailerid = r.retailerid
-        WHERE s.isactive = true;
-    """
-    db.execute(query)
-    return db.fetchall()
+def get_all_stores(if_none_match: Optional[str] = Header(None)):
+    """
+    Returns a list of all stores with their geographic coordinates.
+
+    The encoded list is kept in memory (rebuilt after ETL runs and every
+    STORE_INDEX_REFRESH_SECONDS) with an ETag hashed from its content, so
+    revalidating with If-None-Match usually costs no query at all.
+    """
+    cached = store_list_cache.get("stores")
+    if cached is None:
+        version = store_list_cache.version
+        query = """
+            SELECT
+                s.storeid AS store_id,
+                r.retailername AS retailer_name,
+                s.address,
+                s.latitude,
+                s.longitude
+            FROM stores s
+            JOIN retailers r ON s.retailerid = r.retailerid
+            WHERE s.isactive = true;
+        """
+        with pooled_cursor() as db:
+            db.execute(query)
+            body = fast_json.dumps(store_location_encoder.rows(db.fetchall()))
+        cached = (content_etag("stores", body), body)
+        store_list_cache.set("stores", cached, version)
+
+    etag, body = cached
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag, STORES_CACHE_CONTROL)
+    return Response(body, media_type="application/json", headers=cache_headers(etag, STORES_CACHE_CONTROL))
 
 @app.get("/api/stores/nearby", response_model=List[NearbyStore], tags=["Stores"])
-def get_nearby_stores(lat: float, lon: float, limit: int = Query(5, ge=1, le=50), db: RealDictCursor = Depends(get_db)):
+def get_nearby_stores(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    limit: int = Query(5, ge=1, le=50),
+    retailer_id: Optional[int] = None,
+    radius_km: Optional[float] = Query(None, gt=0, le=200)
+):
     """
     Returns a list of the closest stores to the user's location.
+
+    Parameters:
+    - lat, lon: User's location
+    - limit: Maximum number of stores (default: 5, max: 50)
+    - retailer_id: Only this retailer's stores
+    - radius_km: Only stores within this distance; without it, the `limit`
+      nearest stores are returned however far away they are
+
+    Served from an in-memory spatial index, not the database.
+
+    Examples:
+    - /api/stores/nearby?lat=32.08&lon=34.78 - 5 nearest stores
+    - /api/stores/nearby?lat=32.08&lon=34.78&retailer_id=52&radius_km=3 - Super-Pharm stores within 3 km
     """
-    query = """
-        SELECT
-            s.storeid as store_id,
-            r.retailername as retailer_name,
-            s.storename as store_name,
-            s.address,
-            -- Haversine formula to calculate distance in Kilometers
-            (6371 * acos(cos(radians(%s)) * cos(radians(s.latitude)) * cos(radians(s.longitude) - radians(%s)) + sin(radians(%s)) * sin(radians(s.latitude)))) AS distance_km
-        FROM stores s
-        JOIN retailers r ON s.retailerid = r.retailerid
-        WHERE s.latitude IS NOT NULL AND s.longitude IS NOT NULL AND s.isactive = true
-        ORDER BY distance_km
-        LIMIT %s;
-    """
-    db.execute(query, (lat, lon, lat, limit))
-    return db.fetchall()
+    stores = store_index.nearby(lat, lon, limit, retailer_id=retailer_id, radius_km=radius_km)
+    return FastJSONResponse(nearby_store_encoder.rows(stores))
 
 # --- User Interaction Endpoints ---
 
@@ -859,7 +1403,11 @@ def add_to_favorites(
     """
     try:
         # Verify product exists
-        db.execute("SELECT barcode FROM canonical_products WHERE barcode = %s AND is_active = true", (product_barcode,))
+        db.execute("""
+            SELECT barcode, category, brand
+            FROM canonical_products
+            WHERE barcode = %s AND is_active = true
+        """, (product_barcode,))
         product = db.fetchone()
 
         if not product:
@@ -872,12 +1420,13 @@ def add_to_favorites(
             ON CONFLICT (user_id, product_barcode) DO NOTHING
         """, (user_id, product_barcode))
 
-        # Track interaction for preferences
-        track_user_interaction(user_id, product_barcode, db)
-
         # Commit transaction
         db.connection.commit()
 
+        # Track interaction for preferences (written behind the request)
+        preference_queue.record(user_id, product)
+        recommendation_candidates.mark(user_id)
+
         return {"status": "success", "message": "Product added to favorites"}
 
     except HTTPException:
@@ -901,7 +1450,11 @@ def add_to_cart(
     """
     try:
         # Verify product exists
-        db.execute("SELECT barcode FROM canonical_products WHERE barcode = %s AND is_active = true", (product_barcode,))
+        db.execute("""
+            SELECT barcode, category, brand
+            FROM canonical_products
+            WHERE barcode = %s AND is_active = true
+        """, (product_barcode,))
         product = db.fetchone()
 
         if not product:
@@ -915,12 +1468,13 @@ def add_to_cart(
             DO UPDATE SET quantity = user_cart.quantity + EXCLUDED.quantity, updated_at = NOW()
         """, (user_id, product_barcode, quantity))
 
-        # Track interaction for preferences
-        track_user_interaction(user_id, product_barcode, db)
-
         # Commit transaction
         db.connection.commit()
 
+        # Track interaction for preferences (written behind the request)
+        preference_queue.record(user_id, product)
+        recommendation_candidates.mark(user_id)
+
         # Return the full updated cart
         return get_full_cart(user_id, db)
 
@@ -1000,6 +1554,7 @@ def remove_from_favorites(
         """, (user_id, product_barcode))
 
         db.connection.commit()
+        recommendation_candidates.mark(user_id)
         return {"status": "success", "message": "Product removed from favorites"}
 
     except HTTPException:
@@ -1064,6 +1619,7 @@ def update_cart_item(
             """, (user_id, product_barcode))
 
             db.connection.commit()
+            recommendation_candidates.mark(user_id)
             # Return the full updated cart
             return get_full_cart(user_id, db)
 
@@ -1115,6 +1671,7 @@ def remove_from_cart(
         """, (user_id, product_barcode))
 
         db.connection.commit()
+        recommendation_candidates.mark(user_id)
         # Return the full updated cart
         return get_full_cart(user_id, db)
 
@@ -1126,158 +1683,148 @@ def remove_from_cart(
 
 # --- Recommendations Endpoint ---
 
-@app.get("/api/recommendations", response_model=List[ProductSummary], tags=["Recommendations"])
-def get_recommendations(
-    limit: int = Query(10, ge=1, le=50),
-    user_id: int = Depends(get_current_user),
-    db: RealDictCursor = Depends(get_db)
-):
+def preference_candidates(db: RealDictCursor, user_id: int, limit: int, exclude: List[str]) -> List[str]:
     """
-    Get personalized product recommendations for the authenticated user.
-    Protected endpoint - requires JWT authentication.
-
-    Returns products based on:
-    1. User's top 2-3 categories and top 2-3 brands (by interaction score)
-    2. Excludes products already in favorites or cart
-    3. Returns active products with valid prices
+    Barcodes of products in the user's top categories or brands, for users the
+    item similarity model has too little for. Empty if the user has no
+    preferences yet. Products in `exclude` are skipped.
     """
-
-    # Step 1: Get user's top preferences
     db.execute("""
         SELECT preference_type, preference_value, interaction_score
         FROM user_preferences
         WHERE user_id = %s
-        ORDER BY interaction_score DESC
+        ORDER BY interaction_score DESC, preference_value
     """, (user_id,))
 
     preferences = db.fetchall()
 
     if not preferences:
-        # User has no preferences yet, return popular products
-        query = """
-            SELECT
-                barcode as product_id,
-                barcode,
-                name,
-                brand,
-                COALESCE(image_url, 'https://via.placeholder.com/150?text=No+Image') as image_url,
-                lowest_price
-            FROM canonical_products
-            WHERE is_active = TRUE
-              AND lowest_price IS NOT NULL
-              AND image_url IS NOT NULL
-              AND image_url NOT LIKE '%%placeholder%%'
-            ORDER BY RANDOM()
-            LIMIT %s;
-        """
-        db.execute(query, (limit,))
-        results = db.fetchall()
-    else:
-        # Extract top categories and brands
-        top_categories = [p['preference_value'] for p in preferences if p['preference_type'] == 'category'][:3]
-        top_brands = [p['preference_value'] for p in preferences if p['preference_type'] == 'brand'][:3]
-
-        # Step 2: Get products user has already interacted with (to exclude)
-        db.execute("""
-            SELECT product_barcode FROM user_favorites WHERE user_id = %s
-            UNION
-            SELECT product_barcode FROM user_cart WHERE user_id = %s
-        """, (user_id, user_id))
-
-        interacted_barcodes = [row['product_barcode'] for row in db.fetchall()]
+        return []
+
+    # Top categories and brands, with the user's scores for ranking
+    categories = [p for p in preferences if p['preference_type'] == 'category'][:3]
+    brands = [p for p in preferences if p['preference_type'] == 'brand'][:3]
+    category_values = [p['preference_value'] for p in categories]
+    category_scores = [p['interaction_score'] for p in categories]
+    brand_values = [p['preference_value'] for p in brands]
+    brand_scores = [p['interaction_score'] for p in brands]
+
+    # Ranked by how much the user interacts with the product's category and
+    # brand, then cheapest first, then barcode, so the same preferences always
+    # give the same candidates
+    db.execute("""
+        SELECT cp.barcode
+        FROM canonical_products cp
+        WHERE cp.is_active = TRUE
+          AND (cp.category = ANY(%s::text[]) OR cp.brand = ANY(%s::text[]))
+          AND cp.barcode != ALL(%s)
+          AND cp.lowest_price IS NOT NULL
+          AND cp.image_url IS NOT NULL
+          AND cp.image_url NOT LIKE '%%placeholder%%'
+        ORDER BY
+          COALESCE((%s::float8[])[array_position(%s::text[], cp.category)], 0)
+            + COALESCE((%s::float8[])[array_position(%s::text[], cp.brand)], 0) DESC,
+          cp.lowest_price,
+          cp.barcode
+        LIMIT %s
+    """, (
+        category_values, brand_values, list(exclude),
+        category_scores, category_values, brand_scores, brand_values,
+        limit,
+    ))
+    return [row['barcode'] for row in db.fetchall()]
+
+def compute_recommendation_candidates(db: RealDictCursor, user_id: int) -> List[str]:
+    """
+    A user's ranked candidates for user_recommendation_candidates, computed in
+    the background by recommendation_candidates:
+    1. Products most often held together with the user's cart and favorites by
+       other users (item similarity model, built offline by
+       04_utilities/build_item_similarity.py), most similar first
+    2. Then products from the user's top 2-3 categories and top 2-3 brands
+       (by interaction score)
+    Products already in favorites or cart, inactive, unpriced or without an
+    image are left out.
+    """
+    db.execute("""
+        SELECT product_barcode FROM user_favorites WHERE user_id = %s
+        UNION
+        SELECT product_barcode FROM user_cart WHERE user_id = %s
+    """, (user_id, user_id))
 
-        # Step 3: Build recommendation query
-        category_condition = ""
-        brand_condition = ""
-        query_params = []
+    interacted_barcodes = [row['product_barcode'] for row in db.fetchall()]
 
-        if top_categories:
-            category_condition = "cp.category = ANY(%s)"
-            query_params.append(top_categories)
-        else:
-            category_condition = "TRUE"
-            # Don't append anything - TRUE doesn't need a parameter
+    barcodes = []
+    if interacted_barcodes:
+        candidates = item_similarity.recommend(
+            interacted_barcodes, interacted_barcodes, RECOMMENDATION_CANDIDATES * RECOMMENDATION_OVERFETCH
+        )
+        if candidates:
+            db.execute(RECOMMENDED_PRODUCTS_QUERY, (candidates,))
+            shown = {row['barcode'] for row in db.fetchall()}
+            barcodes = [barcode for barcode in candidates if barcode in shown][:RECOMMENDATION_CANDIDATES]
+
+    if len(barcodes) < RECOMMENDATION_CANDIDATES:
+        barcodes += preference_candidates(
+            db, user_id, RECOMMENDATION_CANDIDATES - len(barcodes), interacted_barcodes + barcodes
+        )
+    return barcodes
 
-        if top_brands:
-            brand_condition = "cp.brand = ANY(%s)"
-            query_params.append(top_brands)
-        else:
-            brand_condition = "TRUE"
-            # Don't append anything - TRUE doesn't need a parameter
+def popular_products(limit: int) -> List[dict]:
+    """Popularity-weighted picks from the catalog snapshot if one is mapped, else the product pool."""
+    snapshot = catalog_snapshots.current()
+    if snapshot is not None:
+        return snapshot.sample_popular(limit)
+    # With snapshots on, the pool is only a stopgap until one is mapped: build it
+    # in the background rather than while the caller holds a pooled connection
+    return product_pool.sample(limit, wait=CATALOG_SNAPSHOT_DIR is None)
 
-        # Add interacted_barcodes to params
-        if interacted_barcodes:
-            query_params.append(interacted_barcodes)
-        else:
-            query_params.append([])  # Empty array for NOT IN clause
+@app.get("/api/recommendations", response_model=List[ProductSummary], tags=["Recommendations"])
+def get_recommendations(
+    limit: int = Query(10, ge=1, le=50),
+    user_id: int = Depends(get_current_user),
+    db: RealDictCursor = Depends(get_db)
+):
+    """
+    Get personalized product recommendations for the authenticated user.
+    Protected endpoint - requires JWT authentication.
 
-        query_params.append(limit)
+    Returns the user's precomputed candidates (see compute_recommendation_candidates),
+    minus products now in their cart or favorites, in one primary-key read.
+    Candidates are recomputed in the background a few seconds after the user's
+    cart, favorites or preferences change, and after ETL runs.
+    Users without candidates yet (or with fewer than `limit`) get popular
+    products, also minus their cart and favorites.
+    """
+    db.execute(RECOMMENDATION_CANDIDATES_QUERY, (limit, user_id))
+    rows = db.fetchall()
 
-        query = f"""
-            SELECT
-                cp.barcode as product_id,
-                cp.barcode,
-                cp.name,
-                cp.brand,
-                COALESCE(cp.image_url, 'https://via.placeholder.com/150?text=No+Image') as image_url,
-                cp.lowest_price
-            FROM canonical_products cp
-            WHERE cp.is_active = TRUE
-              AND ({category_condition} OR {brand_condition})
-              AND cp.barcode != ALL(%s)
-              AND cp.lowest_price IS NOT NULL
-              AND cp.image_url IS NOT NULL
-              AND cp.image_url NOT LIKE '%%placeholder%%'
-            ORDER BY
-              -- Prioritize products with promotions
-              CASE WHEN EXISTS (
-                SELECT 1 FROM promotion_product_links ppl
-                JOIN retailer_products rp ON ppl.retailer_product_id = rp.retailer_product_id
-                WHERE rp.barcode = cp.barcode
-              ) THEN 0 ELSE 1 END,
-              -- Then by random for variety
-              RANDOM()
-            LIMIT %s;
-        """
+    if not rows or recommendation_candidates.is_stale(rows[0]['data_version'], rows[0]['age_seconds']):
+        recommendation_candidates.mark(user_id)
 
-        db.execute(query, tuple(query_params))
-        results = db.fetchall()
+    results = [row for row in rows if row['barcode'] is not None]
+    if len(results) < limit:
+        # Popular products do not know the user: skip what they already hold too
+        db.execute(USER_HELD_BARCODES_QUERY, (user_id, user_id))
+        skip = {row['product_barcode'] for row in db.fetchall()}
+        skip.update(product['barcode'] for product in results)
+        popular = popular_products(limit + len(skip))
+        results += [product for product in popular if product['barcode'] not in skip][:limit - len(results)]
 
     return results
 
 @app.get("/api/recommendations/popular", response_model=List[ProductSummary], tags=["Recommendations"])
-def get_popular_recommendations(
-    limit: int = Query(10, ge=1, le=50),
-    db: RealDictCursor = Depends(get_db)
-):
+def get_popular_recommendations(limit: int = Query(10, ge=1, le=50)):
     """
     Get popular product recommendations for anonymous users.
     Public endpoint - does NOT require authentication.
 
     Returns trending, popular products with their pre-calculated lowest prices.
+    Products are drawn from an in-memory pool (or the catalog snapshot), weighted
+    by how many users have them in their cart or favorites, so repeated calls
+    vary but favor what people actually buy.
     """
-
-    query = """
-        SELECT
-            barcode as product_id,
-            barcode,
-            name,
-            brand,
-            COALESCE(image_url, 'https://via.placeholder.com/150?text=No+Image') as image_url,
-            lowest_price
-        FROM canonical_products
-        WHERE is_active = TRUE
-          AND lowest_price IS NOT NULL
-          AND image_url IS NOT NULL
-          AND image_url NOT LIKE '%%placeholder%%'
-        ORDER BY RANDOM()
-        LIMIT %s;
-    """
-
-    db.execute(query, (limit,))
-    results = db.fetchall()
-
-    return results
+    return popular_products(limit)
 
 @app.post("/api/sync", response_model=SyncResponse, tags=["User Interactions"])
 def sync_anonymous_data(
@@ -1291,60 +1838,105 @@ def sync_anonymous_data(
 
     This is typically called when a user logs in for the first time
     and has local data that needs to be merged with their account.
+
+    Runs a fixed number of set-based statements however many items are
+    synced, and reports the outcome of every item.
     """
     try:
-        favorites_added = 0
-        cart_items_added = 0
+        requested = list(dict.fromkeys(request.favorites + [item.barcode for item in request.cart]))
+        if not requested:
+            return SyncResponse(
+                status="success",
+                favorites_added=0,
+                cart_items_added=0,
+                message="Successfully synced 0 favorites and 0 cart items"
+            )
 
-        # Sync favorites
+        # Validate every barcode at once
+        db.execute("""
+            SELECT barcode, category, brand
+            FROM canonical_products
+            WHERE barcode = ANY(%s) AND is_active = true
+        """, (requested,))
+        products = {row['barcode']: row for row in db.fetchall()}
+
+        interactions = []
+
+        # Sync favorites (duplicates in the request count once)
+        favorite_barcodes = [b for b in dict.fromkeys(request.favorites) if b in products]
+        added_favorites = set()
+        if favorite_barcodes:
+            db.execute("""
+                INSERT INTO user_favorites (user_id, product_barcode)
+                SELECT %s, unnest(%s::text[])
+                ON CONFLICT (user_id, product_barcode) DO NOTHING
+                RETURNING product_barcode
+            """, (user_id, favorite_barcodes))
+            added_favorites = {row['product_barcode'] for row in db.fetchall()}
+            interactions.extend(products[b] for b in favorite_barcodes if b in added_favorites)
+
+        favorite_results = []
+        seen_favorites = set()
         for barcode in request.favorites:
-            # Verify product exists
-            db.execute("SELECT barcode FROM canonical_products WHERE barcode = %s AND is_active = true", (barcode,))
-            product = db.fetchone()
-
-            if product:
-                # Add to favorites (ignore if already exists)
-                db.execute("""
-                    INSERT INTO user_favorites (user_id, product_barcode)
-                    VALUES (%s, %s)
-                    ON CONFLICT (user_id, product_barcode) DO NOTHING
-                    RETURNING favorite_id
-                """, (user_id, barcode))
-
-                if db.fetchone():
-                    favorites_added += 1
-                    # Track interaction for preferences
-                    track_user_interaction(user_id, barcode, db)
-
-        # Sync cart items
+            if barcode not in products:
+                status = "not_found"
+            elif barcode in added_favorites and barcode not in seen_favorites:
+                status = "added"
+            else:
+                status = "already_exists"
+            seen_favorites.add(barcode)
+            favorite_results.append(SyncItemResult(barcode=barcode, status=status))
+
+        # Sync cart items: quantities for the same barcode are summed, as repeated
+        # single upserts would have done
+        cart_quantities = {}
+        for item in request.cart:
+            if item.barcode in products:
+                cart_quantities[item.barcode] = cart_quantities.get(item.barcode, 0) + item.quantity
+
+        inserted_cart = {}
+        if cart_quantities:
+            db.execute("""
+                INSERT INTO user_cart (user_id, product_barcode, quantity)
+                SELECT %s, item.barcode, item.quantity
+                FROM unnest(%s::text[], %s::int[]) AS item(barcode, quantity)
+                ON CONFLICT (user_id, product_barcode)
+                DO UPDATE SET quantity = user_cart.quantity + EXCLUDED.quantity, updated_at = NOW()
+                RETURNING product_barcode, (xmax = 0) AS inserted
+            """, (user_id, list(cart_quantities), list(cart_quantities.values())))
+            inserted_cart = {row['product_barcode']: row['inserted'] for row in db.fetchall()}
+
+        cart_results = []
+        seen_cart = set()
         for item in request.cart:
-            # Verify product exists
-            db.execute("SELECT barcode FROM canonical_products WHERE barcode = %s AND is_active = true", (item.barcode,))
-            product = db.fetchone()
-
-            if product:
-                # Add to cart or update quantity
-                db.execute("""
-                    INSERT INTO user_cart (user_id, product_barcode, quantity)
-                    VALUES (%s, %s, %s)
-                    ON CONFLICT (user_id, product_barcode)
-                    DO UPDATE SET quantity = user_cart.quantity + EXCLUDED.quantity, updated_at = NOW()
-                    RETURNING cart_id
-                """, (user_id, item.barcode, item.quantity))
-
-                if db.fetchone():
-                    cart_items_added += 1
-                    # Track interaction for preferences
-                    track_user_interaction(user_id, item.barcode, db)
+            if item.barcode not in products:
+                status = "not_found"
+            elif inserted_cart.get(item.barcode) and item.barcode not in seen_cart:
+                status = "added"
+            else:
+                status = "updated"
+            seen_cart.add(item.barcode)
+            cart_results.append(SyncItemResult(barcode=item.barcode, status=status))
+            if item.barcode in products:
+                interactions.append(products[item.barcode])
 
         # Commit transaction
         db.connection.commit()
 
+        # Track interactions for preferences (written behind the request)
+        preference_queue.record_many(user_id, interactions)
+        recommendation_candidates.mark(user_id)
+
+        favorites_added = len(added_favorites)
+        cart_items_added = sum(1 for result in cart_results if result.status != "not_found")
+
         return SyncResponse(
             status="success",
             favorites_added=favorites_added,
             cart_items_added=cart_items_added,
-            message=f"Successfully synced {favorites_added} favorites and {cart_items_added} cart items"
+            message=f"Successfully synced {favorites_added} favorites and {cart_items_added} cart items",
+            favorites=favorite_results,
+            cart=cart_results
         )
 
     except HTTPException:
@@ -1353,195 +1945,402 @@ def sync_anonymous_data(
         db.connection.rollback()
         raise HTTPException(status_code=500, detail=f"Sync failed: {str(e)}")
 
+def missing_product_list(optimizer: BasketOptimizer, item_indexes: List[int], product_names: dict) -> List[MissingProduct]:
+    return [
+        MissingProduct(barcode=optimizer.barcodes[i], name=product_names.get(optimizer.barcodes[i], "Unknown Product"))
+        for i in item_indexes
+    ]
+
+def store_basket(
+    optimizer: BasketOptimizer,
+    store_id: int,
+    retailer_id: int,
+    item_indexes: List[int],
+    item_prices,
+    product_names: dict,
+    retailer_names: dict,
+    stores: dict,
+) -> StoreBasket:
+    """StoreBasket for the given cart items bought at one store at item_prices (indexed by item)."""
+    items = [
+        BasketItem(
+            barcode=optimizer.barcodes[i],
+            name=product_names.get(optimizer.barcodes[i], "Unknown Product"),
+            quantity=int(optimizer.quantities[i]),
+            price=round(float(item_prices[i]), 2),
+        )
+        for i in item_indexes
+    ]
+    store = stores.get(store_id, {})
+    return StoreBasket(
+        store_id=store_id,
+        store_name=store.get('storename'),
+        retailer_name=retailer_names.get(retailer_id, f"Retailer {retailer_id}"),
+        address=store.get('address'),
+        total_price=round(sum(item.price * item.quantity for item in items), 2),
+        items=items,
+    )
+
+def cart_recommendation_key(request: CartRecommendationRequest) -> tuple:
+    """
+    Cache key for a cart recommendation: the cart as sorted barcodes with
+    their quantities, plus everything else that changes the answer.
+    """
+    quantities = {}
+    for barcode in request.barcodes:
+        quantities[barcode] = quantities.get(barcode, 0) + 1
+    barcodes = tuple(sorted(quantities))
+    nearby = (request.lat, request.lon, request.radius_km) if request.lat is not None else None
+    return (
+        barcodes,
+        tuple(quantities[b] for b in barcodes),
+        tuple(sorted(set(request.retailer_ids))) if request.retailer_ids else None,
+        tuple(sorted(set(request.store_ids))) if request.store_ids is not None else None,
+        nearby,
+        request.max_stores,
+        request.trip_penalty,
+    )
+
+def build_cart_recommendation(request: CartRecommendationRequest, db: RealDictCursor) -> CartRecommendationResponse:
+    """Compute a cart recommendation; products are listed in barcode order."""
+    quantities = {}
+    for barcode in request.barcodes:
+        quantities[barcode] = quantities.get(barcode, 0) + 1
+    barcodes = sorted(quantities)
+
+    # Step 1: Get all product names for the barcodes (for missing product info)
+    db.execute("""
+        SELECT barcode, name
+        FROM canonical_products
+        WHERE barcode = ANY(%s)
+          AND is_active = true
+    """, (barcodes,))
+    product_names = {row['barcode']: row['name'] for row in db.fetchall()}
+
+    # Check if any products were not found
+    missing_from_db = [b for b in barcodes if b not in product_names]
+    if missing_from_db:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Products not found in database: {', '.join(missing_from_db)}"
+        )
+
+    # Step 2: Narrow the stores to those near the user, if asked to
+    store_ids = request.store_ids
+    if request.lat is not None:
+        nearby = store_index.nearby(
+            request.lat, request.lon, limit=CART_NEARBY_STORE_LIMIT, radius_km=request.radius_km
+        )
+        allowed_stores = set(store_ids) if store_ids is not None else None
+        store_ids = [
+            store['store_id'] for store in nearby
+            if (not request.retailer_ids or store['retailer_id'] in request.retailer_ids)
+            and (allowed_stores is None or store['store_id'] in allowed_stores)
+        ]
+        if not store_ids:
+            raise HTTPException(
+                status_code=404,
+                detail=f"No stores found within {request.radius_km} km"
+            )
+
+    # Step 3: Current prices per store in scope, straight into the optimizer
+    db.execute(CART_STORE_PRICES_QUERY, cart_store_prices_params(barcodes, request.retailer_ids, store_ids))
+    optimizer = BasketOptimizer(barcodes, [quantities[b] for b in barcodes], db.fetchall())
+    if not optimizer.store_count:
+        raise HTTPException(
+            status_code=404,
+            detail="No price data available for the requested products"
+        )
+
+    retailer_ids = request.retailer_ids or sorted(set(optimizer.store_retailers.tolist()))
+    chain_baskets = optimizer.chain_baskets(retailer_ids)
+    best_store = optimizer.best_store()
+    best_split = optimizer.best_split(request.max_stores, request.trip_penalty)
+
+    # Step 4: Names for the retailers and stores in the answer
+    db.execute(
+        "SELECT retailerid, retailername FROM retailers WHERE retailerid = ANY(%s)",
+        (list(retailer_ids),)
+    )
+    retailer_names = {row['retailerid']: row['retailername'] for row in db.fetchall()}
+    chosen_stores = {best_store['store_id']} | {store['store_id'] for store in best_split['stores']}
+    db.execute(
+        "SELECT storeid, storename, address FROM stores WHERE storeid = ANY(%s)",
+        (list(chosen_stores),)
+    )
+    stores = {row['storeid']: row for row in db.fetchall()}
+
+    # Step 5: Chains - fewest missing products first, then lowest price
+    chain_results = [
+        RetailerRecommendation(
+            retailer_name=retailer_names.get(retailer_id, f"Retailer {retailer_id}"),
+            total_price=basket['total_price'],
+            missing_products=missing_product_list(optimizer, basket['missing'], product_names)
+        )
+        for retailer_id, basket in chain_baskets.items()
+    ]
+    chain_results.sort(key=lambda r: (len(r.missing_products), r.total_price))
+
+    return CartRecommendationResponse(
+        recommendation=chain_results[0],
+        alternatives=chain_results[1:],
+        best_store=StoreRecommendation(
+            store=store_basket(
+                optimizer, best_store['store_id'], best_store['retailer_id'], best_store['items'],
+                best_store['prices'], product_names, retailer_names, stores
+            ),
+            missing_products=missing_product_list(optimizer, best_store['missing'], product_names)
+        ),
+        best_split=SplitRecommendation(
+            stores=[
+                store_basket(
+                    optimizer, store['store_id'], store['retailer_id'], store['items'],
+                    best_split['prices'], product_names, retailer_names, stores
+                )
+                for store in best_split['stores']
+            ],
+            total_price=best_split['total_price'],
+            trip_penalty=best_split['trip_penalty'],
+            missing_products=missing_product_list(optimizer, best_split['missing'], product_names)
+        ),
+    )
+
+def compute_cart_recommendation(request: CartRecommendationRequest, key: tuple) -> CartRecommendationResponse:
+    """Cache miss path, on its own pooled connection (waiting callers hold none)."""
+    version = cart_recommendation_cache.version
+    with pooled_cursor() as db:
+        response = build_cart_recommendation(request, db)
+    cart_recommendation_cache.set(key, response, version)
+    return response
+
 @app.post("/api/cart/recommendation", response_model=CartRecommendationResponse, tags=["Cart"])
-def get_cart_recommendation(
-    request: CartRecommendationRequest,
-    db: RealDictCursor = Depends(get_db)
-):
+def get_cart_recommendation(request: CartRecommendationRequest):
     """
-    Analyze a shopping cart and recommend the cheapest retailer for the entire purchase.
+    Analyze a shopping cart and recommend where to buy it.
 
-    This endpoint compares prices across major retailers (Super-Pharm, Be Pharm, Good Pharm)
-    and returns the retailer with the lowest total price that has all products in stock.
+    Current prices at every store in scope are loaded in one query and handed to
+    basket_optimizer, which answers three questions:
+    - recommendation / alternatives: the cheapest chain for the whole cart, each
+      product priced at the chain's cheapest store in scope
+    - best_store: the cheapest single store
+    - best_split: the cheapest way to split the cart across at most max_stores
+      stores, counting trip_penalty for every store visited
 
     Request body:
     {
-        "barcodes": ["7290019075271", "3600522251750", "7290014775510"]
+        "barcodes": ["7290019075271", "3600522251750", "7290014775510"],
+        "max_stores": 2,
+        "trip_penalty": 5.0,
+        "retailer_ids": [52, 97],
+        "lat": 32.0853, "lon": 34.7818, "radius_km": 5
     }
 
-    Response includes:
-    - recommendation: The cheapest retailer with all products available
-    - alternatives: Other retailers with their totals and missing products
+    Only barcodes is required; repeating a barcode buys it more than once.
+    Options covering more of the cart always win over cheaper ones covering less.
+
+    Results are cached per cart (in any order) and scope until an ETL batch
+    touches one of its products, and identical requests arriving while one is
+    being computed wait for it instead of querying again.
     """
 
     try:
         # Validate input
         if not request.barcodes or len(request.barcodes) == 0:
             raise HTTPException(status_code=400, detail="Barcodes list cannot be empty")
+        if (request.lat is None) != (request.lon is None):
+            raise HTTPException(status_code=400, detail="lat and lon must be given together")
 
-        # Define major retailers to compare (Super-Pharm, Good Pharm, Be Pharm)
-        MAJOR_RETAILERS = [52, 97, 150]  # Super-Pharm, Good Pharm, Be Pharm
+        key = cart_recommendation_key(request)
+        cached = cart_recommendation_cache.get(key)
+        if cached is not None:
+            return cached
 
-        # Step 1: Get all product names for the barcodes (for missing product info)
-        product_names = {}
-        placeholders = ','.join(['%s'] * len(request.barcodes))
-        db.execute(f"""
-            SELECT barcode, name
-            FROM canonical_products
-            WHERE barcode IN ({placeholders})
-              AND is_active = true
-        """, tuple(request.barcodes))
+        return cart_recommendation_flights.do(key, lambda: compute_cart_recommendation(request, key))
 
-        for row in db.fetchall():
-            product_names[row['barcode']] = row['name']
+    except HTTPException:
+        raise
+    except PoolTimeoutError:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Cart recommendation failed: {str(e)}")
 
-        # Check if any products were not found
-        missing_from_db = [b for b in request.barcodes if b not in product_names]
-        if missing_from_db:
-            raise HTTPException(
-                status_code=404,
-                detail=f"Products not found in database: {', '.join(missing_from_db)}"
-            )
+# --- Async Request Path ---
+# With API_DB_MODE=async the hottest read endpoints run as `async def` on an
+# asyncpg pool instead of psycopg2 on Starlette's threadpool. They execute the
+# same SQL (from queries.py) and return the same models, so the two modes can
+# be A/B tested by flipping the environment variable.
+
+async_db_pool = None
 
-        # Step 2: Fetch all latest prices for all barcodes across all major retailers
-        # Optimized query using CTE with window function to avoid N+1 correlated subquery
-        # This eliminates the performance bottleneck of executing a subquery for each row
-        query = f"""
-            WITH latest_prices_by_retailer AS (
-                SELECT
-                    rp.barcode,
-                    r.retailerid,
-                    r.retailername,
-                    p.price,
-                    ROW_NUMBER() OVER (
-                        PARTITION BY rp.retailer_product_id
-                        ORDER BY p.price_timestamp DESC
-                    ) as rn
-                FROM retailer_products rp
-                JOIN retailers r ON rp.retailer_id = r.retailerid
-                JOIN prices p ON rp.retailer_product_id = p.retailer_product_id
-                WHERE rp.barcode IN ({placeholders})
-                  AND r.retailerid = ANY(%s)
-                  AND p.price > 0
+async def open_async_db_pool():
+    global async_db_pool
+    import asyncpg  # Only required when the async path is enabled
+
+    async def init_connection(conn):
+        # Match psycopg2, which decodes json/json_agg columns into Python objects
+        for json_type in ("json", "jsonb"):
+            await conn.set_type_codec(
+                json_type, encoder=json.dumps, decoder=json.loads, schema="pg_catalog"
             )
-            SELECT barcode, retailerid, retailername, price
-            FROM latest_prices_by_retailer
-            WHERE rn = 1
-            ORDER BY barcode, retailerid, price ASC
-        """
 
-        db.execute(query, tuple(request.barcodes) + (MAJOR_RETAILERS,))
-        all_prices = db.fetchall()
-
-        # Step 3: Organize prices by retailer and barcode
-        # Structure: {retailer_id: {retailer_name: str, prices: {barcode: price}}}
-        retailer_data = {}
-        for retailer_id in MAJOR_RETAILERS:
-            retailer_data[retailer_id] = {
-                'retailer_name': None,
-                'prices': {}
-            }
-
-        for row in all_prices:
-            retailer_id = row['retailerid']
-            barcode = row['barcode']
-            price = float(row['price'])
-            retailer_name = row['retailername']
-
-            if retailer_id in retailer_data:
-                retailer_data[retailer_id]['retailer_name'] = retailer_name
-                # Keep only the lowest price if there are multiple stores
-                if barcode not in retailer_data[retailer_id]['prices']:
-                    retailer_data[retailer_id]['prices'][barcode] = price
-                else:
-                    retailer_data[retailer_id]['prices'][barcode] = min(
-                        retailer_data[retailer_id]['prices'][barcode],
-                        price
-                    )
-
-        # Step 4: Calculate totals and identify missing products for each retailer
-        retailer_results = []
-
-        for retailer_id, data in retailer_data.items():
-            retailer_name = data['retailer_name']
-
-            # Get retailer name from database if not found in prices
-            if not retailer_name:
-                db.execute("SELECT retailername FROM retailers WHERE retailerid = %s", (retailer_id,))
-                result = db.fetchone()
-                retailer_name = result['retailername'] if result else f"Retailer {retailer_id}"
-
-            total_price = 0.0
-            missing_products = []
-
-            for barcode in request.barcodes:
-                if barcode in data['prices']:
-                    total_price += data['prices'][barcode]
-                else:
-                    # Product is missing at this retailer
-                    missing_products.append(MissingProduct(
-                        barcode=barcode,
-                        name=product_names.get(barcode, "Unknown Product")
-                    ))
-
-            retailer_results.append({
-                'retailer_name': retailer_name,
-                'total_price': round(total_price, 2),
-                'missing_products': missing_products,
-                'has_all_products': len(missing_products) == 0
-            })
+    server_settings = {}
+    if DB_STATEMENT_TIMEOUT_MS:
+        server_settings["statement_timeout"] = str(DB_STATEMENT_TIMEOUT_MS)
 
-        # Step 5: Sort retailers - first by availability (all products), then by price
-        retailer_results.sort(key=lambda x: (not x['has_all_products'], x['total_price']))
+    async_db_pool = await asyncpg.create_pool(
+        database=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        server_settings=server_settings,
+        init=init_connection
+    )
 
-        # Step 6: Determine recommendation and alternatives
-        recommendation = None
-        alternatives = []
+async def close_async_db_pool():
+    if async_db_pool is not None:
+        await async_db_pool.close()
 
-        for result in retailer_results:
-            retailer_rec = RetailerRecommendation(
-                retailer_name=result['retailer_name'],
-                total_price=result['total_price'],
-                missing_products=result['missing_products']
-            )
+@asynccontextmanager
+async def async_pooled_connection():
+    """Checks a connection out of the asyncpg pool for the duration of the block."""
+    try:
+        conn = await async_db_pool.acquire(timeout=DB_POOL_CHECKOUT_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise PoolTimeoutError(
+            f"No database connection available within {DB_POOL_CHECKOUT_TIMEOUT}s"
+        )
+    try:
+        yield conn
+    finally:
+        await async_db_pool.release(conn)
 
-            # The first retailer with all products is the recommendation
-            if recommendation is None and result['has_all_products']:
-                recommendation = retailer_rec
-            else:
-                alternatives.append(retailer_rec)
-
-        # If no retailer has all products, recommend the one with fewest missing items and lowest price
-        if recommendation is None:
-            if retailer_results:
-                recommendation = RetailerRecommendation(
-                    retailer_name=retailer_results[0]['retailer_name'],
-                    total_price=retailer_results[0]['total_price'],
-                    missing_products=retailer_results[0]['missing_products']
-                )
-                alternatives = [
-                    RetailerRecommendation(
-                        retailer_name=r['retailer_name'],
-                        total_price=r['total_price'],
-                        missing_products=r['missing_products']
-                    )
-                    for r in retailer_results[1:]
-                ]
-            else:
-                raise HTTPException(
-                    status_code=404,
-                    detail="No price data available for the requested products"
-                )
+async def get_async_db():
+    """Checks a connection out of the asyncpg pool for the duration of the request."""
+    async with async_pooled_connection() as conn:
+        yield conn
+
+ASYNC_PRODUCT_DETAIL_QUERY = to_asyncpg_sql(PRODUCT_DETAIL_QUERY)
+ASYNC_PRODUCT_BATCH_QUERY = to_asyncpg_sql(PRODUCT_BATCH_QUERY)
 
-        return CartRecommendationResponse(
-            recommendation=recommendation,
-            alternatives=alternatives
+async def search_products_async(
+    q: Optional[str] = None,
+    category: Optional[str] = None,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db=Depends(get_async_db)
+):
+    """Async twin of search_products."""
+    if not q and not category:
+        return PaginatedProductResponse(
+            total_results=0,
+            page=page,
+            page_size=page_size,
+            total_pages=0,
+            results=[]
         )
 
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Cart recommendation failed: {str(e)}")
+    after = decode_search_cursor(cursor) if cursor else None
+
+    count_key = (q, category)
+    total_results = search_count_cache.get(count_key)
+    if total_results is None:
+        count_query, count_params = build_search_count_query(q, category)
+        total_results = await db.fetchval(to_asyncpg_sql(count_query), *count_params)
+        search_count_cache.set(count_key, total_results)
+
+    offset = (page - 1) * page_size
+    query, query_params = build_search_page_query(q, category, page_size, offset, after)
+    rows = await db.fetch(to_asyncpg_sql(query), *query_params)
+
+    return search_page_response(page, page_size, total_results, [dict(row) for row in rows])
+
+async def get_product_by_barcode_async(barcode: str, response: Response, if_none_match: Optional[str] = Header(None)):
+    """Async twin of get_product_by_barcode."""
+    etag = product_etag(barcode, promotion_clock.current())
+    if etag is not None and etag_matches(if_none_match, etag):
+        return not_modified(etag, CATALOG_CACHE_CONTROL)
+
+    product = product_detail_cache.get(barcode)
+    if product is None:
+        version = product_detail_cache.version
+        async with async_pooled_connection() as db:
+            row = await db.fetchrow(ASYNC_PRODUCT_DETAIL_QUERY, barcode, barcode)
+        product = product_detail_response(
+            dict(row) if row else None, "Product not found for this barcode or is inactive."
+        )
+        product_detail_cache.set(barcode, product, version)
+
+    if etag is not None:
+        response.headers.update(cache_headers(etag, CATALOG_CACHE_CONTROL))
+    return product
+
+async def get_product_by_id_async(product_id: str, response: Response, if_none_match: Optional[str] = Header(None)):
+    """Async twin of get_product_by_id."""
+    etag = product_etag(product_id, promotion_clock.current())
+    if etag is not None and etag_matches(if_none_match, etag):
+        return not_modified(etag, CATALOG_CACHE_CONTROL)
+
+    product = product_detail_cache.get(product_id)
+    if product is None:
+        version = product_detail_cache.version
+        async with async_pooled_connection() as db:
+            row = await db.fetchrow(ASYNC_PRODUCT_DETAIL_QUERY, product_id, product_id)
+        product = product_detail_response(dict(row) if row else None, "Product not found or is inactive.")
+        product_detail_cache.set(product_id, product, version)
+
+    if etag is not None:
+        response.headers.update(cache_headers(etag, CATALOG_CACHE_CONTROL))
+    return product
+
+async def get_products_batch_async(request: ProductBatchRequest, db=Depends(get_async_db)):
+    """Async twin of get_products_batch."""
+    products_by_barcode = {}
+    missing = list(dict.fromkeys(request.barcodes))
+    cache_version = None
+
+    if request.store_ids is None:
+        promotion_clock.current()  # Clears the cache once promotions may have ended
+        cached = {barcode: product_detail_cache.get(barcode) for barcode in missing}
+        products_by_barcode.update({b: p for b, p in cached.items() if p is not None})
+        missing = [barcode for barcode in missing if cached[barcode] is None]
+        cache_version = product_detail_cache.version
+
+    if missing:
+        rows = await db.fetch(ASYNC_PRODUCT_BATCH_QUERY, *product_batch_params(missing, request.store_ids))
+        collect_batch_rows([dict(row) for row in rows], products_by_barcode, cache_version)
+
+    return product_batch_response(request.barcodes, products_by_barcode)
+
+# Sync endpoint name -> async implementation
+ASYNC_ENDPOINTS = {
+    "search_products": search_products_async,
+    "get_product_by_barcode": get_product_by_barcode_async,
+    "get_product_by_id": get_product_by_id_async,
+    "get_products_batch": get_products_batch_async,
+}
+
+def use_async_endpoints():
+    """
+    Swap the sync routes listed in ASYNC_ENDPOINTS for their async twins in place,
+    keeping path, route order, response model and OpenAPI metadata unchanged.
+    """
+    for index, route in enumerate(app.router.routes):
+        if isinstance(route, APIRoute) and route.name in ASYNC_ENDPOINTS:
+            app.router.routes[index] = APIRoute(
+                route.path,
+                ASYNC_ENDPOINTS[route.name],
+                response_model=route.response_model,
+                tags=route.tags,
+                methods=route.methods,
+                name=route.name,
+                summary=route.summary,
+                description=route.description
+            )
+
+if API_DB_MODE == "async":
+    app.add_event_handler("startup", open_async_db_pool)
+    app.add_event_handler("shutdown", close_async_db_pool)
+    use_async_endpoints()
 
 if __name__ == "__main__":
     print("🚀 Starting PharmMate Backend Server...")
@@ -0,0 +1,187 @@
+"""
+Basket optimizer behind /api/cart/recommendation.
+
+Current prices for a cart become a dense items x stores NumPy matrix (NaN
+where a store does not sell an item). Every question the endpoint answers is
+then a handful of vectorized reductions over that matrix:
+
+- best single store: per-store totals and missing counts in one pass
+- best single chain: the cheapest store of each chain per item (as before,
+  a chain "has" an item if any of its stores in scope sells it)
+- best split across at most K stores: choose the store set S minimizing
+  sum(quantity x cheapest price within S) + trip_penalty x |S|
+
+The split is a small facility-location problem. Stores are first pruned to
+the cheapest candidates (plus the cheapest store for every item, so coverage
+is never lost), pairs are enumerated exactly, and larger sets are grown
+greedily from the best few pairs and then improved by single-store swaps.
+
+Missing items are priced at MISSING_ITEM_COST, so any option that covers more
+of the cart always beats a cheaper one that covers less.
+"""
+
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+MISSING_ITEM_COST = 1e7
+CANDIDATE_STORES = 40
+MAX_SWAP_ROUNDS = 5
+GROWTH_STARTS = 8  # Best pairs that larger store sets are grown from
+
+
+class BasketOptimizer:
+    def __init__(self, barcodes: Sequence[str], quantities: Sequence[int], store_rows: List[dict]):
+        """
+        Args:
+            barcodes: Distinct barcodes in the cart
+            quantities: Quantity of each barcode
+            store_rows: One dict per store: store_id, retailer_id, and parallel
+                lists `items` (indexes into barcodes) and `prices`
+        """
+        self.barcodes = list(barcodes)
+        self.quantities = np.asarray(quantities, dtype=np.float64)
+        self.store_ids = np.array([row['store_id'] for row in store_rows], dtype=np.int64)
+        self.store_retailers = np.array([row['retailer_id'] for row in store_rows], dtype=np.int64)
+
+        self.prices = np.full((len(self.barcodes), len(store_rows)), np.nan)
+        if store_rows:
+            rows = np.concatenate([np.asarray(row['items'], dtype=np.int64) for row in store_rows])
+            cols = np.repeat(np.arange(len(store_rows)), [len(row['items']) for row in store_rows])
+            values = np.concatenate([np.asarray(row['prices'], dtype=np.float64) for row in store_rows])
+            # A product can map to several retailer products at one store; keep the cheapest
+            self.prices[rows, cols] = np.inf
+            np.fmin.at(self.prices, (rows, cols), values)
+
+        self.available = ~np.isnan(self.prices)
+        # Missing items cost more than any real basket, per unit
+        self._cost = np.where(self.available, self.prices, MISSING_ITEM_COST)
+
+    @property
+    def store_count(self) -> int:
+        return len(self.store_ids)
+
+    def _basket(self, item_prices: np.ndarray) -> dict:
+        """Total, item indexes and missing item indexes for one unit price per item."""
+        available = item_prices < MISSING_ITEM_COST
+        total = float(self.quantities[available] @ item_prices[available])
+        return {
+            'total_price': round(total, 2),
+            'items': [int(i) for i in np.flatnonzero(available)],
+            'missing': [int(i) for i in np.flatnonzero(~available)],
+            'prices': item_prices,
+        }
+
+    # --- Single store ---
+
+    def best_store(self) -> Optional[dict]:
+        if not self.store_count:
+            return None
+        scores = self.quantities @ self._cost
+        j = int(np.argmin(scores))
+        basket = self._basket(self._cost[:, j])
+        basket['store_id'] = int(self.store_ids[j])
+        basket['retailer_id'] = int(self.store_retailers[j])
+        return basket
+
+    # --- Single chain ---
+
+    def chain_baskets(self, retailer_ids: Sequence[int]) -> Dict[int, dict]:
+        """Basket per chain, pricing each item at the chain's cheapest store in scope."""
+        baskets = {}
+        for retailer_id in retailer_ids:
+            columns = self.store_retailers == retailer_id
+            if columns.any():
+                item_prices = self._cost[:, columns].min(axis=1)
+            else:
+                item_prices = np.full(len(self.barcodes), MISSING_ITEM_COST)
+            baskets[retailer_id] = self._basket(item_prices)
+        return baskets
+
+    # --- Split across stores ---
+
+    def _candidates(self) -> np.ndarray:
+        scores = self.quantities @ self._cost
+        limit = min(CANDIDATE_STORES, self.store_count)
+        cheapest = np.argpartition(scores, limit - 1)[:limit]
+        # Keep the cheapest store for every item so no item becomes unreachable
+        per_item = np.argmin(self._cost, axis=1)
+        return np.unique(np.concatenate([cheapest, per_item]))
+
+    def _grow(self, cost: np.ndarray, store_set: List[int], score: float, max_stores: int, trip_penalty: float):
+        """Greedily add stores while one pays for its trip, then improve by single-store swaps."""
+        current = cost[:, store_set].min(axis=1)
+        while len(store_set) < max_stores:
+            totals = self.quantities @ np.minimum(current[:, None], cost)
+            totals[store_set] = np.inf
+            j = int(np.argmin(totals))
+            new_score = float(totals[j]) + trip_penalty * (len(store_set) + 1)
+            if new_score >= score:
+                break
+            store_set.append(j)
+            score = new_score
+            current = np.minimum(current, cost[:, j])
+
+        for _ in range(MAX_SWAP_ROUNDS):
+            improved = False
+            for position in range(len(store_set)):
+                others = store_set[:position] + store_set[position + 1:]
+                rest = cost[:, others].min(axis=1)
+                totals = self.quantities @ np.minimum(rest[:, None], cost)
+                totals[others] = np.inf
+                j = int(np.argmin(totals))
+                new_score = float(totals[j]) + trip_penalty * len(store_set)
+                if new_score < score - 1e-9:
+                    store_set[position] = j
+                    score = new_score
+                    improved = True
+            if not improved:
+                break
+        return score, store_set
+
+    def best_split(self, max_stores: int, trip_penalty: float = 0.0) -> Optional[dict]:
+        if not self.store_count:
+            return None
+
+        candidates = self._candidates()
+        cost = self._cost[:, candidates]
+        single_scores = self.quantities @ cost + trip_penalty
+        best_set = [int(np.argmin(single_scores))]
+        best_score = float(single_scores[best_set[0]])
+
+        if max_stores >= 2 and len(candidates) >= 2:
+            # Exact search over all pairs, one row of the pair table at a time,
+            # keeping each row's best pair as a starting point for larger sets
+            pairs = []
+            for a in range(len(candidates) - 1):
+                pair_scores = self.quantities @ np.minimum(cost[:, a, None], cost[:, a + 1:]) + 2 * trip_penalty
+                b = int(np.argmin(pair_scores))
+                pairs.append((float(pair_scores[b]), [a, a + 1 + b]))
+            pairs.sort(key=lambda pair: pair[0])
+            if pairs[0][0] < best_score:
+                best_score, best_set = pairs[0]
+
+            if max_stores >= 3:
+                for score, store_set in pairs[:GROWTH_STARTS]:
+                    score, store_set = self._grow(cost, list(store_set), score, max_stores, trip_penalty)
+                    if score < best_score:
+                        best_score, best_set = score, store_set
+
+        columns = candidates[best_set]
+        chosen_cost = self._cost[:, columns]
+        assignment = columns[np.argmin(chosen_cost, axis=1)]
+        basket = self._basket(chosen_cost.min(axis=1))
+
+        # Drop stores that ended up with no items (possible when coverage is partial)
+        available = basket['prices'] < MISSING_ITEM_COST
+        used_columns = sorted(set(assignment[available].tolist()))
+        basket['stores'] = [
+            {
+                'store_id': int(self.store_ids[j]),
+                'retailer_id': int(self.store_retailers[j]),
+                'items': [int(i) for i in np.flatnonzero(available & (assignment == j))],
+            }
+            for j in used_columns
+        ]
+        basket['trip_penalty'] = round(trip_penalty * len(used_columns), 2)
+        return basket
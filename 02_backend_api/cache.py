@@ -0,0 +1,207 @@
+"""
+In-process caches for the PharmMate API.
+
+TTLCache is a thread-safe LRU with a per-entry time-to-live and hit/miss
+counters. Sync endpoints run on Starlette's threadpool, so every operation
+takes the cache lock.
+
+VersionedCache wraps a TTLCache for data the ETLs change, invalidating by
+key (or wholesale) as the data_versions watcher reports new versions.
+
+SingleFlight coalesces concurrent identical computations, so a burst of the
+same cache miss runs once.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, List, Optional
+
+_MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 300.0):
+        """
+        Args:
+            max_entries: Least recently used entries are evicted beyond this size
+            ttl_seconds: Entries older than this are treated as misses
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (stored_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING or now - entry[0] > self.ttl_seconds:
+                if entry is not _MISSING:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return entry[1] if entry else None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def keys(self) -> List[Hashable]:
+        with self._lock:
+            return list(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class VersionedCache:
+    """
+    TTLCache for responses derived from ETL-loaded data.
+
+    Callers read `version` before querying and pass it back to set(). If data
+    was invalidated in between, the fill is dropped instead of caching a
+    response that may predate the ETL commit.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 300.0):
+        self._cache = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self._lock = threading.Lock()
+        self.version = 0
+        self.invalidations = 0
+        self.clears = 0
+        self.stale_fills = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        return self._cache.get(key, default)
+
+    def set(self, key: Hashable, value: Any, version: int):
+        with self._lock:
+            if version != self.version:
+                self.stale_fills += 1
+                return
+            self._cache.set(key, value)
+
+    def invalidate(self, version: int, keys):
+        """Drop the given keys; fills started before `version` are discarded."""
+        with self._lock:
+            self.version = version
+            for key in keys:
+                if self._cache.pop(key) is not None:
+                    self.invalidations += 1
+
+    def invalidate_where(self, version: int, predicate: Callable[[Hashable], bool]):
+        """Like invalidate(), for every cached key where predicate(key) is true."""
+        with self._lock:
+            self.version = version
+            for key in self._cache.keys():
+                if predicate(key) and self._cache.pop(key) is not None:
+                    self.invalidations += 1
+
+    def clear(self, version: int):
+        """Drop everything; fills started before `version` are discarded."""
+        with self._lock:
+            self.version = version
+            self._cache.clear()
+            self.clears += 1
+
+    def __len__(self):
+        return len(self._cache)
+
+    def stats(self) -> dict:
+        stats = self._cache.stats()
+        stats.update({
+            'data_version': self.version,
+            'invalidations': self.invalidations,
+            'clears': self.clears,
+            'stale_fills': self.stale_fills,
+        })
+        return stats
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller runs the
+    function and later callers block until it finishes, then share its result
+    (or its exception). Nothing is kept once the call returns; pair it with a
+    cache for that.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.calls += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'calls': self.calls,
+                'shared': self.shared,
+            }
@@ -0,0 +1,402 @@
+"""
+Immutable, memory-mapped catalog snapshot shared by all API workers.
+
+Every uvicorn worker building its own copy of the catalog behind popular
+picks (the product pool) costs a full query and the same memory once per
+worker. After
+an ETL run publishes a data version, write_catalog_snapshot() instead writes
+the catalog once to a versioned file; each worker mmaps it read-only, so the
+pages live in the OS page cache once and are shared by every worker.
+
+File layout (little endian):
+
+    8 bytes   MAGIC
+    8 bytes   header length H
+    H bytes   JSON header: data_version, created_at, product count and
+              {section: [offset, dtype, count]}
+    sections  raw NumPy arrays from the next ALIGNMENT boundary on, each
+              aligned to ALIGNMENT bytes (offsets are relative to the first)
+
+Products are sorted by barcode. String columns (barcode, name, brand,
+image_url) are a UTF-8 blob plus n + 1 offsets; lowest_price is float64 (NaN
+when unknown). popularity_cum holds cumulative draw weights (zero weight for
+products that may not be recommended), so a popular pick is a binary search.
+Only what popular picks read is stored: cart pricing reads current_prices,
+which batches update before the run's snapshot exists.
+
+Publishing is atomic: the snapshot is written under a temporary name and
+renamed, then the CURRENT file naming it is replaced the same way, under a
+lock file since every ETL publishes here; CURRENT never moves to an older
+data version. Workers swap to a new snapshot by reading CURRENT (after every
+run, and at most every refresh_seconds); requests already holding the old
+snapshot keep using it, and its file stays readable after being deleted while
+it is mapped. Popularity (cart and favorite counts) changes between runs, so
+given a database pool the workers also republish a snapshot older than
+publish_seconds; one worker writes it and the others map it.
+"""
+
+import fcntl
+import json
+import logging
+import mmap
+import os
+import random
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import psycopg2.extensions
+
+from product_pool import POPULARITY_WEIGHT
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"PMCAT02\0"
+ALIGNMENT = 64
+CURRENT_FILE = "CURRENT"
+LOCK_FILE = ".lock"
+PUBLISH_LOCK_FILE = ".publish.lock"  # Held by the worker republishing a stale snapshot
+KEEP_SNAPSHOTS = 3  # Older files are deleted when a new one is published
+
+STRING_COLUMNS = ("barcode", "name", "brand", "image_url")
+
+SNAPSHOT_PRODUCTS_QUERY = """
+    SELECT
+        cp.barcode,
+        cp.name,
+        cp.brand,
+        cp.image_url,
+        cp.lowest_price::float8,
+        (cp.lowest_price IS NOT NULL
+         AND cp.image_url IS NOT NULL
+         AND cp.image_url NOT LIKE '%placeholder%') AS recommendable,
+        COALESCE(pop.interactions, 0) AS interactions
+    FROM canonical_products cp
+    LEFT JOIN (
+        SELECT product_barcode, COUNT(*) AS interactions
+        FROM (
+            SELECT product_barcode FROM user_cart
+            UNION ALL
+            SELECT product_barcode FROM user_favorites
+        ) all_interactions
+        GROUP BY product_barcode
+    ) pop ON pop.product_barcode = cp.barcode
+    WHERE cp.is_active = TRUE
+    ORDER BY cp.barcode COLLATE "C"
+"""
+
+
+def _string_column(values: Sequence[Optional[str]]):
+    """UTF-8 blob and n + 1 offsets; None is stored as an empty string."""
+    encoded = [(value or "").encode("utf-8") for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def _aligned(n: int) -> int:
+    return -(-n // ALIGNMENT) * ALIGNMENT
+
+
+def _write_sections(path: str, header: dict, sections: Dict[str, np.ndarray]):
+    layout = {}
+    offset = 0
+    for name, array in sections.items():
+        layout[name] = [offset, array.dtype.str, int(array.size)]
+        offset += _aligned(array.nbytes)
+    header_bytes = json.dumps(dict(header, sections=layout)).encode("utf-8")
+    data_start = _aligned(len(MAGIC) + 8 + len(header_bytes))
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(header_bytes).to_bytes(8, "little"))
+        f.write(header_bytes)
+        for name, array in sections.items():
+            f.write(b"\0" * (data_start + layout[name][0] - f.tell()))
+            f.write(np.ascontiguousarray(array).tobytes())
+
+
+def write_catalog_snapshot(conn, directory: str, version: int) -> str:
+    """
+    Write the snapshot for `version` from the database and make it CURRENT.
+    conn must have no transaction open. Returns the snapshot's path.
+    """
+    os.makedirs(directory, exist_ok=True)
+    started = time.monotonic()
+    try:
+        with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+            cur.execute(SNAPSHOT_PRODUCTS_QUERY)
+            products = cur.fetchall()
+    finally:
+        conn.rollback()  # Read only; ends the transaction
+
+    sections: Dict[str, np.ndarray] = {}
+    for column, name in enumerate(STRING_COLUMNS):
+        blob, offsets = _string_column([row[column] for row in products])
+        sections[f"{name}_data"] = blob
+        sections[f"{name}_offsets"] = offsets
+
+    sections["lowest_price"] = np.array(
+        [row[4] if row[4] is not None else np.nan for row in products], dtype=np.float64
+    )
+    weights = np.array(
+        [1.0 + POPULARITY_WEIGHT * row[6] if row[5] else 0.0 for row in products], dtype=np.float64
+    )
+    sections["popularity_cum"] = np.cumsum(weights)
+
+    # Unique per write, so workers notice a re-published version too
+    filename = f"catalog-{version}-{int(time.time() * 1000)}.bin"
+    path = os.path.join(directory, filename)
+    # Temporary names are unique per writer: the ETLs publish into the same directory
+    tmp_path = _temp_path(directory, filename)
+    _write_sections(tmp_path, {
+        'data_version': version,
+        'created_at': time.time(),
+        'products': len(products),
+    }, sections)
+    os.replace(tmp_path, path)
+
+    # Serialized, so an older version finishing last cannot take CURRENT back
+    with open(os.path.join(directory, LOCK_FILE), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        published = _current_version(directory)
+        if published is not None and published > version:
+            logger.info(f"Catalog snapshot {filename} not published: version {published} is already current")
+        else:
+            current_tmp = _temp_path(directory, CURRENT_FILE)
+            with open(current_tmp, "w") as f:
+                f.write(filename)
+            os.replace(current_tmp, os.path.join(directory, CURRENT_FILE))
+        _remove_old_snapshots(directory, keep=_current_name(directory))
+    logger.info(
+        f"Catalog snapshot {filename} written: {len(products)} products "
+        f"in {time.monotonic() - started:.1f}s"
+    )
+    return path
+
+
+def _current_name(directory: str) -> Optional[str]:
+    try:
+        with open(os.path.join(directory, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def _current_version(directory: str) -> Optional[int]:
+    """Data version of the snapshot CURRENT names, from its catalog-{version}-{ms}.bin name."""
+    try:
+        return int(_current_name(directory).split("-")[1])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def _current_age(directory: str) -> Optional[float]:
+    """Seconds since the snapshot CURRENT names was written, from its catalog-{version}-{ms}.bin name."""
+    try:
+        return time.time() - int(_current_name(directory).split("-")[2].split(".")[0]) / 1000
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def _temp_path(directory: str, name: str) -> str:
+    fd, path = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=directory)
+    os.fchmod(fd, 0o644)  # mkstemp creates 0600; workers may run as another user
+    os.close(fd)
+    return path
+
+
+def _remove_old_snapshots(directory: str, keep: str):
+    snapshots = sorted(
+        (name for name in os.listdir(directory) if name.startswith("catalog-") and name.endswith(".bin")),
+        key=lambda name: os.path.getmtime(os.path.join(directory, name))
+    )
+    for name in snapshots[:-KEEP_SNAPSHOTS]:
+        if name != keep:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+class CatalogSnapshot:
+    """One mapped snapshot file. Arrays are read-only views of the shared pages."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a catalog snapshot")
+        header_length = int.from_bytes(self._mmap[len(MAGIC):len(MAGIC) + 8], "little")
+        header_start = len(MAGIC) + 8
+        self.header = json.loads(self._mmap[header_start:header_start + header_length])
+        self._data_start = _aligned(header_start + header_length)
+        self.data_version = self.header['data_version']
+        self.product_count = self.header['products']
+
+        self._arrays = {
+            name: np.frombuffer(self._mmap, dtype=np.dtype(dtype), count=count, offset=self._data_start + offset)
+            for name, (offset, dtype, count) in self.header['sections'].items()
+        }
+        self.lowest_price = self._arrays['lowest_price']
+        self.popularity_cum = self._arrays['popularity_cum']
+
+    def _bytes(self, column: str, i: int) -> bytes:
+        offsets = self._arrays[f"{column}_offsets"]
+        data_offset = self._data_start + self.header['sections'][f"{column}_data"][0]
+        return self._mmap[data_offset + int(offsets[i]):data_offset + int(offsets[i + 1])]
+
+    def string(self, column: str, i: int) -> str:
+        return self._bytes(column, i).decode("utf-8")
+
+    def summary(self, i: int) -> dict:
+        """A ProductSummary dict for product i."""
+        price = float(self.lowest_price[i])
+        barcode = self.string('barcode', i)
+        return {
+            'product_id': barcode,
+            'barcode': barcode,
+            'name': self.string('name', i),
+            'brand': self.string('brand', i) or None,
+            'image_url': self.string('image_url', i) or None,
+            'lowest_price': None if np.isnan(price) else price,
+        }
+
+    def sample_popular(self, k: int) -> List[dict]:
+        """Up to k distinct recommendable products, drawn by popularity like ProductPool."""
+        total = float(self.popularity_cum[-1]) if self.product_count else 0.0
+        if total <= 0:
+            return []
+        chosen = []
+        seen = set()
+        attempts = 0
+        while len(chosen) < k and attempts < k * 20:
+            attempts += 1
+            i = int(np.searchsorted(self.popularity_cum, random.random() * total, side='right'))
+            i = min(i, self.product_count - 1)
+            if i not in seen:
+                seen.add(i)
+                chosen.append(i)
+        return [self.summary(i) for i in chosen]
+
+
+class CatalogSnapshots:
+    """The current snapshot in a directory, swapped atomically when CURRENT changes."""
+
+    def __init__(
+        self,
+        directory: Optional[str],
+        refresh_seconds: float = 30.0,
+        db_pool=None,
+        publish_seconds: float = 600.0,
+    ):
+        """
+        Args:
+            directory: Where the ETLs publish snapshots; None disables snapshots
+            refresh_seconds: Age after which the next request checks CURRENT for a new snapshot
+            db_pool: DatabasePool used to republish stale snapshots; None leaves publishing to the ETLs
+            publish_seconds: Age after which that check republishes the snapshot (or publishes a first one)
+        """
+        self.directory = directory
+        self.refresh_seconds = refresh_seconds
+        self.db_pool = db_pool
+        self.publish_seconds = publish_seconds
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._build_lock = threading.Lock()
+        self._refreshing = threading.Event()
+        self._checked_at = None
+        self.version = None
+        self.load_seconds = None
+
+    def current(self) -> Optional[CatalogSnapshot]:
+        """The mapped snapshot, or None (disabled, or nothing published yet)."""
+        if self.directory is None:
+            return None
+        if self._checked_at is None or time.monotonic() - self._checked_at > self.refresh_seconds:
+            self._refresh_in_background()
+        return self._snapshot
+
+    def _refresh_in_background(self):
+        if self._refreshing.is_set():
+            return
+        self._refreshing.set()
+
+        def refresh():
+            try:
+                self.publish_if_stale()
+                self.rebuild(self.version)
+            except Exception as e:
+                logger.error(f"Background catalog snapshot reload failed: {e}")
+            finally:
+                self._refreshing.clear()
+
+        threading.Thread(target=refresh, name="catalog-snapshot-refresh", daemon=True).start()
+
+    def _stale(self) -> bool:
+        age = _current_age(self.directory)
+        return age is None or age > self.publish_seconds
+
+    def publish_if_stale(self):
+        """
+        Write a fresh snapshot at the latest data version seen if CURRENT is
+        older than publish_seconds (or missing). Skipped while another worker
+        is writing one.
+        """
+        if self.db_pool is None or not self._stale():
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, PUBLISH_LOCK_FILE), "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            if not self._stale():  # Another worker published since the first check
+                return
+            snapshot = self._snapshot
+            version = self.version if self.version is not None else (snapshot.data_version if snapshot else 0)
+            conn = self.db_pool.getconn()
+            try:
+                write_catalog_snapshot(conn, self.directory, version)
+            finally:
+                self.db_pool.putconn(conn)
+
+    def rebuild(self, version: Optional[int] = None, only_if_missing: bool = False):
+        """Map the snapshot CURRENT names if it is not the one already mapped."""
+        if self.directory is None:
+            return
+        with self._build_lock:
+            self.version = version
+            if only_if_missing and self._snapshot is not None:
+                return
+            self._checked_at = time.monotonic()
+            try:
+                with open(os.path.join(self.directory, CURRENT_FILE)) as f:
+                    filename = f.read().strip()
+            except OSError:
+                return
+            path = os.path.join(self.directory, filename)
+            if self._snapshot is not None and self._snapshot.path == path:
+                return
+
+            started = time.monotonic()
+            snapshot = CatalogSnapshot(path)
+            self._snapshot = snapshot
+            self.load_seconds = round(time.monotonic() - started, 3)
+            logger.info(
+                f"Catalog snapshot {filename} mapped: {snapshot.product_count} products "
+                f"(data version {snapshot.data_version})"
+            )
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            'enabled': self.directory is not None,
+            'ready': snapshot is not None,
+            'path': snapshot.path if snapshot else None,
+            'data_version': snapshot.data_version if snapshot else None,
+            'products': snapshot.product_count if snapshot else 0,
+            'load_seconds': self.load_seconds,
+        }
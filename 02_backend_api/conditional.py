@@ -0,0 +1,119 @@
+"""
+HTTP conditional requests for the catalog endpoints.
+
+Catalog data only changes when an ETL batch or run commits, so a client (or a
+CDN in front of the API) that already holds a response can revalidate it with
+If-None-Match and get an empty 304 instead of the body. ETags are computed
+from state the API already has in memory, so a 304 is answered before a
+database connection is checked out:
+
+- Product details: the data version that last changed the barcode, tracked by
+  EntityVersions from the data_versions watcher. Every finished run bumps all
+  products, since runs can also change stores and promotions. Promotions also
+  end without any ETL write, so an ExpiryClock period is part of the ETag too.
+- /api/stores: a hash of the encoded store list, which is kept in memory.
+- /api/deals: the deal pool's data version and pruning state.
+
+ETags are weak: CompressionMiddleware serves the same content gzip, brotli or
+plain, and a weak validator matches all three.
+"""
+
+import hashlib
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set
+
+from fastapi.responses import Response
+
+
+class EntityVersions:
+    """The data version that last changed each barcode."""
+
+    def __init__(self):
+        self.run_version: Optional[int] = None
+        self._barcodes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def on_run(self, version: int):
+        """Run-level change (and the initial version at startup): everything is at `version`."""
+        with self._lock:
+            self.run_version = version
+            self._barcodes = {}
+
+    def on_barcodes(self, version: int, barcodes: Set[str]):
+        with self._lock:
+            for barcode in barcodes:
+                self._barcodes[barcode] = version
+
+    def version_of(self, barcode: str) -> Optional[int]:
+        """None until the watcher has reported the startup version."""
+        run_version = self.run_version
+        if run_version is None:
+            return None
+        return self._barcodes.get(barcode, run_version)
+
+    def stats(self) -> dict:
+        return {'run_version': self.run_version, 'changed_barcodes': len(self._barcodes)}
+
+
+class ExpiryClock:
+    """
+    Numbered periods of `seconds` for responses that change as time passes
+    (promotions ending) without a data version. on_rollover callbacks run once
+    when a new period is first observed, e.g. to clear caches holding them.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.period: Optional[int] = None
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def on_rollover(self, callback: Callable[[], None]):
+        self._callbacks.append(callback)
+
+    def current(self) -> int:
+        period = int(time.time() // self.seconds)
+        if period != self.period:
+            with self._lock:
+                if period == self.period:
+                    return period
+                first = self.period is None
+                self.period = period
+            if not first:
+                for callback in self._callbacks:
+                    callback()
+        return period
+
+
+def weak_etag(*parts) -> str:
+    return 'W/"' + '-'.join(str(part) for part in parts) + '"'
+
+
+def content_etag(prefix: str, body: bytes) -> str:
+    return weak_etag(prefix, hashlib.sha1(body).hexdigest()[:16])
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison against an If-None-Match header ("*" or a list of ETags)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def cache_headers(etag: str, cache_control: str) -> dict:
+    return {'ETag': etag, 'Cache-Control': cache_control}
+
+
+def not_modified(etag: str, cache_control: str) -> Response:
+    """Empty 304 carrying the validators a 200 would have had."""
+    return Response(status_code=304, headers=cache_headers(etag, cache_control))
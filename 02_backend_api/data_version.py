@@ -0,0 +1,186 @@
+"""
+Watches the data_versions table written by the ETLs.
+
+A daemon thread polls the table every few seconds. Two kinds of rows appear:
+
+- Run-level rows (barcodes IS NULL), written when an ETL run finishes.
+  subscribe() callbacks get the new version, once at startup and then after
+  every run; this is how in-memory indexes are rebuilt without a restart.
+- Batch rows listing the barcodes a committed batch touched.
+  subscribe_barcodes() callbacks get (version, barcodes) so caches can drop
+  exactly those products.
+
+Versions come from a sequence, but the ETLs insert their batch rows inside
+long, concurrent transactions, so a version can commit after a higher one. The
+watcher therefore only advances past a missing version once it can no longer
+appear: every transaction that was running when the gap was first seen has
+ended (the snapshot's xmin has passed the xmax seen then; batch rows are
+written after the batch's prices, so their transaction already had an xid), or
+max_gap_wait seconds have passed. Until then the rows above the gap wait too,
+which keeps versions handed to subscribers increasing and the same in every
+worker.
+"""
+
+import logging
+import threading
+import time
+from typing import Callable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class DataVersionWatcher:
+    def __init__(self, db_pool, poll_interval: float = 15.0, max_gap_wait: float = 600.0):
+        """
+        Args:
+            db_pool: DatabasePool used for the (tiny) polling query
+            poll_interval: Seconds between polls
+            max_gap_wait: Give up on a missing version after this long even if
+                transactions older than the gap are still open
+        """
+        self.db_pool = db_pool
+        self.poll_interval = poll_interval
+        self.max_gap_wait = max_gap_wait
+        self.version = None
+        # While waiting on a gap: (highest version seen, snapshot xmax, monotonic time) when it appeared
+        self._gap: Optional[Tuple[int, int, float]] = None
+        self.gaps_skipped = 0
+        self._subscribers: List[Callable[[int], None]] = []
+        self._barcode_subscribers: List[Callable[[int, Set[str]], None]] = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, callback: Callable[[int], None]):
+        """Register callback(version) for run-level changes; called from the watcher thread."""
+        self._subscribers.append(callback)
+
+    def subscribe_barcodes(self, callback: Callable[[int, Set[str]], None]):
+        """Register callback(version, barcodes) for batch changes; called from the watcher thread."""
+        self._barcode_subscribers.append(callback)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="data-version-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_interval + 1)
+            self._thread = None
+
+    def _fetch_version(self) -> int:
+        conn = self.db_pool.getconn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT COALESCE(MAX(version), 0) AS version FROM data_versions")
+                return cur.fetchone()['version']
+        finally:
+            self.db_pool.putconn(conn)
+
+    def _fetch_changes(self, since: int) -> Tuple[List[dict], int, int]:
+        """Rows after `since`, plus the xmin and xmax of the snapshot they were read in."""
+        conn = self.db_pool.getconn()
+        try:
+            with conn.cursor() as cur:
+                # One statement, so the rows and the snapshot bounds agree
+                cur.execute("""
+                    SELECT snap.xmin, snap.xmax, dv.version, dv.barcodes
+                    FROM (
+                        SELECT
+                            txid_snapshot_xmin(txid_current_snapshot()) AS xmin,
+                            txid_snapshot_xmax(txid_current_snapshot()) AS xmax
+                    ) snap
+                    LEFT JOIN data_versions dv ON dv.version > %s
+                    ORDER BY dv.version
+                """, (since,))
+                rows = cur.fetchall()
+                changes = [row for row in rows if row['version'] is not None]
+                return changes, rows[0]['xmin'], rows[0]['xmax']
+        finally:
+            self.db_pool.putconn(conn)
+
+    def _gap_closed(self, missing_below: int, xmin: int) -> bool:
+        """Whether versions below `missing_below` that are still missing can be skipped."""
+        if self._gap is None:
+            return False
+        seen_version, gap_xmax, noticed_at = self._gap
+        if missing_below > seen_version:
+            return False  # Appeared after the gap we are waiting on
+        if xmin >= gap_xmax:
+            return True
+        if time.monotonic() - noticed_at > self.max_gap_wait:
+            logger.warning(f"Skipping data versions below {missing_below} still missing after {self.max_gap_wait}s")
+            return True
+        return False
+
+    def _take_contiguous(self, changes: List[dict], xmin: int, xmax: int) -> List[dict]:
+        """The changes that can be applied now, in version order, stopping at an open gap."""
+        taken = []
+        expected = self.version + 1
+        for change in changes:
+            if change['version'] != expected:
+                if not self._gap_closed(change['version'], xmin):
+                    if self._gap is None or change['version'] > self._gap[0]:
+                        self._gap = (changes[-1]['version'], xmax, time.monotonic())
+                    return taken
+                self.gaps_skipped += change['version'] - expected
+            taken.append(change)
+            expected = change['version'] + 1
+        self._gap = None
+        return taken
+
+    def _notify(self, subscribers: list, *args):
+        for callback in subscribers:
+            try:
+                callback(*args)
+            except Exception as e:
+                logger.error(f"Data version subscriber {getattr(callback, '__name__', callback)} failed: {e}")
+
+    def check(self):
+        """Poll once and notify subscribers of anything committed since the last poll."""
+        if self.version is None:
+            try:
+                version = self._fetch_version()
+            except Exception as e:
+                # Table missing or DB down at startup: still build the indexes once
+                logger.warning(f"Could not read data_versions: {e}")
+                version = 0
+            self.version = version
+            logger.info(f"Data version at startup: {version}")
+            self._notify(self._subscribers, version)
+            return
+
+        try:
+            changes, xmin, xmax = self._fetch_changes(self.version)
+        except Exception as e:
+            logger.warning(f"Could not read data_versions: {e}")
+            return
+        changes = self._take_contiguous(changes, xmin, xmax)
+        if not changes:
+            return
+
+        previous, self.version = self.version, changes[-1]['version']
+        barcodes = set()
+        run_finished = False
+        for change in changes:
+            if change['barcodes'] is None:
+                run_finished = True
+            else:
+                barcodes.update(change['barcodes'])
+
+        logger.info(
+            f"Data version changed: {previous} -> {self.version} "
+            f"({len(barcodes)} barcodes{', run finished' if run_finished else ''})"
+        )
+        if barcodes:
+            self._notify(self._barcode_subscribers, self.version, barcodes)
+        if run_finished:
+            self._notify(self._subscribers, self.version)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.check()
+            self._stop.wait(self.poll_interval)
@@ -0,0 +1,228 @@
+"""
+Managed PostgreSQL connection pool for the PharmMate API.
+
+psycopg2's own pools close every returned connection above `minconn`, so under
+load they reconnect constantly. This pool keeps up to `max_size` connections
+open, waits (bounded by a checkout timeout) instead of failing when all are in
+use, pings connections that sat idle before handing them out, applies a
+server-side statement_timeout, and keeps counters that are reported on /health.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.extras import RealDictCursor
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection could be checked out within the timeout."""
+
+
+class DatabasePool:
+    def __init__(
+        self,
+        dsn_kwargs: dict,
+        min_size: int = 2,
+        max_size: int = 10,
+        checkout_timeout: float = 5.0,
+        statement_timeout_ms: int = 15000,
+        health_check_interval: float = 30.0,
+        max_idle_seconds: float = 300.0,
+        cursor_factory=RealDictCursor,
+        on_checkout=None,
+    ):
+        """
+        Args:
+            dsn_kwargs: Keyword arguments passed to psycopg2.connect (dbname, user, ...)
+            min_size: Connections opened eagerly and never trimmed
+            max_size: Hard cap on open connections
+            checkout_timeout: Seconds to wait for a free connection before failing
+            statement_timeout_ms: statement_timeout applied to every connection (0 disables)
+            health_check_interval: Idle seconds after which a connection is pinged before reuse
+            max_idle_seconds: Idle connections above min_size are closed after this long
+            cursor_factory: Default cursor class for the pool's connections
+            on_checkout: Called with the milliseconds each checkout waited
+        """
+        self.dsn_kwargs = dict(dsn_kwargs)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.statement_timeout_ms = statement_timeout_ms
+        self.health_check_interval = health_check_interval
+        self.max_idle_seconds = max_idle_seconds
+        self.cursor_factory = cursor_factory
+        self.on_checkout = on_checkout
+
+        self._lock = threading.Lock()
+        # One slot per connection that may be checked out at the same time
+        self._slots = threading.BoundedSemaphore(max_size)
+        # (connection, last_returned_monotonic), most recently returned on the right
+        self._idle = deque()
+        self._opened = False
+
+        self.stats = {
+            'connections_opened': 0,
+            'connections_closed': 0,
+            'checkouts': 0,
+            'checkout_timeouts': 0,
+            'in_use': 0,
+            'broken_discarded': 0,
+            'health_checks': 0,
+            'total_wait_ms': 0.0,
+            'max_wait_ms': 0.0,
+        }
+
+    def _connect(self):
+        connect_kwargs = dict(self.dsn_kwargs)
+        if self.statement_timeout_ms:
+            connect_kwargs['options'] = f"-c statement_timeout={int(self.statement_timeout_ms)}"
+        conn = psycopg2.connect(cursor_factory=self.cursor_factory, **connect_kwargs)
+        with self._lock:
+            self.stats['connections_opened'] += 1
+        return conn
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._lock:
+            self.stats['connections_closed'] += 1
+
+    def open(self):
+        """Open the min_size connections eagerly (idempotent)."""
+        with self._lock:
+            if self._opened:
+                return
+            self._opened = True
+        for _ in range(self.min_size):
+            conn = self._connect()
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+        logger.info(f"Database pool opened (min={self.min_size}, max={self.max_size})")
+
+    def close(self):
+        """Close every idle connection; checked-out ones are closed when returned."""
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._opened = False
+        for conn, _ in idle:
+            self._discard(conn)
+        logger.info("Database pool closed")
+
+    def _is_healthy(self, conn, idle_since: float) -> bool:
+        """Cheap liveness check; only pings connections that sat idle for a while."""
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.health_check_interval:
+            return True
+        with self._lock:
+            self.stats['health_checks'] += 1
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        """Check out a connection, waiting up to checkout_timeout seconds."""
+        if not self._opened:
+            self.open()
+
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.checkout_timeout):
+            with self._lock:
+                self.stats['checkout_timeouts'] += 1
+            raise PoolTimeoutError(
+                f"No database connection available within {self.checkout_timeout}s"
+            )
+
+        try:
+            conn = None
+            while conn is None:
+                with self._lock:
+                    entry = self._idle.pop() if self._idle else None
+                if entry is None:
+                    conn = self._connect()
+                elif self._is_healthy(*entry):
+                    conn = entry[0]
+                else:
+                    with self._lock:
+                        self.stats['broken_discarded'] += 1
+                    self._discard(entry[0])
+        except Exception:
+            self._slots.release()
+            raise
+
+        waited_ms = (time.monotonic() - started) * 1000
+        with self._lock:
+            self.stats['checkouts'] += 1
+            self.stats['in_use'] += 1
+            self.stats['total_wait_ms'] += waited_ms
+            self.stats['max_wait_ms'] = max(self.stats['max_wait_ms'], waited_ms)
+        if self.on_checkout is not None:
+            self.on_checkout(waited_ms)
+        return conn
+
+    def putconn(self, conn):
+        """Return a connection, rolling back anything the request left open."""
+        try:
+            reusable = self._opened and not conn.closed
+            if reusable:
+                try:
+                    status = conn.get_transaction_status()
+                    if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                        reusable = False
+                    elif status != extensions.TRANSACTION_STATUS_IDLE:
+                        conn.rollback()
+                except psycopg2.Error:
+                    reusable = False
+
+            now = time.monotonic()
+            stale = []
+            with self._lock:
+                if reusable:
+                    self._idle.append((conn, now))
+                # Trim connections above min_size that nobody has needed for a while
+                while (len(self._idle) > self.min_size
+                       and now - self._idle[0][1] > self.max_idle_seconds):
+                    stale.append(self._idle.popleft()[0])
+                self.stats['in_use'] -= 1
+
+            if not reusable:
+                self._discard(conn)
+            for old in stale:
+                self._discard(old)
+        finally:
+            self._slots.release()
+
+    def snapshot(self) -> dict:
+        """Pool statistics for /health."""
+        with self._lock:
+            stats = dict(self.stats)
+            idle = len(self._idle)
+        checkouts = stats['checkouts']
+        return {
+            'min_size': self.min_size,
+            'max_size': self.max_size,
+            'open_connections': idle + stats['in_use'],
+            'idle_connections': idle,
+            'in_use': stats['in_use'],
+            'connections_opened': stats['connections_opened'],
+            'connections_closed': stats['connections_closed'],
+            'checkouts': checkouts,
+            'checkout_timeouts': stats['checkout_timeouts'],
+            'broken_discarded': stats['broken_discarded'],
+            'health_checks': stats['health_checks'],
+            'avg_wait_ms': round(stats['total_wait_ms'] / checkouts, 3) if checkouts else 0.0,
+            'max_wait_ms': round(stats['max_wait_ms'], 3),
+        }
@@ -0,0 +1,167 @@
+"""
+In-memory pool of current deals behind /api/deals.
+
+The pool holds one deal per product (per retailer, and across retailers):
+every active, priced product linked to a promotion that has not ended. It is
+rebuilt after each ETL run, so a request only has to draw `limit` deals
+uniformly at random instead of shuffling the promotions tables.
+
+Promotions that end between rebuilds are dropped in memory the first time a
+request notices the earliest end date has passed.
+"""
+
+import logging
+import random
+import threading
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEAL_POOL_QUERY = """
+    SELECT DISTINCT ON (p.retailer_id, cp.barcode)
+        p.promotion_id AS deal_id,
+        p.retailer_id,
+        r.retailername AS retailer_name,
+        p.description AS title,
+        p.remarks AS description,
+        cp.barcode AS product_id,
+        cp.name AS product_name,
+        cp.brand AS product_brand,
+        cp.image_url AS product_image_url,
+        cp.lowest_price,
+        EXTRACT(EPOCH FROM p.end_date) AS ends_at
+    FROM promotions p
+    JOIN retailers r ON p.retailer_id = r.retailerid
+    JOIN promotion_product_links ppl ON p.promotion_id = ppl.promotion_id
+    JOIN retailer_products rp ON ppl.retailer_product_id = rp.retailer_product_id
+    JOIN canonical_products cp ON rp.barcode = cp.barcode
+    WHERE (p.end_date IS NULL OR p.end_date >= NOW())
+      AND cp.is_active = true
+      AND cp.lowest_price IS NOT NULL
+    ORDER BY p.retailer_id, cp.barcode, p.promotion_id
+"""
+
+
+class _DealSnapshot:
+    """Immutable pool contents; replaced wholesale, never mutated."""
+
+    def __init__(self, by_retailer: Dict[int, List[dict]]):
+        self.by_retailer = by_retailer
+
+        # Across retailers, a product appears once, under its lowest promotion_id
+        by_barcode = {}
+        for deals in by_retailer.values():
+            for deal in deals:
+                current = by_barcode.get(deal['product_id'])
+                if current is None or deal['deal_id'] < current['deal_id']:
+                    by_barcode[deal['product_id']] = deal
+        self.all_deals = list(by_barcode.values())
+
+        end_times = [
+            deal['ends_at'] for deals in by_retailer.values() for deal in deals
+            if deal['ends_at'] is not None
+        ]
+        self.next_expiry = min(end_times) if end_times else None
+
+    def without_expired(self, now: float) -> "_DealSnapshot":
+        return _DealSnapshot({
+            retailer_id: [d for d in deals if d['ends_at'] is None or d['ends_at'] >= now]
+            for retailer_id, deals in self.by_retailer.items()
+        })
+
+
+class DealPool:
+    def __init__(self, db_pool):
+        self.db_pool = db_pool
+        self._snapshot: Optional[_DealSnapshot] = None
+        self._build_lock = threading.Lock()
+        self.version = None
+        self.build_seconds = None
+
+    @property
+    def ready(self) -> bool:
+        return self._snapshot is not None
+
+    def _current_snapshot(self) -> Optional[_DealSnapshot]:
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.next_expiry is None:
+            return snapshot
+
+        now = time.time()
+        if now > snapshot.next_expiry:
+            # Several requests may race to prune; each result is equally valid
+            snapshot = snapshot.without_expired(now)
+            self._snapshot = snapshot
+        return snapshot
+
+    def sample(self, limit: int, retailer_id: Optional[int] = None) -> List[dict]:
+        """Up to `limit` distinct deals drawn uniformly at random."""
+        snapshot = self._current_snapshot()
+        if snapshot is None:
+            return []
+        if retailer_id:
+            deals = snapshot.by_retailer.get(retailer_id, [])
+        else:
+            deals = snapshot.all_deals
+        return random.sample(deals, min(limit, len(deals)))
+
+    def content_tag(self) -> Optional[str]:
+        """
+        Changes whenever the pool's contents do: the data version it was built
+        at and the next end date still ahead (which moves as deals expire).
+        """
+        snapshot = self._current_snapshot()
+        if snapshot is None:
+            return None
+        next_expiry = int(snapshot.next_expiry) if snapshot.next_expiry is not None else 0
+        return f"{self.version}.{next_expiry}"
+
+    def ensure_ready(self):
+        """Build the pool now if no build has finished yet (first requests after startup)."""
+        if self._snapshot is None:
+            self.rebuild(self.version, only_if_missing=True)
+
+    def rebuild(self, version: Optional[int] = None, only_if_missing: bool = False):
+        """Reload the pool from the database and swap it in atomically."""
+        with self._build_lock:
+            if only_if_missing and self._snapshot is not None:
+                return
+            started = time.monotonic()
+            conn = self.db_pool.getconn()
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(DEAL_POOL_QUERY)
+                    rows = cur.fetchall()
+            finally:
+                self.db_pool.putconn(conn)
+
+            by_retailer: Dict[int, List[dict]] = {}
+            for row in rows:
+                deal = dict(row)
+                deal['lowest_price'] = float(deal['lowest_price'])
+                if deal['ends_at'] is not None:
+                    deal['ends_at'] = float(deal['ends_at'])
+                by_retailer.setdefault(deal['retailer_id'], []).append(deal)
+
+            snapshot = _DealSnapshot(by_retailer)
+            self._snapshot = snapshot
+            self.version = version
+            self.build_seconds = round(time.monotonic() - started, 3)
+            logger.info(
+                f"Deal pool rebuilt: {len(snapshot.all_deals)} products, "
+                f"{len(rows)} retailer deals in {self.build_seconds}s (data version {version})"
+            )
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            'ready': snapshot is not None,
+            'deals': len(snapshot.all_deals) if snapshot else 0,
+            'by_retailer': (
+                {retailer_id: len(deals) for retailer_id, deals in snapshot.by_retailer.items()}
+                if snapshot else {}
+            ),
+            'data_version': self.version,
+            'build_seconds': self.build_seconds,
+        }
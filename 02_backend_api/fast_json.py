@@ -0,0 +1,92 @@
+"""
+Fast JSON responses for the list endpoints.
+
+Returning rows through response_model makes FastAPI validate every row into a
+Pydantic model and then encode the models, which dominates /api/stores (every
+active store) and /api/search at page_size=100. These endpoints instead return
+a FastJSONResponse built from plain dicts:
+
+- RowEncoder is compiled once per response model: the model's output keys in
+  order, each with the same conversion Pydantic would apply (Decimal -> float,
+  int), and its default when a row lacks the key. Extra row columns (search
+  scores, retailer IDs) are dropped, as response_model would.
+- FastJSONResponse encodes with orjson when it is installed, else the standard
+  library, with the same compact UTF-8 output as FastAPI's JSONResponse.
+
+The response_model stays on each route for the OpenAPI schema.
+"""
+
+import json
+import typing
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Iterable, List
+
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # Optional: the standard library produces the same bytes, slower
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_UTC_Z)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def _to_float(value):
+    return float(value) if value is not None else None
+
+
+def _to_int(value):
+    return int(value) if value is not None else None
+
+
+def _converter(annotation):
+    """Conversion for one field: float and int are coerced, everything else passes through."""
+    if typing.get_origin(annotation) is typing.Union:
+        args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        annotation = args[0] if len(args) == 1 else None
+    if annotation is float:
+        return _to_float
+    if annotation is int:
+        return _to_int
+    return None
+
+
+class RowEncoder:
+    """Turns row dicts into dicts with exactly a Pydantic model's output keys and types."""
+
+    def __init__(self, model):
+        self.fields = []
+        for name, field in model.model_fields.items():
+            key = field.alias or name  # FastAPI responds by alias
+            default = None if field.is_required() else field.get_default(call_default_factory=True)
+            self.fields.append((key, _converter(field.annotation), default))
+
+    def row(self, row: dict) -> dict:
+        encoded = {}
+        for key, convert, default in self.fields:
+            value = row.get(key, default)
+            encoded[key] = convert(value) if convert is not None else value
+        return encoded
+
+    def rows(self, rows: Iterable[dict]) -> List[dict]:
+        return [self.row(row) for row in rows]
@@ -0,0 +1,162 @@
+"""
+Item-to-item similarity model behind /api/recommendations.
+
+04_utilities/build_item_similarity.py builds the model offline from user_cart
+and user_favorites: the cosine similarity between the sets of users holding
+each pair of products, keeping the top k neighbours of every product. It is
+saved as one .npz file with the neighbour lists in CSR layout:
+
+- items: every barcode that has neighbours
+- indptr: item i's neighbours are neighbors[indptr[i]:indptr[i + 1]]
+- neighbors: int32 positions in items, most similar first
+- scores: float32 similarities matching neighbors
+
+The API only needs numpy to load it. A request looks up the neighbours of the
+user's cart and favorites and sums their scores, so the cost is O(k) per seed
+product however large the catalog is, and ties break by barcode so the same
+inputs always give the same ranking.
+
+The file is reloaded when the data_versions watcher reports a run and, since
+the job runs on its own schedule, in the background when a request finds the
+file was last checked more than refresh_seconds ago.
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "item_similarity.npz")
+
+
+def save_model(path: str, items: List[str], indptr, neighbors, scores, meta: Optional[dict] = None):
+    """Write a model file atomically, so a loading API never sees half of it."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    meta = meta or {}
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez_compressed(
+            f,
+            items=np.asarray(items, dtype=str),
+            indptr=np.asarray(indptr, dtype=np.int64),
+            neighbors=np.asarray(neighbors, dtype=np.int32),
+            scores=np.asarray(scores, dtype=np.float32),
+            meta_keys=np.asarray(list(meta.keys()), dtype=str),
+            meta_values=np.asarray([float(v) for v in meta.values()], dtype=np.float64),
+        )
+    os.replace(tmp_path, path)
+
+
+class _SimilaritySnapshot:
+    def __init__(self, data, mtime: float):
+        self.items = data["items"].tolist()
+        self.index = {barcode: i for i, barcode in enumerate(self.items)}
+        self.indptr = data["indptr"]
+        self.neighbors = data["neighbors"]
+        self.scores = data["scores"]
+        self.meta = dict(zip(data["meta_keys"].tolist(), data["meta_values"].tolist()))
+        self.mtime = mtime
+
+
+class ItemSimilarity:
+    def __init__(self, path: str = DEFAULT_MODEL_PATH, refresh_seconds: float = 300.0):
+        """
+        Args:
+            path: Model file written by build_item_similarity.py
+            refresh_seconds: Age after which the next request checks the file for a new model
+        """
+        self.path = path
+        self.refresh_seconds = refresh_seconds
+        self._snapshot: Optional[_SimilaritySnapshot] = None
+        self._build_lock = threading.Lock()
+        self._refreshing = threading.Event()
+        self._checked_at = None
+        self.version = None
+        self.load_seconds = None
+
+    def recommend(self, seeds: Iterable[str], exclude: Iterable[str], limit: int) -> List[str]:
+        """
+        Up to `limit` barcodes ranked by summed similarity to the seed products,
+        highest first, ties by barcode. Products in `exclude` are skipped; empty
+        when no model is loaded or no seed has neighbours.
+        """
+        if self._checked_at is None or time.monotonic() - self._checked_at > self.refresh_seconds:
+            self._refresh_in_background()
+        snapshot = self._snapshot
+        if snapshot is None:
+            return []
+
+        excluded = set(exclude)
+        totals: Dict[int, float] = {}
+        for barcode in dict.fromkeys(seeds):
+            i = snapshot.index.get(barcode)
+            if i is None:
+                continue
+            start, end = snapshot.indptr[i], snapshot.indptr[i + 1]
+            for j, score in zip(snapshot.neighbors[start:end].tolist(), snapshot.scores[start:end].tolist()):
+                totals[j] = totals.get(j, 0.0) + score
+
+        ranked = sorted(
+            ((score, snapshot.items[j]) for j, score in totals.items() if snapshot.items[j] not in excluded),
+            key=lambda pair: (-pair[0], pair[1])
+        )
+        return [barcode for _, barcode in ranked[:limit]]
+
+    def _refresh_in_background(self):
+        if self._refreshing.is_set():
+            return
+        self._refreshing.set()
+
+        def refresh():
+            try:
+                self.rebuild(self.version)
+            except Exception as e:
+                logger.error(f"Background item similarity reload failed: {e}")
+            finally:
+                self._refreshing.clear()
+
+        threading.Thread(target=refresh, name="item-similarity-refresh", daemon=True).start()
+
+    def rebuild(self, version: Optional[int] = None, only_if_missing: bool = False):
+        """Load the model file if it changed since the last load and swap it in atomically."""
+        with self._build_lock:
+            self.version = version
+            snapshot = self._snapshot
+            if only_if_missing and snapshot is not None:
+                return
+            first_check = self._checked_at is None
+            self._checked_at = time.monotonic()
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                if first_check:
+                    logger.warning(f"No item similarity model at {self.path}; recommendations use preferences only")
+                return
+            if snapshot is not None and snapshot.mtime == mtime:
+                return
+
+            started = time.monotonic()
+            with np.load(self.path, allow_pickle=False) as data:
+                snapshot = _SimilaritySnapshot(data, mtime)
+            self._snapshot = snapshot
+            self.load_seconds = round(time.monotonic() - started, 3)
+            logger.info(
+                f"Item similarity model loaded: {len(snapshot.items)} products, "
+                f"{len(snapshot.neighbors)} neighbours in {self.load_seconds}s"
+            )
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            'ready': snapshot is not None,
+            'path': self.path,
+            'products': len(snapshot.items) if snapshot else 0,
+            'neighbors': len(snapshot.neighbors) if snapshot else 0,
+            'built_at': snapshot.meta.get('built_at') if snapshot else None,
+            'load_seconds': self.load_seconds,
+        }
@@ -0,0 +1,213 @@
+"""
+Write-behind queue for user preference tracking.
+
+Adding a product to favorites or the cart bumps the user's category and brand
+preference scores. Instead of upserting user_preferences inside the request,
+endpoints record the increments here; they are coalesced per
+(user_id, preference_type, preference_value) and a background worker writes
+them in one set-based upsert per flush.
+
+Staleness is bounded: pending increments are flushed at least every
+flush_interval seconds (sooner once batch_size keys are pending), and stop()
+flushes whatever is left, so a clean shutdown loses nothing.
+
+A key the database rejects (e.g. a user deleted meanwhile, a value too long)
+would fail the whole upsert; the batch is then written key by key and only
+the rejected keys are dropped. Other failures (connection lost) requeue the
+batch for the next flush.
+"""
+
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
+
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+PreferenceKey = Tuple[int, str, str]  # (user_id, preference_type, preference_value)
+
+UPSERT_PREFERENCES_SQL = """
+    INSERT INTO user_preferences (user_id, preference_type, preference_value, interaction_score, last_updated)
+    SELECT increment.user_id, increment.preference_type, increment.preference_value, increment.score, NOW()
+    FROM unnest(%s::int[], %s::text[], %s::text[], %s::int[])
+        AS increment(user_id, preference_type, preference_value, score)
+    ON CONFLICT (user_id, preference_type, preference_value)
+    DO UPDATE SET
+        interaction_score = user_preferences.interaction_score + EXCLUDED.interaction_score,
+        last_updated = NOW()
+"""
+
+
+def _upsert_params(batch: Dict[PreferenceKey, int]) -> tuple:
+    return (
+        [user_id for user_id, _, _ in batch],
+        [preference_type for _, preference_type, _ in batch],
+        [value for _, _, value in batch],
+        list(batch.values()),
+    )
+
+
+class PreferenceQueue:
+    def __init__(
+        self,
+        db_pool,
+        flush_interval: float = 2.0,
+        batch_size: int = 500,
+        max_pending: int = 50000,
+        on_flush: Optional[Callable[[Set[int]], None]] = None,
+    ):
+        """
+        Args:
+            db_pool: DatabasePool used by the flushing worker
+            flush_interval: Maximum seconds an increment waits before being written
+            batch_size: Flush early once this many distinct keys are pending
+            max_pending: Increments for new keys are dropped (and counted) beyond this
+            on_flush: Called with the user IDs whose preferences a flush just wrote
+        """
+        self.db_pool = db_pool
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.on_flush = on_flush
+        self._pending: Dict[PreferenceKey, int] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.recorded = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.dropped = 0  # Increments (not keys), from max_pending or rejected keys
+        self.rejected_keys = 0
+        self.last_flush_at = None
+
+    def record(self, user_id: int, product: dict):
+        """Queue one interaction with a product (a dict with category and brand)."""
+        self.record_many(user_id, [product])
+
+    def record_many(self, user_id: int, products: Iterable[dict]):
+        """Queue one interaction per product."""
+        with self._lock:
+            for product in products:
+                for preference_type in ('category', 'brand'):
+                    value = product.get(preference_type)
+                    if not value:
+                        continue
+                    key = (user_id, preference_type, value)
+                    if key not in self._pending and len(self._pending) >= self.max_pending:
+                        self.dropped += 1
+                        continue
+                    self._pending[key] = self._pending.get(key, 0) + 1
+                    self.recorded += 1
+            if len(self._pending) >= self.batch_size:
+                self._wakeup.set()
+
+    def flush(self) -> int:
+        """Write all pending increments now. Returns the number of keys written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+
+            conn = self.db_pool.getconn()
+            try:
+                try:
+                    with conn.cursor() as cur:
+                        cur.execute(UPSERT_PREFERENCES_SQL, _upsert_params(batch))
+                    conn.commit()
+                    written = len(batch)
+                except (psycopg2.IntegrityError, psycopg2.DataError) as e:
+                    conn.rollback()
+                    logger.warning(f"Preference flush of {len(batch)} keys rejected, writing key by key: {e}")
+                    written = self._flush_key_by_key(conn, batch)
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"Preference flush failed, requeueing {len(batch)} keys: {e}")
+                self._requeue(batch)
+                raise
+            finally:
+                self.db_pool.putconn(conn)
+
+            self.flushed += written
+            self.flushes += 1
+            self.last_flush_at = time.time()
+            if self.on_flush is not None:
+                try:
+                    self.on_flush({user_id for user_id, _, _ in batch})
+                except Exception as e:
+                    logger.error(f"Preference flush callback failed: {e}")
+            return written
+
+    def _flush_key_by_key(self, conn, batch: Dict[PreferenceKey, int]) -> int:
+        """Upsert each key under its own savepoint, dropping the ones the database rejects."""
+        written = 0
+        with conn.cursor() as cur:
+            for key, score in batch.items():
+                cur.execute("SAVEPOINT preference")
+                try:
+                    cur.execute(UPSERT_PREFERENCES_SQL, _upsert_params({key: score}))
+                    cur.execute("RELEASE SAVEPOINT preference")
+                    written += 1
+                except (psycopg2.IntegrityError, psycopg2.DataError) as e:
+                    cur.execute("ROLLBACK TO SAVEPOINT preference")
+                    with self._lock:
+                        self.dropped += score
+                        self.rejected_keys += 1
+                    logger.error(f"Dropping preference increment {key} (+{score}): {e}")
+        conn.commit()
+        return written
+
+    def _requeue(self, batch: Dict[PreferenceKey, int]):
+        with self._lock:
+            for key, score in batch.items():
+                if key not in self._pending and len(self._pending) >= self.max_pending:
+                    self.dropped += score
+                    continue
+                self._pending[key] = self._pending.get(key, 0) + score
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="preference-queue", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the worker and flush everything still pending."""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 10)
+            self._thread = None
+        try:
+            self.flush()
+        except Exception:
+            logger.error(f"Lost {len(self._pending)} pending preference updates at shutdown")
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                # Already logged and requeued; back off until the next interval
+                self._stop.wait(self.flush_interval)
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            'pending_keys': pending,
+            'recorded': self.recorded,
+            'flushed_keys': self.flushed,
+            'flushes': self.flushes,
+            'dropped_increments': self.dropped,
+            'rejected_keys': self.rejected_keys,
+            'last_flush_at': self.last_flush_at,
+            'flush_interval': self.flush_interval,
+        }
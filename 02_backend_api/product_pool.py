@@ -0,0 +1,182 @@
+"""
+In-memory pool of recommendable products behind the popular and cold-start
+recommendations.
+
+The pool is the array of every active, priced, imaged product plus a
+cumulative weight array: 1 + POPULARITY_WEIGHT x (number of users who have the
+product in their cart or favorites). A weighted draw is a bisect over the
+cumulative weights, so sampling k products costs O(k log n) however large the
+catalog is.
+
+The pool is rebuilt after every ETL run (and after the deactivation scripts)
+via data_versions. Popularity also drifts as users shop, so a pool older than
+refresh_seconds is rebuilt in the background on the next request while that
+request is still served from the current pool.
+"""
+
+import bisect
+import logging
+import random
+import threading
+import time
+from itertools import accumulate
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# How much one cart/favorite entry outweighs the baseline every product gets
+POPULARITY_WEIGHT = 5.0
+
+PRODUCT_POOL_QUERY = """
+    SELECT
+        cp.barcode AS product_id,
+        cp.barcode,
+        cp.name,
+        cp.brand,
+        cp.image_url,
+        cp.lowest_price,
+        COALESCE(pop.interactions, 0) AS interactions
+    FROM canonical_products cp
+    LEFT JOIN (
+        SELECT product_barcode, COUNT(*) AS interactions
+        FROM (
+            SELECT product_barcode FROM user_cart
+            UNION ALL
+            SELECT product_barcode FROM user_favorites
+        ) all_interactions
+        GROUP BY product_barcode
+    ) pop ON pop.product_barcode = cp.barcode
+    WHERE cp.is_active = TRUE
+      AND cp.lowest_price IS NOT NULL
+      AND cp.image_url IS NOT NULL
+      AND cp.image_url NOT LIKE '%placeholder%'
+"""
+
+
+class _ProductSnapshot:
+    def __init__(self, products: List[dict], weights: List[float]):
+        self.products = products
+        self.cum_weights = list(accumulate(weights))
+        self.total_weight = self.cum_weights[-1] if self.cum_weights else 0.0
+        self.built_at = time.monotonic()
+
+
+class ProductPool:
+    def __init__(self, db_pool, refresh_seconds: float = 600.0):
+        """
+        Args:
+            db_pool: DatabasePool used for rebuilds
+            refresh_seconds: Age after which the next request triggers a background rebuild
+        """
+        self.db_pool = db_pool
+        self.refresh_seconds = refresh_seconds
+        self._snapshot: Optional[_ProductSnapshot] = None
+        self._build_lock = threading.Lock()
+        self._refreshing = threading.Event()
+        self.version = None
+        self.build_seconds = None
+
+    def _weighted_indexes(self, snapshot: _ProductSnapshot, k: int) -> List[int]:
+        """k distinct indexes, each drawn in proportion to its weight among those left."""
+        n = len(snapshot.products)
+        if k >= n:
+            indexes = list(range(n))
+            random.shuffle(indexes)
+            return indexes
+
+        chosen = []
+        seen = set()
+        # Rejecting repeats keeps the draw exact; a few very heavy products could
+        # make repeats common, so fall back to uniform picks after enough tries
+        attempts = 0
+        while len(chosen) < k and attempts < k * 20:
+            attempts += 1
+            index = bisect.bisect_right(snapshot.cum_weights, random.random() * snapshot.total_weight)
+            index = min(index, n - 1)
+            if index not in seen:
+                seen.add(index)
+                chosen.append(index)
+        while len(chosen) < k:
+            index = random.randrange(n)
+            if index not in seen:
+                seen.add(index)
+                chosen.append(index)
+        return chosen
+
+    def sample(self, k: int, weighted: bool = True, wait: bool = True) -> List[dict]:
+        """
+        Up to k distinct products, drawn by popularity (or uniformly). A pool
+        not built yet is built now, or with wait=False in the background while
+        this call returns nothing.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            if not wait:
+                self._refresh_in_background()
+                return []
+            self.rebuild(self.version, only_if_missing=True)
+            snapshot = self._snapshot
+        elif time.monotonic() - snapshot.built_at > self.refresh_seconds:
+            self._refresh_in_background()
+
+        if not snapshot.products:
+            return []
+        if weighted:
+            return [snapshot.products[i] for i in self._weighted_indexes(snapshot, k)]
+        return random.sample(snapshot.products, min(k, len(snapshot.products)))
+
+    def _refresh_in_background(self):
+        if self._refreshing.is_set():
+            return
+        self._refreshing.set()
+
+        def refresh():
+            try:
+                self.rebuild(self.version)
+            except Exception as e:
+                logger.error(f"Background product pool refresh failed: {e}")
+            finally:
+                self._refreshing.clear()
+
+        threading.Thread(target=refresh, name="product-pool-refresh", daemon=True).start()
+
+    def rebuild(self, version: Optional[int] = None, only_if_missing: bool = False):
+        """Reload the pool from the database and swap it in atomically."""
+        with self._build_lock:
+            if only_if_missing and self._snapshot is not None:
+                return
+            started = time.monotonic()
+            conn = self.db_pool.getconn()
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(PRODUCT_POOL_QUERY)
+                    rows = cur.fetchall()
+            finally:
+                self.db_pool.putconn(conn)
+
+            products = []
+            weights = []
+            for row in rows:
+                interactions = row.pop('interactions')
+                row['lowest_price'] = float(row['lowest_price'])
+                products.append(row)
+                weights.append(1.0 + POPULARITY_WEIGHT * interactions)
+
+            self._snapshot = _ProductSnapshot(products, weights)
+            self.version = version
+            self.build_seconds = round(time.monotonic() - started, 3)
+            logger.info(
+                f"Product pool rebuilt: {len(products)} products in {self.build_seconds}s "
+                f"(data version {version})"
+            )
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            'ready': snapshot is not None,
+            'products': len(snapshot.products) if snapshot else 0,
+            'total_weight': snapshot.total_weight if snapshot else 0.0,
+            'age_seconds': round(time.monotonic() - snapshot.built_at, 1) if snapshot else None,
+            'data_version': self.version,
+            'build_seconds': self.build_seconds,
+        }
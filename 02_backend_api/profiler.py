@@ -0,0 +1,168 @@
+"""
+Opt-in sampling profiler for single API requests.
+
+An admin (X-Admin-Token in ADMIN_TOKENS) adds `X-Profile: 1` or `?_profile=1`
+to a request. While it runs, a RequestProfiler thread samples the Python
+stacks of the threads that serve requests (the event loop and Starlette's
+threadpool workers) every interval_ms, so Pydantic validation, response
+serialization and Python loops show up next to the SQL calls.
+
+Samples are aggregated as folded stacks ("thread;outer;...;inner count"), the
+input format of flamegraph.pl, inferno and speedscope. Finished profiles are
+kept in a ProfileStore and served on /api/metrics/profiles/{id}; the profiled
+response carries the id in X-Profile-Id.
+
+Requests that are not profiled pay one header lookup. Threads that are idle
+(waiting for work) are skipped; requests running concurrently with the
+profiled one do show up, and the profile reports how many there were.
+"""
+
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from typing import Callable, Optional
+
+# Stacks made only of these modules are a thread waiting for work
+_PLUMBING_MODULES = {
+    '__main__', 'anyio', 'asyncio', 'concurrent', 'queue', 'runpy', 'selectors', 'threading', 'uvicorn', 'uvloop',
+}
+
+# Threads that run request code
+_REQUEST_THREAD_PREFIXES = ('AnyIO worker thread',)
+
+MAX_STACK_DEPTH = 128
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _folded_stack(frame) -> Optional[str]:
+    """Outermost-first frame labels joined with ';', or None for an idle thread."""
+    labels = []
+    busy = False
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        module = frame.f_globals.get('__name__', '').split('.')[0]
+        if module not in _PLUMBING_MODULES:
+            busy = True
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    if not busy:
+        return None
+    labels.reverse()
+    return ';'.join(labels)
+
+
+class RequestProfiler:
+    def __init__(
+        self,
+        label: str,
+        interval_ms: float = 2.0,
+        max_seconds: float = 60.0,
+        in_flight: Optional[Callable[[], int]] = None,
+    ):
+        """
+        Args:
+            label: Request being profiled ("GET /api/...")
+            interval_ms: Time between samples
+            max_seconds: Sampling stops after this long even if the request has not finished
+            in_flight: Returns how many requests are being served right now
+        """
+        self.id = uuid.uuid4().hex[:12]
+        self.label = label
+        self.interval = interval_ms / 1000
+        self.max_seconds = max_seconds
+        self.in_flight = in_flight
+        self.loop_thread_id = threading.get_ident()  # Started from the event loop
+        self.stacks = Counter()
+        self.samples = 0
+        self.max_in_flight = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self.started_at = None
+        self.duration_ms = None
+
+    def start(self) -> "RequestProfiler":
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> "RequestProfiler":
+        self._stop.set()
+        self._thread.join()
+        self.duration_ms = round((time.perf_counter() - self._started) * 1000, 2)
+        return self
+
+    def _request_threads(self) -> dict:
+        threads = {self.loop_thread_id: 'event-loop'}
+        for thread in threading.enumerate():
+            if thread.name.startswith(_REQUEST_THREAD_PREFIXES):
+                threads[thread.ident] = 'worker'
+        return threads
+
+    def _run(self):
+        deadline = time.perf_counter() + self.max_seconds
+        while not self._stop.wait(self.interval) and time.perf_counter() < deadline:
+            threads = self._request_threads()
+            frames = sys._current_frames()
+            for thread_id, kind in threads.items():
+                frame = frames.get(thread_id)
+                stack = _folded_stack(frame) if frame is not None else None
+                if stack is not None:
+                    self.stacks[f"{kind};{stack}"] += 1
+            self.samples += 1
+            if self.in_flight is not None:
+                self.max_in_flight = max(self.max_in_flight, self.in_flight())
+
+    def folded(self) -> str:
+        """Folded stacks, one "frame;frame;... count" line each, heaviest first."""
+        return '\n'.join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + '\n'
+
+    def summary(self) -> dict:
+        return {
+            'id': self.id,
+            'request': self.label,
+            'started_at': self.started_at,
+            'duration_ms': self.duration_ms,
+            'samples': self.samples,
+            'interval_ms': self.interval * 1000,
+            'concurrent_requests': max(self.max_in_flight - 1, 0),
+            'top_frames': self._top_frames(10),
+        }
+
+    def _top_frames(self, limit: int) -> list:
+        """Innermost frames by sample count (self time)."""
+        leaf_counts = Counter()
+        for stack, count in self.stacks.items():
+            leaf_counts[stack.rsplit(';', 1)[-1]] += count
+        return [{'frame': frame, 'samples': count} for frame, count in leaf_counts.most_common(limit)]
+
+
+class ProfileStore:
+    """The most recent finished profiles, by id."""
+
+    def __init__(self, max_profiles: int = 20):
+        self.max_profiles = max_profiles
+        self._profiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, profiler: RequestProfiler):
+        with self._lock:
+            self._profiles[profiler.id] = profiler
+            while len(self._profiles) > self.max_profiles:
+                self._profiles.popitem(last=False)
+
+    def get(self, profile_id: str) -> Optional[RequestProfiler]:
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+    def summaries(self) -> list:
+        with self._lock:
+            profiles = list(self._profiles.values())
+        return [profiler.summary() for profiler in reversed(profiles)]
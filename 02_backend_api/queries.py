@@ -0,0 +1,468 @@
+"""
+SQL shared by the sync (psycopg2) and async (asyncpg) request paths.
+
+Queries are written with psycopg2 placeholders (%s, and %% for a literal %).
+The async path converts them with to_asyncpg_sql() so both implementations
+always run exactly the same statements.
+"""
+
+import itertools
+import re
+
+# Full product detail: latest price per store plus active promotions.
+# Latest prices come from current_prices (one row per product/store, kept up to
+# date by the ETLs), so the cost depends on the number of stores, not on history.
+# Parameters: (barcode, barcode)
+PRODUCT_DETAIL_QUERY = """
+    WITH latest_prices AS (
+        SELECT
+            cur.retailer_product_id,
+            cur.store_id,
+            cur.price,
+            cur.scraped_at
+        FROM current_prices cur
+        JOIN retailer_products rp ON cur.retailer_product_id = rp.retailer_product_id
+        WHERE rp.barcode = %s
+    )
+    SELECT
+        cp.barcode,
+        cp.name,
+        cp.brand,
+        cp.image_url,
+        (
+            SELECT json_agg(
+                json_build_object(
+                    'retailer_id', r.retailerid,
+                    'retailer_name', r.retailername,
+                    'store_id', s.storeid,
+                    'store_name', s.storename,
+                    'store_address', s.address,
+                    'price', lp.price,
+                    'last_updated', lp.scraped_at,
+                    'in_stock', true
+                ) ORDER BY lp.price ASC
+            )
+            FROM latest_prices lp
+            JOIN stores s ON lp.store_id = s.storeid
+            JOIN retailers r ON s.retailerid = r.retailerid
+            WHERE s.isactive = true
+        ) as prices,
+        (
+            SELECT json_agg(
+                json_build_object(
+                    'deal_id', prom.promotion_id,
+                    'title', prom.description,
+                    'description', prom.remarks,
+                    'retailer_name', r.retailername,
+                    'store_id', prom.store_id
+                )
+            )
+            FROM promotions prom
+            JOIN promotion_product_links ppl ON prom.promotion_id = ppl.promotion_id
+            JOIN retailer_products rp ON ppl.retailer_product_id = rp.retailer_product_id
+            JOIN retailers r ON prom.retailer_id = r.retailerid
+            WHERE rp.barcode = cp.barcode
+              AND (prom.end_date IS NULL OR prom.end_date >= NOW())
+        ) as promotions
+    FROM canonical_products cp
+    WHERE cp.barcode = %s
+      AND cp.is_active = true;
+"""
+
+
+# Product detail for many barcodes in one set-based statement: same output as
+# PRODUCT_DETAIL_QUERY, one row per active product, prices and promotions
+# aggregated per barcode. Passing store IDs limits prices to those stores (and
+# promotions to those stores or chain-wide ones); NULL means all stores.
+# Parameters: product_batch_params(barcodes, store_ids)
+PRODUCT_BATCH_QUERY = """
+    WITH requested AS (
+        SELECT DISTINCT unnest(%s::text[]) AS barcode
+    ),
+    latest_prices AS (
+        SELECT
+            rp.barcode,
+            cur.store_id,
+            cur.price,
+            cur.scraped_at
+        FROM requested req
+        JOIN retailer_products rp ON rp.barcode = req.barcode
+        JOIN current_prices cur ON cur.retailer_product_id = rp.retailer_product_id
+        WHERE %s::int[] IS NULL OR cur.store_id = ANY(%s::int[])
+    ),
+    price_lists AS (
+        SELECT
+            lp.barcode,
+            json_agg(
+                json_build_object(
+                    'retailer_id', r.retailerid,
+                    'retailer_name', r.retailername,
+                    'store_id', s.storeid,
+                    'store_name', s.storename,
+                    'store_address', s.address,
+                    'price', lp.price,
+                    'last_updated', lp.scraped_at,
+                    'in_stock', true
+                ) ORDER BY lp.price ASC
+            ) AS prices
+        FROM latest_prices lp
+        JOIN stores s ON lp.store_id = s.storeid
+        JOIN retailers r ON s.retailerid = r.retailerid
+        WHERE s.isactive = true
+        GROUP BY lp.barcode
+    ),
+    promotion_lists AS (
+        SELECT
+            rp.barcode,
+            json_agg(
+                json_build_object(
+                    'deal_id', prom.promotion_id,
+                    'title', prom.description,
+                    'description', prom.remarks,
+                    'retailer_name', r.retailername,
+                    'store_id', prom.store_id
+                )
+            ) AS promotions
+        FROM requested req
+        JOIN retailer_products rp ON rp.barcode = req.barcode
+        JOIN promotion_product_links ppl ON ppl.retailer_product_id = rp.retailer_product_id
+        JOIN promotions prom ON prom.promotion_id = ppl.promotion_id
+        JOIN retailers r ON prom.retailer_id = r.retailerid
+        WHERE (prom.end_date IS NULL OR prom.end_date >= NOW())
+          AND (%s::int[] IS NULL OR prom.store_id IS NULL OR prom.store_id = ANY(%s::int[]))
+        GROUP BY rp.barcode
+    )
+    SELECT
+        cp.barcode,
+        cp.name,
+        cp.brand,
+        cp.image_url,
+        pl.prices,
+        prl.promotions
+    FROM requested req
+    JOIN canonical_products cp ON cp.barcode = req.barcode
+    LEFT JOIN price_lists pl ON pl.barcode = cp.barcode
+    LEFT JOIN promotion_lists prl ON prl.barcode = cp.barcode
+    WHERE cp.is_active = true;
+"""
+
+
+def product_batch_params(barcodes, store_ids):
+    """Parameters for PRODUCT_BATCH_QUERY."""
+    return (list(barcodes), store_ids, store_ids, store_ids, store_ids)
+
+
+# Current prices for a cart, one row per active store that sells any of it:
+# `items` are 0-based positions in the barcode list and `prices` the matching
+# prices (a product listed twice at a store appears twice). This is the input
+# of basket_optimizer.BasketOptimizer. NULL retailer/store IDs mean no limit.
+# Parameters: cart_store_prices_params(barcodes, retailer_ids, store_ids)
+CART_STORE_PRICES_QUERY = """
+    SELECT
+        cur.store_id,
+        s.retailerid AS retailer_id,
+        array_agg(cart.item - 1) AS items,
+        array_agg(cur.price::float8) AS prices
+    FROM unnest(%s::text[]) WITH ORDINALITY AS cart(barcode, item)
+    JOIN retailer_products rp ON rp.barcode = cart.barcode
+    JOIN current_prices cur ON cur.retailer_product_id = rp.retailer_product_id
+    JOIN stores s ON s.storeid = cur.store_id
+    WHERE s.isactive = true
+      AND (%s::int[] IS NULL OR s.retailerid = ANY(%s::int[]))
+      AND (%s::int[] IS NULL OR cur.store_id = ANY(%s::int[]))
+    GROUP BY cur.store_id, s.retailerid;
+"""
+
+
+def cart_store_prices_params(barcodes, retailer_ids, store_ids):
+    """Parameters for CART_STORE_PRICES_QUERY."""
+    return (list(barcodes), retailer_ids, retailer_ids, store_ids, store_ids)
+
+
+# Product summaries for recommended barcodes, limited to products the
+# recommendation endpoints may show. Rows come back in no particular order.
+# Parameters: (barcodes,)
+RECOMMENDED_PRODUCTS_QUERY = """
+    SELECT
+        cp.barcode AS product_id,
+        cp.barcode,
+        cp.name,
+        cp.brand,
+        cp.image_url,
+        cp.lowest_price
+    FROM canonical_products cp
+    WHERE cp.barcode = ANY(%s)
+      AND cp.is_active = TRUE
+      AND cp.lowest_price IS NOT NULL
+      AND cp.image_url IS NOT NULL
+      AND cp.image_url NOT LIKE '%%placeholder%%'
+"""
+
+
+# A user's materialized recommendation candidates (see
+# recommendation_candidates.py), best first, minus products now inactive or
+# already in their cart or favorites. No rows: the user has no candidates row
+# yet; one row with NULL product columns: none of their candidates are left.
+# Parameters: (limit, user_id)
+RECOMMENDATION_CANDIDATES_QUERY = """
+    SELECT
+        urc.data_version,
+        EXTRACT(EPOCH FROM NOW() - urc.computed_at) AS age_seconds,
+        c.product_id,
+        c.barcode,
+        c.name,
+        c.brand,
+        c.image_url,
+        c.lowest_price
+    FROM user_recommendation_candidates urc
+    LEFT JOIN LATERAL (
+        SELECT
+            candidate.rank,
+            cp.barcode AS product_id,
+            cp.barcode,
+            cp.name,
+            cp.brand,
+            cp.image_url,
+            cp.lowest_price
+        FROM unnest(urc.barcodes) WITH ORDINALITY AS candidate(barcode, rank)
+        JOIN canonical_products cp ON cp.barcode = candidate.barcode
+        WHERE cp.is_active = TRUE
+          AND cp.lowest_price IS NOT NULL
+          AND NOT EXISTS (
+              SELECT 1 FROM user_cart uc
+              WHERE uc.user_id = urc.user_id AND uc.product_barcode = candidate.barcode
+          )
+          AND NOT EXISTS (
+              SELECT 1 FROM user_favorites uf
+              WHERE uf.user_id = urc.user_id AND uf.product_barcode = candidate.barcode
+          )
+        ORDER BY candidate.rank
+        LIMIT %s
+    ) c ON TRUE
+    WHERE urc.user_id = %s
+    ORDER BY c.rank
+"""
+
+
+# Barcodes in a user's cart or favorites, which recommendations never show.
+# Parameters: (user_id, user_id)
+USER_HELD_BARCODES_QUERY = """
+    SELECT product_barcode FROM user_cart WHERE user_id = %s
+    UNION
+    SELECT product_barcode FROM user_favorites WHERE user_id = %s
+"""
+
+
+# Price history of one product: min/avg/max per retailer per day, week or
+# month over the last `buckets` buckets, the current one included. The ETLs
+# store price_timestamp as naive local time, so it is bucketed as is and only
+# NOW() is converted to the catalog time zone for the window bound. The ETLs
+# insert a row per price file per store, so this aggregates many rows into at
+# most buckets x retailers; it reads them through idx_prices_product_timestamp
+# (03_database/create_price_history_index.py).
+# Parameters: price_history_params(barcode, bucket, buckets, tz)
+PRICE_HISTORY_QUERY = """
+    SELECT
+        rp.retailer_id,
+        r.retailername AS retailer_name,
+        date_trunc(%s, p.price_timestamp)::date AS bucket_start,
+        MIN(p.price)::float8 AS min_price,
+        ROUND(AVG(p.price), 2)::float8 AS avg_price,
+        MAX(p.price)::float8 AS max_price,
+        COUNT(*) AS observations
+    FROM retailer_products rp
+    JOIN retailers r ON rp.retailer_id = r.retailerid
+    JOIN prices p ON p.retailer_product_id = rp.retailer_product_id
+    WHERE rp.barcode = %s
+      AND p.price > 0
+      AND p.price_timestamp >= date_trunc(%s, NOW() AT TIME ZONE %s) - %s::interval
+    GROUP BY rp.retailer_id, r.retailername, bucket_start
+    ORDER BY rp.retailer_id, bucket_start
+"""
+
+
+def price_history_params(barcode, bucket, buckets, tz):
+    """Parameters for PRICE_HISTORY_QUERY."""
+    lookback = f"{buckets - 1} {bucket}s"
+    return (bucket, barcode, bucket, tz, lookback)
+
+
+# Biggest price drops of the last `days` calendar days (today for 1, in the
+# given time zone), one row per product: its largest percentage drop among
+# the drops the ETLs recorded in price_changes that still stand (the store's
+# current price is no higher). Read as a detected_at range from price_changes'
+# indexes (03_database/create_price_changes_table.py).
+# Parameters: price_drops_params(days, tz, retailer_id, category, limit)
+PRICE_DROPS_QUERY = """
+    SELECT *
+    FROM (
+        SELECT DISTINCT ON (cp.barcode)
+            cp.barcode AS product_id,
+            cp.barcode,
+            cp.name,
+            cp.brand,
+            cp.image_url,
+            pc.retailer_id,
+            r.retailername AS retailer_name,
+            pc.store_id,
+            s.storename AS store_name,
+            pc.old_price::float8 AS old_price,
+            pc.new_price::float8 AS new_price,
+            ROUND(100 * (pc.old_price - pc.new_price) / pc.old_price, 1)::float8 AS drop_percent,
+            pc.price_timestamp AS changed_at
+        FROM price_changes pc
+        JOIN current_prices cur
+          ON cur.retailer_product_id = pc.retailer_product_id AND cur.store_id = pc.store_id
+        JOIN retailer_products rp ON rp.retailer_product_id = pc.retailer_product_id
+        JOIN canonical_products cp ON cp.barcode = rp.barcode
+        JOIN retailers r ON pc.retailer_id = r.retailerid
+        JOIN stores s ON s.storeid = pc.store_id
+        WHERE pc.detected_at >= (date_trunc('day', NOW() AT TIME ZONE %s) - %s::interval) AT TIME ZONE %s
+          AND (%s::int IS NULL OR pc.retailer_id = %s)
+          AND (%s::text IS NULL OR cp.category LIKE %s)
+          AND cur.price <= pc.new_price
+          AND s.isactive = true
+          AND cp.is_active = TRUE
+        ORDER BY cp.barcode, drop_percent DESC, pc.price_timestamp DESC
+    ) drops
+    ORDER BY drop_percent DESC, barcode
+    LIMIT %s
+"""
+
+
+def price_drops_params(days, tz, retailer_id, category, limit):
+    """Parameters for PRICE_DROPS_QUERY; category matches as a prefix, like search."""
+    category_prefix = f"{_like_escape(category)}%" if category else None
+    return (tz, f"{days - 1} days", tz, retailer_id, retailer_id, category_prefix, category_prefix, limit)
+
+
+def _like_escape(text: str) -> str:
+    """Escape LIKE wildcards so user input is matched literally."""
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _search_where_clause(q, category):
+    """WHERE clause and parameters shared by the search count and page queries."""
+    query_conditions = [
+        "is_active = true",
+        "lowest_price IS NOT NULL",
+        "image_url IS NOT NULL",
+        "image_url NOT LIKE '%%placeholder%%'"
+    ]
+    params = []
+
+    # Text match on name or brand: substring (ILIKE) or fuzzy (pg_trgm % operator).
+    # Both are served by the gin_trgm_ops indexes from create_search_indexes.py.
+    if q:
+        substring = f"%{_like_escape(q)}%"
+        query_conditions.append(
+            "(name ILIKE %s OR brand ILIKE %s OR name %% %s OR brand %% %s)"
+        )
+        params.extend([substring, substring, q, q])
+
+    # Add category filter if category is provided
+    # Use LIKE for prefix matching to support hierarchical categories (e.g., "טיפוח/הגנה מהשמש")
+    if category:
+        query_conditions.append("category LIKE %s")
+        params.append(f"{_like_escape(category)}%")
+
+    return " AND ".join(query_conditions), params
+
+
+def build_search_count_query(q, category):
+    """
+    Exact match count for /api/search. Callers cache it per (q, category),
+    so paging through results does not re-count.
+
+    Returns:
+        (count_query, count_params)
+    """
+    where_clause, params = _search_where_clause(q, category)
+    count_query = f"""
+        SELECT COUNT(*) as total
+        FROM canonical_products
+        WHERE {where_clause};
+    """
+    return count_query, tuple(params)
+
+
+def build_search_page_query(q, category, page_size, offset=0, after=None):
+    """
+    Page query for /api/search.
+
+    With a text query, results are ranked: exact name/brand match > prefix
+    (of the name or of any word in it) > substring > fuzzy, with trigram
+    similarity breaking ties inside a tier. Without one (category browsing)
+    they are ordered by name. Either way the order is total (barcode is the
+    final tie-breaker), so `after` - the (score, name, barcode) of the last row
+    of the previous page - gives keyset pagination that stays fast on deep pages.
+
+    Returns:
+        (page_query, page_params)
+    """
+    where_clause, params = _search_where_clause(q, category)
+
+    if q:
+        escaped = _like_escape(q)
+        score_sql = """
+            ROUND((
+                CASE
+                    WHEN lower(name) = lower(%s) OR lower(brand) = lower(%s) THEN 3
+                    WHEN name ILIKE %s OR name ILIKE %s OR brand ILIKE %s THEN 2
+                    WHEN name ILIKE %s OR brand ILIKE %s THEN 1
+                    ELSE 0
+                END
+                + GREATEST(similarity(name, %s), similarity(COALESCE(brand, ''), %s))
+            )::numeric, 4)
+        """
+        score_params = [
+            q, q,
+            f"{escaped}%", f"% {escaped}%", f"{escaped}%",
+            f"%{escaped}%", f"%{escaped}%",
+            q, q
+        ]
+    else:
+        score_sql = "0::numeric"
+        score_params = []
+
+    keyset_condition = ""
+    keyset_params = []
+    if after is not None:
+        after_score, after_name, after_barcode = after
+        keyset_condition = "WHERE (-score, name, barcode) > (-%s::numeric, %s, %s)"
+        keyset_params = [after_score, after_name, after_barcode]
+        offset = 0
+
+    page_query = f"""
+        SELECT product_id, barcode, name, brand, image_url, lowest_price, score
+        FROM (
+            SELECT
+                barcode as product_id,
+                barcode,
+                name,
+                brand,
+                COALESCE(image_url, 'https://via.placeholder.com/150?text=No+Image') as image_url,
+                lowest_price,
+                {score_sql} AS score
+            FROM canonical_products
+            WHERE {where_clause}
+        ) ranked
+        {keyset_condition}
+        ORDER BY score DESC, name, barcode
+        LIMIT %s OFFSET %s;
+    """
+    page_params = score_params + params + keyset_params + [page_size, offset]
+
+    return page_query, tuple(page_params)
+
+
+_PLACEHOLDER_RE = re.compile(r"%%|%s")
+
+
+def to_asyncpg_sql(sql: str) -> str:
+    """Rewrite psycopg2 placeholders (%s) as asyncpg ones ($1, $2, ...)."""
+    counter = itertools.count(1)
+    return _PLACEHOLDER_RE.sub(
+        lambda m: "%" if m.group() == "%%" else f"${next(counter)}",
+        sql
+    )
@@ -0,0 +1,171 @@
+"""
+Materialized per-user recommendation candidates behind /api/recommendations.
+
+Computing recommendations (item similarity lookups, the preference query) on
+every call is wasted work: a user's candidates only change when their cart,
+favorites or preferences do, or when the catalog does. CandidateRefresher
+keeps one user_recommendation_candidates row per user with their ranked
+candidate barcodes, so the endpoint is a primary-key read joined to
+canonical_products.
+
+Rows are refreshed incrementally:
+
+- Endpoints that change a user's cart or favorites, and PreferenceQueue after
+  writing their preference scores, mark the user. A background worker
+  recomputes a user once they have had no new marks for settle_seconds, so a
+  burst of cart edits costs one refresh.
+- Every row records the data version it was computed at. A read that finds a
+  row older than the latest run (or than max_age_seconds) still serves it, and
+  marks the user for a refresh.
+
+stop() refreshes everything still pending, so a clean shutdown loses nothing.
+"""
+
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, List
+
+logger = logging.getLogger(__name__)
+
+UPSERT_CANDIDATES_SQL = """
+    INSERT INTO user_recommendation_candidates (user_id, barcodes, data_version, computed_at)
+    VALUES (%s, %s, %s, NOW())
+    ON CONFLICT (user_id)
+    DO UPDATE SET
+        barcodes = EXCLUDED.barcodes,
+        data_version = EXCLUDED.data_version,
+        computed_at = NOW()
+"""
+
+
+class CandidateRefresher:
+    def __init__(
+        self,
+        db_pool,
+        compute: Callable[..., List[str]],
+        settle_seconds: float = 5.0,
+        max_age_seconds: float = 86400.0,
+        max_pending: int = 50000,
+    ):
+        """
+        Args:
+            db_pool: DatabasePool used by the refreshing worker
+            compute: compute(cursor, user_id) -> ranked candidate barcodes
+            settle_seconds: A user is refreshed once unmarked for this long
+            max_age_seconds: Rows older than this are refreshed when read, even without changes
+            max_pending: Marks for new users are dropped (and counted) beyond this
+        """
+        self.db_pool = db_pool
+        self.compute = compute
+        self.settle_seconds = settle_seconds
+        self.max_age_seconds = max_age_seconds
+        self.max_pending = max_pending
+        self._pending: Dict[int, float] = {}  # user_id -> last marked (monotonic)
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.version = 0
+        self.marked = 0
+        self.refreshed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.last_refresh_at = None
+
+    def mark(self, user_id: int):
+        """The user's inputs changed; refresh their candidates soon."""
+        self.mark_many([user_id])
+
+    def mark_many(self, user_ids: Iterable[int]):
+        now = time.monotonic()
+        with self._lock:
+            for user_id in user_ids:
+                if user_id not in self._pending and len(self._pending) >= self.max_pending:
+                    self.dropped += 1
+                    continue
+                self._pending[user_id] = now
+                self.marked += 1
+
+    def on_run(self, version: int):
+        """Catalog changed: rows computed before `version` are refreshed when next read."""
+        self.version = version
+
+    def is_stale(self, data_version: int, age_seconds: float) -> bool:
+        return data_version < self.version or age_seconds > self.max_age_seconds
+
+    def refresh(self, user_ids: List[int]) -> int:
+        """Recompute and store candidates for these users now. Returns how many were stored."""
+        if not user_ids:
+            return 0
+        with self._refresh_lock:
+            version = self.version
+            stored = 0
+            conn = self.db_pool.getconn()
+            try:
+                for user_id in user_ids:
+                    try:
+                        with conn.cursor() as cur:
+                            barcodes = self.compute(cur, user_id)
+                            cur.execute(UPSERT_CANDIDATES_SQL, (user_id, barcodes, version))
+                        conn.commit()
+                        stored += 1
+                    except Exception as e:
+                        # Marked again the next time the user changes something
+                        # or their recommendations are read
+                        conn.rollback()
+                        self.failed += 1
+                        logger.error(f"Recommendation candidate refresh for user {user_id} failed: {e}")
+            finally:
+                self.db_pool.putconn(conn)
+
+            self.refreshed += stored
+            self.last_refresh_at = time.time()
+            return stored
+
+    def _take_settled(self, everything: bool = False) -> List[int]:
+        cutoff = time.monotonic() - self.settle_seconds
+        with self._lock:
+            settled = [user_id for user_id, marked_at in self._pending.items() if everything or marked_at <= cutoff]
+            for user_id in settled:
+                del self._pending[user_id]
+        return settled
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="recommendation-candidates", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the worker and refresh every user still pending."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.settle_seconds + 30)
+            self._thread = None
+        try:
+            self.refresh(self._take_settled(everything=True))
+        except Exception as e:
+            logger.error(f"Pending recommendation candidate refreshes lost at shutdown: {e}")
+
+    def _run(self):
+        while not self._stop.wait(min(self.settle_seconds, 1.0)):
+            try:
+                self.refresh(self._take_settled())
+            except Exception as e:
+                logger.error(f"Recommendation candidate refresh failed: {e}")
+                self._stop.wait(self.settle_seconds)
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            'pending_users': pending,
+            'marked': self.marked,
+            'refreshed': self.refreshed,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'data_version': self.version,
+            'last_refresh_at': self.last_refresh_at,
+        }
@@ -0,0 +1,210 @@
+"""
+Per-request timing for the PharmMate API.
+
+The timing middleware in backend.py opens a RequestTiming for every request
+and keeps it in a context variable, which Starlette copies into the threadpool
+running sync endpoints and dependencies. While it is open:
+
+- TimedCursor (the pool's cursor factory) adds every statement's duration
+- DatabasePool reports how long each checkout waited
+
+When the response is ready the middleware turns it into a Server-Timing
+header and a JSON log line, and adds the durations to per-route latency
+histograms (RouteMetrics) that /api/metrics reports as p50/p95/p99.
+
+Work outside a request (background rebuilds, the preference queue) runs with
+no RequestTiming open and is not recorded. The asyncpg endpoints only report
+total time.
+"""
+
+import bisect
+import contextvars
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from psycopg2.extras import RealDictCursor
+
+# Upper bounds (ms) of the histogram buckets: 0.1 ms to about 2 minutes, each
+# bucket 25% wider than the last, so percentiles are within ~12% of exact
+BUCKET_BOUNDS_MS = [0.1 * 1.25 ** i for i in range(64)]
+
+# Statements kept per request for the log line; the rest are only counted
+MAX_RECORDED_STATEMENTS = 50
+
+_current = contextvars.ContextVar("request_timing", default=None)
+
+
+class RequestTiming:
+    def __init__(self, label: Optional[str] = None):
+        self.label = label  # "GET /api/..." for log lines about this request
+        self.started = time.perf_counter()
+        self.db_ms = 0.0
+        self.db_checkout_ms = 0.0
+        self.queries = 0
+        self.statements: List[Tuple[float, str]] = []  # (duration_ms, SQL)
+
+    def add_statement(self, duration_ms: float, sql: str):
+        self.db_ms += duration_ms
+        self.queries += 1
+        if len(self.statements) < MAX_RECORDED_STATEMENTS:
+            self.statements.append((duration_ms, sql))
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def slowest_statement(self) -> Optional[Tuple[float, str]]:
+        return max(self.statements, key=lambda s: s[0]) if self.statements else None
+
+    def server_timing(self, total_ms: float) -> str:
+        """Server-Timing header value: app time, SQL time and pool wait."""
+        app_ms = max(total_ms - self.db_ms - self.db_checkout_ms, 0.0)
+        return (
+            f'total;dur={total_ms:.1f}, '
+            f'app;dur={app_ms:.1f}, '
+            f'db;dur={self.db_ms:.1f};desc="{self.queries} queries", '
+            f'db-checkout;dur={self.db_checkout_ms:.1f}'
+        )
+
+
+def start_request(label: Optional[str] = None) -> Tuple[RequestTiming, contextvars.Token]:
+    timing = RequestTiming(label)
+    return timing, _current.set(timing)
+
+
+def finish_request(token: contextvars.Token):
+    _current.reset(token)
+
+
+def current() -> Optional[RequestTiming]:
+    return _current.get()
+
+
+def current_label() -> Optional[str]:
+    timing = _current.get()
+    return timing.label if timing is not None else None
+
+
+def record_checkout(waited_ms: float):
+    """DatabasePool checkout observer."""
+    timing = _current.get()
+    if timing is not None:
+        timing.db_checkout_ms += waited_ms
+
+
+def _statement_text(cursor, query) -> str:
+    if isinstance(query, bytes):
+        return query.decode('utf-8', 'replace')
+    return str(query)
+
+
+class TimedCursor(RealDictCursor):
+    """RealDictCursor that adds each statement's duration to the open RequestTiming."""
+
+    def execute(self, query, vars=None):
+        timing = _current.get()
+        if timing is None:
+            return super().execute(query, vars)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            timing.add_statement((time.perf_counter() - started) * 1000, _statement_text(self, query))
+
+    def executemany(self, query, vars_list):
+        timing = _current.get()
+        if timing is None:
+            return super().executemany(query, vars_list)
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            timing.add_statement((time.perf_counter() - started) * 1000, _statement_text(self, query))
+
+
+class LatencyHistogram:
+    """Fixed-bucket histogram; percentiles are read off the bucket bounds."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, value_ms: float):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS_MS, value_ms)] += 1
+        self.count += 1
+        self.sum_ms += value_ms
+        self.max_ms = max(self.max_ms, value_ms)
+
+    def percentile(self, fraction: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                if index == len(BUCKET_BOUNDS_MS):
+                    return self.max_ms
+                return min(BUCKET_BOUNDS_MS[index], self.max_ms)
+        return self.max_ms
+
+    def summary(self) -> dict:
+        return {
+            'p50_ms': round(self.percentile(0.50), 2),
+            'p95_ms': round(self.percentile(0.95), 2),
+            'p99_ms': round(self.percentile(0.99), 2),
+            'mean_ms': round(self.sum_ms / self.count, 2) if self.count else 0.0,
+            'max_ms': round(self.max_ms, 2),
+        }
+
+
+class _RouteStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0  # 5xx responses
+        self.queries = 0
+        self.total = LatencyHistogram()
+        self.db = LatencyHistogram()
+        self.db_checkout = LatencyHistogram()
+
+
+class RouteMetrics:
+    """Latency histograms per (method, route template), since startup."""
+
+    def __init__(self):
+        self._routes: Dict[Tuple[str, str], _RouteStats] = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def record(self, method: str, route: str, status_code: int, total_ms: float, timing: RequestTiming):
+        with self._lock:
+            stats = self._routes.get((method, route))
+            if stats is None:
+                stats = self._routes[(method, route)] = _RouteStats()
+            stats.requests += 1
+            if status_code >= 500:
+                stats.errors += 1
+            stats.queries += timing.queries
+            stats.total.add(total_ms)
+            stats.db.add(timing.db_ms)
+            stats.db_checkout.add(timing.db_checkout_ms)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            routes = {
+                f"{method} {route}": {
+                    'requests': stats.requests,
+                    'errors': stats.errors,
+                    'queries_per_request': round(stats.queries / stats.requests, 2),
+                    'total': stats.total.summary(),
+                    'db': stats.db.summary(),
+                    'db_checkout': stats.db_checkout.summary(),
+                }
+                for (method, route), stats in sorted(self._routes.items(), key=lambda item: item[0][::-1])
+            }
+        return {
+            'since': self.started_at,
+            'routes': routes,
+        }
@@ -0,0 +1,228 @@
+"""
+In-process prefix index behind /api/search/suggest.
+
+The index is a pair of parallel sorted arrays: normalized keys and the id of
+the suggestion each key belongs to. Every suggestion (product name, brand or
+category path) contributes one key per word start, so "קרם" finds both
+"קרם ידיים" and "ניוואה קרם לחות". A lookup is two bisects plus a top-k by
+popularity; for very short prefixes, whose ranges span thousands of keys, the
+top-k is precomputed at build time.
+
+Indexes are immutable once built. SuggestService swaps in a freshly built one
+with a single reference assignment, so readers never see a half-built index.
+"""
+
+import bisect
+import heapq
+import logging
+import re
+import threading
+import time
+import unicodedata
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Hebrew final letters fold onto their regular forms
+_FINAL_LETTERS = str.maketrans({
+    'ך': 'כ',
+    'ם': 'מ',
+    'ן': 'נ',
+    'ף': 'פ',
+    'ץ': 'צ',
+})
+
+# Gershayim, geresh and the ASCII/typographic quotes people type instead of
+# them. Removed outright so מ"ל, מ״ל and מל normalize identically.
+_QUOTES_RE = re.compile("[\"'`\u05F3\u05F4\u2018\u2019\u201C\u201D\u201E]")
+
+# Niqqud and cantillation marks (maqaf, paseq and sof pasuq are left to become separators)
+_HEBREW_MARKS_RE = re.compile("[\u0591-\u05BD\u05BF\u05C1\u05C2\u05C4\u05C5\u05C7]")
+
+_SEPARATORS_RE = re.compile(r"[^\w]+")
+
+# Prefixes up to this length get a precomputed top-k
+SHORT_PREFIX_LENGTH = 3
+MAX_SUGGESTIONS = 20
+
+
+def normalize_text(text: Optional[str]) -> str:
+    """
+    Normalize Hebrew/English text for prefix matching: case-fold, strip niqqud,
+    fold final letters, drop gershayim/quotes (מ"ל -> מל) and collapse any other
+    punctuation to single spaces.
+    """
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = _HEBREW_MARKS_RE.sub("", text)
+    text = _QUOTES_RE.sub("", text)
+    text = text.translate(_FINAL_LETTERS)
+    text = _SEPARATORS_RE.sub(" ", text)
+    return text.strip()
+
+
+def _word_start_keys(normalized: str) -> Iterable[str]:
+    """The normalized text from each word start onwards."""
+    words = normalized.split(" ")
+    for i in range(len(words)):
+        yield " ".join(words[i:])
+
+
+class SuggestIndex:
+    def __init__(self, suggestions: List[dict]):
+        """
+        Args:
+            suggestions: dicts with text, type, barcode (products only) and popularity
+        """
+        self.suggestions = suggestions
+        pairs = []
+        for suggestion_id, suggestion in enumerate(suggestions):
+            normalized = normalize_text(suggestion['text'])
+            for key in set(_word_start_keys(normalized)):
+                if key:
+                    pairs.append((key, suggestion_id))
+        pairs.sort()
+        self.keys = [key for key, _ in pairs]
+        self.suggestion_ids = [suggestion_id for _, suggestion_id in pairs]
+
+        # Rank used everywhere: most popular first, then shorter, then alphabetical
+        self._rank = [
+            (-s['popularity'], len(s['text']), s['text']) for s in suggestions
+        ]
+        self._short_prefix_top = self._precompute_short_prefixes()
+
+    def _top_ids(self, lo: int, hi: int, k: int) -> List[int]:
+        ids = set(self.suggestion_ids[lo:hi])
+        return heapq.nsmallest(k, ids, key=self._rank.__getitem__)
+
+    def _precompute_short_prefixes(self) -> Dict[str, List[int]]:
+        top = {}
+        prefixes = set()
+        for key in self.keys:
+            for length in range(1, SHORT_PREFIX_LENGTH + 1):
+                prefixes.add(key[:length])
+        for prefix in prefixes:
+            lo, hi = self._range(prefix)
+            top[prefix] = self._top_ids(lo, hi, MAX_SUGGESTIONS)
+        return top
+
+    def _range(self, prefix: str):
+        lo = bisect.bisect_left(self.keys, prefix)
+        hi = bisect.bisect_left(self.keys, prefix + "\U0010FFFF", lo)
+        return lo, hi
+
+    def lookup(self, query: str, k: int = 10) -> List[dict]:
+        prefix = normalize_text(query)
+        if not prefix:
+            return []
+        k = min(k, MAX_SUGGESTIONS)
+        if len(prefix) <= SHORT_PREFIX_LENGTH:
+            ids = self._short_prefix_top.get(prefix, [])[:k]
+        else:
+            lo, hi = self._range(prefix)
+            ids = self._top_ids(lo, hi, k)
+        return [self.suggestions[i] for i in ids]
+
+    def __len__(self):
+        return len(self.suggestions)
+
+
+class SuggestService:
+    """Owns the live SuggestIndex and rebuilds it from the database."""
+
+    def __init__(self, db_pool):
+        self.db_pool = db_pool
+        self.index: Optional[SuggestIndex] = None
+        self.version = None
+        self.built_at = None
+        self.build_seconds = None
+        self._build_lock = threading.Lock()
+
+    def suggest(self, query: str, k: int = 10) -> List[dict]:
+        index = self.index  # Take one reference; a rebuild may swap it meanwhile
+        if index is None:
+            return []
+        return index.lookup(query, k)
+
+    def _load_suggestions(self, cur) -> List[dict]:
+        # Popularity: how many users have the product in their cart or favorites
+        cur.execute("""
+            SELECT product_barcode AS barcode, COUNT(*) AS popularity
+            FROM (
+                SELECT product_barcode FROM user_cart
+                UNION ALL
+                SELECT product_barcode FROM user_favorites
+            ) interactions
+            GROUP BY product_barcode
+        """)
+        popularity = {row['barcode']: row['popularity'] for row in cur.fetchall()}
+
+        # Same visibility rules as /api/search, so every suggestion has results
+        cur.execute("""
+            SELECT barcode, name, brand, category
+            FROM canonical_products
+            WHERE is_active = true
+              AND lowest_price IS NOT NULL
+              AND image_url IS NOT NULL
+              AND image_url NOT LIKE '%placeholder%'
+        """)
+
+        suggestions = []
+        brands = {}
+        categories = {}
+        for row in cur.fetchall():
+            # Every product counts once so unpopular catalogs still rank by size
+            score = 1 + popularity.get(row['barcode'], 0)
+            if row['name']:
+                suggestions.append({
+                    'text': row['name'],
+                    'type': 'product',
+                    'barcode': row['barcode'],
+                    'popularity': score,
+                })
+            if row['brand']:
+                brands[row['brand']] = brands.get(row['brand'], 0) + score
+            if row['category']:
+                categories[row['category']] = categories.get(row['category'], 0) + score
+
+        suggestions.extend(
+            {'text': brand, 'type': 'brand', 'barcode': None, 'popularity': score}
+            for brand, score in brands.items()
+        )
+        suggestions.extend(
+            {'text': category, 'type': 'category', 'barcode': None, 'popularity': score}
+            for category, score in categories.items()
+        )
+        return suggestions
+
+    def rebuild(self, version: Optional[int] = None):
+        """Build a new index and swap it in atomically."""
+        with self._build_lock:
+            started = time.monotonic()
+            conn = self.db_pool.getconn()
+            try:
+                with conn.cursor() as cur:
+                    suggestions = self._load_suggestions(cur)
+            finally:
+                self.db_pool.putconn(conn)
+
+            index = SuggestIndex(suggestions)
+            self.index = index
+            self.version = version
+            self.built_at = time.time()
+            self.build_seconds = round(time.monotonic() - started, 3)
+            logger.info(
+                f"Suggest index rebuilt: {len(index)} suggestions, {len(index.keys)} keys "
+                f"in {self.build_seconds}s (data version {version})"
+            )
+
+    def stats(self) -> dict:
+        index = self.index
+        return {
+            'ready': index is not None,
+            'suggestions': len(index) if index else 0,
+            'keys': len(index.keys) if index else 0,
+            'data_version': self.version,
+            'build_seconds': self.build_seconds,
+        }
@@ -0,0 +1,340 @@
+"""
+Slow statement capture for the API and the ETLs.
+
+SlowQueryLog.cursor_factory() returns a cursor class that times every
+execute(). Statements slower than threshold_ms are captured with their
+parameters into an in-memory ring buffer (served on
+/api/metrics/slow-queries) and, optionally, the slow_queries table (created
+by 03_database/create_slow_queries_table.py), which is where the ETLs record
+theirs.
+
+A sample of captured statements is explained off the request path by a worker
+thread on its own connection:
+
+- reads (SELECT / WITH) get EXPLAIN (ANALYZE, BUFFERS) inside a READ ONLY
+  transaction that is rolled back
+- writes are never re-executed; they get a plain EXPLAIN (estimated plan)
+
+Plans are checked for the regressions PERFORMANCE_AUDIT_REPORT.md found:
+sequential scans on large tables, sorts that spilled to disk (external
+merge), and hash joins that spilled into multiple batches.
+
+The same statement shape is explained at most once per explain_interval, so a
+regression on a hot path costs one EXPLAIN, not one per request.
+"""
+
+import json
+import logging
+import queue
+import random
+import re
+import threading
+import time
+from collections import deque
+from typing import Callable, List, Optional
+
+from psycopg2 import extensions
+
+logger = logging.getLogger(__name__)
+
+# Tables with at least this many rows (pg_class.reltuples) are "large"
+LARGE_TABLE_ROWS = 50000
+
+MAX_STORED_SQL_CHARS = 4000
+MAX_STORED_PARAMS_CHARS = 1000
+
+INSERT_SLOW_QUERY_SQL = """
+    INSERT INTO slow_queries (captured_at, source, context, duration_ms, query, params, plan, analyzed, flags, explain_error)
+    VALUES (to_timestamp(%s), %s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+_READ_STATEMENT_RE = re.compile(r"^\s*(SELECT|WITH|VALUES|TABLE)\b", re.IGNORECASE)
+_WRITE_STATEMENT_RE = re.compile(r"^\s*(INSERT|UPDATE|DELETE|MERGE)\b", re.IGNORECASE)
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+def statement_fingerprint(sql: str) -> str:
+    """Statement shape: literals replaced and whitespace collapsed (first 500 chars)."""
+    return " ".join(_LITERAL_RE.sub("?", sql[:2000]).split())[:500]
+
+
+def _walk(plan: dict):
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from _walk(child)
+
+
+def plan_flags(plan: dict, table_rows: dict) -> List[str]:
+    """
+    Problems in an EXPLAIN (FORMAT JSON) plan tree.
+
+    Args:
+        plan: The top "Plan" node
+        table_rows: Estimated rows per relation name, for deciding what is large
+    """
+    flags = []
+    for node in _walk(plan):
+        node_type = node.get('Node Type')
+        if node_type == 'Seq Scan':
+            relation = node.get('Relation Name')
+            if table_rows.get(relation, 0) >= LARGE_TABLE_ROWS:
+                flags.append(f"seq_scan:{relation}")
+        elif node_type == 'Sort' and node.get('Sort Space Type') == 'Disk':
+            flags.append(f"disk_sort:{node.get('Sort Method', 'external')}")
+        elif node_type == 'Hash' and node.get('Hash Batches', 1) > 1:
+            flags.append(f"hash_spill:{node['Hash Batches']}_batches")
+    return sorted(set(flags))
+
+
+class SlowQueryLog:
+    def __init__(
+        self,
+        source: str,
+        connect: Callable,
+        release: Callable,
+        threshold_ms: float = 500.0,
+        explain_sample_rate: float = 1.0,
+        explain_interval: float = 300.0,
+        explain_timeout_ms: int = 30000,
+        max_entries: int = 200,
+        persist: bool = False,
+        context: Optional[Callable[[], Optional[str]]] = None,
+    ):
+        """
+        Args:
+            source: Stored with every entry ("api", "be_pharm_etl", ...)
+            connect: Returns a connection for the explain worker
+            release: Gives that connection back (putconn, close, ...)
+            threshold_ms: Statements at least this slow are captured
+            explain_sample_rate: Fraction of captured statements that get explained
+            explain_interval: Seconds before the same statement shape is explained again
+            explain_timeout_ms: statement_timeout for each EXPLAIN
+            max_entries: Size of the in-memory ring buffer
+            persist: Also insert every entry into the slow_queries table
+            context: Returns a label for the current work (the API passes the request path)
+        """
+        self.source = source
+        self.connect = connect
+        self.release = release
+        self.threshold_ms = threshold_ms
+        self.explain_sample_rate = explain_sample_rate
+        self.explain_interval = explain_interval
+        self.explain_timeout_ms = explain_timeout_ms
+        self.persist = persist
+        self.context = context
+        self._entries = deque(maxlen=max_entries)
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=100)
+        self._last_explained = {}  # fingerprint -> monotonic time
+        self._thread = None
+        self.captured = 0
+        self.explained = 0
+        self.explain_errors = 0
+        self.dropped = 0
+        self.persist_errors = 0
+
+    def cursor_factory(self, base=extensions.cursor):
+        """A subclass of `base` whose statements are checked against the threshold."""
+        log = self
+
+        class SlowQueryCursor(base):
+            def execute(self, query, vars=None):
+                started = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    log.observe(self, query, vars, (time.perf_counter() - started) * 1000)
+
+            def executemany(self, query, vars_list):
+                started = time.perf_counter()
+                try:
+                    return super().executemany(query, vars_list)
+                finally:
+                    log.observe(self, query, None, (time.perf_counter() - started) * 1000)
+
+        return SlowQueryCursor
+
+    def observe(self, cursor, query, vars, duration_ms: float):
+        """Capture one statement if it was slow (called by the cursor after every execute)."""
+        if duration_ms < self.threshold_ms or threading.current_thread() is self._thread:
+            return
+
+        # cursor.query is the statement exactly as sent, parameters included
+        sent = cursor.query
+        if isinstance(sent, bytes):
+            sent = sent.decode('utf-8', 'replace')
+        if not sent:
+            sent = query.decode('utf-8', 'replace') if isinstance(query, bytes) else str(query)
+
+        entry = {
+            'captured_at': time.time(),
+            'source': self.source,
+            'context': self.context() if self.context else None,
+            'duration_ms': round(duration_ms, 2),
+            'query': sent[:MAX_STORED_SQL_CHARS],
+            'params': repr(vars)[:MAX_STORED_PARAMS_CHARS] if vars is not None else None,
+            'plan': None,
+            'analyzed': False,
+            'flags': [],
+            'explain_error': None,
+        }
+        with self._lock:
+            self._entries.append(entry)
+            self.captured += 1
+        logger.warning(f"Slow query ({entry['duration_ms']} ms, {entry['context'] or self.source}): {' '.join(sent[:300].split())}")
+
+        if self._should_explain(sent):
+            try:
+                self._queue.put_nowait((entry, sent))
+                return
+            except queue.Full:
+                with self._lock:
+                    self.dropped += 1
+        if self.persist:
+            self._queue_persist_only(entry)
+
+    def _should_explain(self, sql: str) -> bool:
+        if not (_READ_STATEMENT_RE.match(sql) or _WRITE_STATEMENT_RE.match(sql)):
+            return False
+        if random.random() >= self.explain_sample_rate:
+            return False
+        fingerprint = statement_fingerprint(sql)
+        now = time.monotonic()
+        with self._lock:
+            last = self._last_explained.get(fingerprint)
+            if last is not None and now - last < self.explain_interval:
+                return False
+            self._last_explained[fingerprint] = now
+            if len(self._last_explained) > 10000:
+                self._last_explained.clear()
+        return True
+
+    def _queue_persist_only(self, entry: dict):
+        try:
+            self._queue.put_nowait((entry, None))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    # --- Worker ---
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name=f"slow-query-{self.source}", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 30.0):
+        """Finish queued explains (up to timeout seconds) and stop the worker."""
+        if self._thread is None:
+            return
+        try:
+            self._queue.put((None, None), timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout=timeout)
+        self._thread = None
+
+    def _run(self):
+        while True:
+            entry, sql = self._queue.get()
+            if entry is None:
+                return
+            conn = None
+            try:
+                conn = self.connect()
+                if sql is not None:
+                    self._explain(conn, entry, sql)
+                if self.persist:
+                    self._persist(conn, entry)
+            except Exception as e:
+                logger.error(f"Slow query worker failed: {e}")
+            finally:
+                if conn is not None:
+                    try:
+                        conn.rollback()
+                    except Exception:
+                        pass
+                    self.release(conn)
+
+    def _explain(self, conn, entry: dict, sql: str):
+        analyze = bool(_READ_STATEMENT_RE.match(sql))
+        try:
+            # Plain cursor: JSON plans come back as one column in one row
+            with conn.cursor(cursor_factory=extensions.cursor) as cur:
+                if analyze:
+                    # Data-modifying CTEs fail here instead of writing; the rollback undoes the rest
+                    cur.execute("SET TRANSACTION READ ONLY")
+                cur.execute(f"SET LOCAL statement_timeout = {int(self.explain_timeout_ms)}")
+                if analyze:
+                    cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql)
+                else:
+                    cur.execute("EXPLAIN (FORMAT JSON) " + sql)
+                result = cur.fetchone()[0]
+                plan = (json.loads(result) if isinstance(result, str) else result)[0]
+                conn.rollback()
+
+                relations = [node['Relation Name'] for node in _walk(plan['Plan']) if node.get('Node Type') == 'Seq Scan']
+                table_rows = {}
+                if relations:
+                    cur.execute(
+                        "SELECT relname, reltuples FROM pg_class WHERE relname = ANY(%s) AND relkind IN ('r', 'p', 'm')",
+                        (relations,)
+                    )
+                    table_rows = {name: rows for name, rows in cur.fetchall()}
+                    conn.rollback()
+
+            entry['plan'] = plan
+            entry['analyzed'] = analyze
+            entry['flags'] = plan_flags(plan['Plan'], table_rows)
+            with self._lock:
+                self.explained += 1
+            if entry['flags']:
+                logger.warning(f"Slow query plan flagged {entry['flags']}: {' '.join(sql[:300].split())}")
+        except Exception as e:
+            conn.rollback()
+            entry['explain_error'] = str(e)[:500]
+            with self._lock:
+                self.explain_errors += 1
+
+    def _persist(self, conn, entry: dict):
+        try:
+            with conn.cursor(cursor_factory=extensions.cursor) as cur:
+                cur.execute(INSERT_SLOW_QUERY_SQL, (
+                    entry['captured_at'], entry['source'], entry['context'], entry['duration_ms'],
+                    entry['query'], entry['params'],
+                    json.dumps(entry['plan']) if entry['plan'] is not None else None,
+                    entry['analyzed'], entry['flags'], entry['explain_error'],
+                ))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            with self._lock:
+                self.persist_errors += 1
+            logger.warning(f"Could not store slow query: {e}")
+
+    # --- Reporting ---
+
+    def snapshot(self, limit: int = 50, flagged_only: bool = False) -> dict:
+        with self._lock:
+            entries = list(self._entries)
+        entries.reverse()
+        if flagged_only:
+            entries = [entry for entry in entries if entry['flags']]
+        return {
+            'stats': self.stats(),
+            'entries': entries[:limit],
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'threshold_ms': self.threshold_ms,
+                'buffered': len(self._entries),
+                'captured': self.captured,
+                'explained': self.explained,
+                'explain_errors': self.explain_errors,
+                'explain_queue': self._queue.qsize(),
+                'dropped': self.dropped,
+                'persist_errors': self.persist_errors,
+            }
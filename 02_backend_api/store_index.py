@@ -0,0 +1,247 @@
+"""
+In-memory spatial index over store coordinates behind /api/stores/nearby.
+
+Stores are bucketed into a grid of CELL_DEGREES x CELL_DEGREES cells (about
+5 km in Israel), one grid for all stores and one per retailer. A k-nearest
+query searches rings of cells outwards from the user's cell and stops as soon
+as no unvisited cell can hold anything closer than the k-th store found. A
+radius query only visits the cells overlapping the circle's bounding box.
+Either way only a handful of stores get a haversine distance.
+
+The index is rebuilt after every ETL run (which can create stores) and, since
+geocoding scripts update coordinates outside the ETLs, in the background once
+it is older than refresh_seconds.
+"""
+
+import heapq
+import logging
+import math
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CELL_DEGREES = 0.05
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180.0
+
+STORE_INDEX_QUERY = """
+    SELECT
+        s.storeid AS store_id,
+        s.retailerid AS retailer_id,
+        r.retailername AS retailer_name,
+        s.storename AS store_name,
+        s.address,
+        s.latitude,
+        s.longitude
+    FROM stores s
+    JOIN retailers r ON s.retailerid = r.retailerid
+    WHERE s.latitude IS NOT NULL AND s.longitude IS NOT NULL AND s.isactive = true
+"""
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _cell(lat: float, lon: float) -> Tuple[int, int]:
+    return math.floor(lat / CELL_DEGREES), math.floor(lon / CELL_DEGREES)
+
+
+class _Grid:
+    def __init__(self, stores: List[dict]):
+        self.stores = stores
+        self.cells: Dict[Tuple[int, int], List[dict]] = {}
+        for store in stores:
+            self.cells.setdefault(_cell(store['latitude'], store['longitude']), []).append(store)
+        if self.cells:
+            rows = [row for row, _ in self.cells]
+            cols = [col for _, col in self.cells]
+            self.bounds = (min(rows), max(rows), min(cols), max(cols))
+
+    def _ring(self, center: Tuple[int, int], radius: int):
+        """Occupied cells at Chebyshev distance `radius` from center."""
+        row0, col0 = center
+        if radius == 0:
+            cells = [center]
+        else:
+            cells = []
+            for col in range(col0 - radius, col0 + radius + 1):
+                cells.append((row0 - radius, col))
+                cells.append((row0 + radius, col))
+            for row in range(row0 - radius + 1, row0 + radius):
+                cells.append((row, col0 - radius))
+                cells.append((row, col0 + radius))
+        for cell in cells:
+            stores = self.cells.get(cell)
+            if stores:
+                yield stores
+
+    @staticmethod
+    def _cell_size_km(lat: float, radius: int) -> float:
+        """Lower bound on a cell's width and height within `radius` rings of lat."""
+        worst_lat = min(90.0, abs(lat) + (radius + 1) * CELL_DEGREES)
+        return CELL_DEGREES * KM_PER_DEGREE * max(math.cos(math.radians(worst_lat)), 0.0)
+
+    def nearest(self, lat: float, lon: float, k: int) -> List[Tuple[float, dict]]:
+        if not self.cells:
+            return []
+        center = _cell(lat, lon)
+        min_row, max_row, min_col, max_col = self.bounds
+        max_radius = max(center[0] - min_row, max_row - center[0], center[1] - min_col, max_col - center[1])
+
+        found = []  # (distance, store_id, store)
+        for radius in range(max_radius + 1):
+            # Far from every store (or nearly exhausted): scanning all stores is cheaper than rings
+            if (2 * radius + 1) ** 2 > 4 * len(self.cells):
+                found = [(haversine_km(lat, lon, s['latitude'], s['longitude']), s['store_id'], s) for s in self.stores]
+                break
+            for stores in self._ring(center, radius):
+                for s in stores:
+                    found.append((haversine_km(lat, lon, s['latitude'], s['longitude']), s['store_id'], s))
+            # Anything not yet visited is at least `radius` whole cells away
+            if len(found) >= k and heapq.nsmallest(k, found)[-1][0] <= radius * self._cell_size_km(lat, radius):
+                break
+        return [(distance, store) for distance, _, store in heapq.nsmallest(k, found)]
+
+    def within(self, lat: float, lon: float, radius_km: float) -> List[Tuple[float, dict]]:
+        dlat = radius_km / KM_PER_DEGREE
+        cos_lat = max(math.cos(math.radians(min(89.0, abs(lat) + dlat))), 1e-6)
+        dlon = radius_km / (KM_PER_DEGREE * cos_lat)
+        min_row, min_col = _cell(lat - dlat, lon - dlon)
+        max_row, max_col = _cell(lat + dlat, lon + dlon)
+
+        found = []
+        if (max_row - min_row + 1) * (max_col - min_col + 1) > len(self.cells):
+            candidates = [self.stores]
+        else:
+            candidates = (
+                self.cells[(row, col)]
+                for row in range(min_row, max_row + 1)
+                for col in range(min_col, max_col + 1)
+                if (row, col) in self.cells
+            )
+        for stores in candidates:
+            for s in stores:
+                distance = haversine_km(lat, lon, s['latitude'], s['longitude'])
+                if distance <= radius_km:
+                    found.append((distance, s['store_id'], s))
+        found.sort()
+        return [(distance, store) for distance, _, store in found]
+
+
+class _StoreSnapshot:
+    def __init__(self, stores: List[dict]):
+        self.all = _Grid(stores)
+        by_retailer: Dict[int, List[dict]] = {}
+        for store in stores:
+            by_retailer.setdefault(store['retailer_id'], []).append(store)
+        self.by_retailer = {retailer_id: _Grid(group) for retailer_id, group in by_retailer.items()}
+        self.built_at = time.monotonic()
+
+
+class StoreIndex:
+    def __init__(self, db_pool, refresh_seconds: float = 300.0):
+        """
+        Args:
+            db_pool: DatabasePool used for rebuilds
+            refresh_seconds: Age after which the next request triggers a background rebuild
+        """
+        self.db_pool = db_pool
+        self.refresh_seconds = refresh_seconds
+        self._snapshot: Optional[_StoreSnapshot] = None
+        self._build_lock = threading.Lock()
+        self._refreshing = threading.Event()
+        self.version = None
+        self.build_seconds = None
+
+    def _current_snapshot(self) -> _StoreSnapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            self.rebuild(self.version, only_if_missing=True)
+            snapshot = self._snapshot
+        elif time.monotonic() - snapshot.built_at > self.refresh_seconds:
+            self._refresh_in_background()
+        return snapshot
+
+    def nearby(
+        self,
+        lat: float,
+        lon: float,
+        limit: int,
+        retailer_id: Optional[int] = None,
+        radius_km: Optional[float] = None,
+    ) -> List[dict]:
+        """
+        The `limit` closest active stores, optionally only one retailer's and
+        only those within radius_km. Each result carries distance_km.
+        """
+        snapshot = self._current_snapshot()
+        grid = snapshot.by_retailer.get(retailer_id) if retailer_id else snapshot.all
+        if grid is None:
+            return []
+        if radius_km is not None:
+            matches = grid.within(lat, lon, radius_km)[:limit]
+        else:
+            matches = grid.nearest(lat, lon, limit)
+        return [dict(store, distance_km=round(distance, 3)) for distance, store in matches]
+
+    def _refresh_in_background(self):
+        if self._refreshing.is_set():
+            return
+        self._refreshing.set()
+
+        def refresh():
+            try:
+                self.rebuild(self.version)
+            except Exception as e:
+                logger.error(f"Background store index refresh failed: {e}")
+            finally:
+                self._refreshing.clear()
+
+        threading.Thread(target=refresh, name="store-index-refresh", daemon=True).start()
+
+    def rebuild(self, version: Optional[int] = None, only_if_missing: bool = False):
+        """Reload store coordinates and swap in a new index atomically."""
+        with self._build_lock:
+            if only_if_missing and self._snapshot is not None:
+                return
+            started = time.monotonic()
+            conn = self.db_pool.getconn()
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(STORE_INDEX_QUERY)
+                    rows = cur.fetchall()
+            finally:
+                self.db_pool.putconn(conn)
+
+            stores = []
+            for row in rows:
+                store = dict(row)
+                store['latitude'] = float(store['latitude'])
+                store['longitude'] = float(store['longitude'])
+                stores.append(store)
+
+            self._snapshot = _StoreSnapshot(stores)
+            self.version = version
+            self.build_seconds = round(time.monotonic() - started, 3)
+            logger.info(
+                f"Store index rebuilt: {len(stores)} stores in {len(self._snapshot.all.cells)} cells "
+                f"in {self.build_seconds}s (data version {version})"
+            )
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            'ready': snapshot is not None,
+            'stores': len(snapshot.all.stores) if snapshot else 0,
+            'cells': len(snapshot.all.cells) if snapshot else 0,
+            'age_seconds': round(time.monotonic() - snapshot.built_at, 1) if snapshot else None,
+            'data_version': self.version,
+            'build_seconds': self.build_seconds,
+        }
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Test script for POST /api/products/batch
+"""
+
+import requests
+import time
+
+BASE_URL = "http://localhost:8000"
+
+
+def get_sample_barcodes(count: int = 20):
+    """Pick real barcodes from the popular recommendations endpoint"""
+    response = requests.get(f"{BASE_URL}/api/recommendations/popular", params={"limit": count}, timeout=10)
+    response.raise_for_status()
+    return [product['barcode'] for product in response.json()]
+
+
+def test_batch_matches_single_lookups(barcodes):
+    """Batch results should match /api/products/{id} one by one"""
+    print("\n=== Testing batch vs single lookups ===")
+
+    start_time = time.time()
+    response = requests.post(f"{BASE_URL}/api/products/batch", json={"barcodes": barcodes}, timeout=30)
+    elapsed = time.time() - start_time
+
+    if response.status_code != 200:
+        print(f"❌ Batch failed: {response.status_code} {response.text}")
+        return
+
+    data = response.json()
+    print(f"✅ {len(data['products'])} products, {len(data['not_found'])} not found in {elapsed:.2f}s")
+
+    returned = [product['product_id'] for product in data['products']]
+    expected_order = [barcode for barcode in barcodes if barcode in returned]
+    print(f"{'✅' if returned == expected_order else '❌'} Products are in request order")
+
+    mismatches = 0
+    for product in data['products'][:5]:
+        single = requests.get(f"{BASE_URL}/api/products/{product['product_id']}", timeout=10).json()
+        if sorted(p['price'] for p in single['prices']) != sorted(p['price'] for p in product['prices']):
+            mismatches += 1
+    print(f"{'✅' if mismatches == 0 else '❌'} Prices match single lookups ({mismatches} mismatches)")
+
+
+def test_batch_store_filter(barcodes):
+    """store_ids limits prices to those stores"""
+    print("\n=== Testing store_ids filter ===")
+
+    stores = requests.get(f"{BASE_URL}/api/stores/nearby", params={"lat": 32.08, "lon": 34.78, "limit": 5}, timeout=10).json()
+    store_ids = [store['store_id'] for store in stores]
+
+    response = requests.post(
+        f"{BASE_URL}/api/products/batch",
+        json={"barcodes": barcodes, "store_ids": store_ids},
+        timeout=30
+    )
+    data = response.json()
+
+    outside = [
+        price for product in data['products'] for price in product['prices']
+        if price['store_id'] not in store_ids
+    ]
+    if not outside:
+        print(f"✅ All prices come from the {len(store_ids)} requested stores ({len(data['products'])} products)")
+    else:
+        print(f"❌ {len(outside)} prices from other stores")
+
+
+def test_batch_unknown_and_limits():
+    """Unknown barcodes go to not_found; oversized requests are rejected"""
+    print("\n=== Testing not_found and limits ===")
+
+    response = requests.post(f"{BASE_URL}/api/products/batch", json={"barcodes": ["0000000000000"]}, timeout=10)
+    if response.status_code == 200 and response.json()['not_found'] == ["0000000000000"]:
+        print("✅ Unknown barcode reported in not_found")
+    else:
+        print(f"❌ Unknown barcode: {response.status_code} {response.text}")
+
+    response = requests.post(f"{BASE_URL}/api/products/batch", json={"barcodes": [str(i) for i in range(501)]}, timeout=10)
+    print(f"{'✅' if response.status_code == 422 else '❌'} 501 barcodes rejected ({response.status_code})")
+
+
+if __name__ == "__main__":
+    print("Testing POST /api/products/batch endpoint")
+    print("=" * 50)
+
+    sample_barcodes = get_sample_barcodes()
+    test_batch_matches_single_lookups(sample_barcodes)
+    test_batch_store_filter(sample_barcodes)
+    test_batch_unknown_and_limits()
+
+    print("\n" + "=" * 50)
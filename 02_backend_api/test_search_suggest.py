@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Test script for GET /api/search/suggest (autocomplete)
+"""
+
+import requests
+import time
+
+BASE_URL = "http://localhost:8000"
+
+
+def suggest(q: str, limit: int = 8):
+    start_time = time.time()
+    response = requests.get(f"{BASE_URL}/api/search/suggest", params={"q": q, "limit": limit}, timeout=10)
+    elapsed_ms = (time.time() - start_time) * 1000
+    return response, elapsed_ms
+
+
+def test_suggest_prefixes():
+    """Short and longer prefixes return ranked suggestions"""
+    print("\n=== Testing suggestion prefixes ===")
+
+    for q in ["ק", "קר", "קרם", "nivea", "שמפו"]:
+        response, elapsed_ms = suggest(q)
+        if response.status_code != 200:
+            print(f"❌ '{q}' failed: {response.status_code} {response.text}")
+            continue
+
+        data = response.json()
+        print(f"✅ '{q}': {len(data['suggestions'])} suggestions in {elapsed_ms:.1f}ms (round trip)")
+        for suggestion in data['suggestions'][:3]:
+            print(f"   [{suggestion['type']}] {suggestion['text']}")
+
+
+def test_suggest_normalization():
+    """מ"ל, מ״ל and מל must give the same suggestions"""
+    print("\n=== Testing Hebrew normalization ===")
+
+    results = []
+    for q in ['מ"ל', 'מ״ל', 'מל']:
+        response, _ = suggest(q, limit=20)
+        results.append([s['text'] for s in response.json()['suggestions']])
+
+    if results[0] == results[1] == results[2]:
+        print(f"✅ Quote variants return identical suggestions ({len(results[0])})")
+    else:
+        print("❌ Quote variants return different suggestions")
+
+
+def test_suggest_limits():
+    """Empty queries return nothing; limit is validated"""
+    print("\n=== Testing limits ===")
+
+    response, _ = suggest("")
+    if response.status_code == 200 and response.json()['suggestions'] == []:
+        print("✅ Empty query returns no suggestions")
+    else:
+        print(f"❌ Empty query: {response.status_code} {response.text}")
+
+    response, _ = suggest("קר", limit=50)
+    if response.status_code == 422:
+        print("✅ limit above 20 is rejected")
+    else:
+        print(f"❌ limit=50 returned {response.status_code}")
+
+
+if __name__ == "__main__":
+    print("Testing GET /api/search/suggest endpoint")
+    print("=" * 50)
+
+    health = requests.get(f"{BASE_URL}/health", timeout=10).json()
+    print(f"Suggest index: {health.get('suggest_index')}")
+
+    test_suggest_prefixes()
+    test_suggest_normalization()
+    test_suggest_limits()
+
+    print("\n" + "=" * 50)
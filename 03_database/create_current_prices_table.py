@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Migration: creates the current_prices table
+
+current_prices holds exactly one row per (retailer_product_id, store_id): the
+most recent positive price from the prices history. The retailer ETLs upsert
+into it as they insert history, and the API's product detail and cart
+recommendation endpoints read from it instead of ranking the whole history
+with ROW_NUMBER() on every request.
+
+Usage:
+    python3 03_database/create_current_prices_table.py            # create + backfill
+    python3 03_database/create_current_prices_table.py --rebuild  # truncate + backfill again
+"""
+
+import os
+import sys
+import argparse
+import psycopg2
+from datetime import datetime
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Database configuration
+DB_NAME = os.getenv("DB_NAME", "price_comparison_app_v2")
+DB_USER = os.getenv("DB_USER", "postgres")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "025655358")
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = os.getenv("DB_PORT", "5432")
+
+CREATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS current_prices (
+        retailer_product_id INTEGER NOT NULL
+            REFERENCES retailer_products (retailer_product_id) ON DELETE CASCADE,
+        store_id INTEGER NOT NULL
+            REFERENCES stores (storeid) ON DELETE CASCADE,
+        price NUMERIC(10,2) NOT NULL,
+        price_timestamp TIMESTAMPTZ NOT NULL,
+        scraped_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (retailer_product_id, store_id)
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_current_prices_store_id
+        ON current_prices (store_id);
+
+    CREATE INDEX IF NOT EXISTS idx_retailer_products_barcode
+        ON retailer_products (barcode);
+"""
+
+# Latest positive price per (retailer_product_id, store_id), same rule the API used
+BACKFILL_SQL = """
+    INSERT INTO current_prices (retailer_product_id, store_id, price, price_timestamp, scraped_at)
+    SELECT DISTINCT ON (retailer_product_id, store_id)
+        retailer_product_id,
+        store_id,
+        price,
+        price_timestamp,
+        COALESCE(scraped_at, NOW())
+    FROM prices
+    WHERE price > 0
+    ORDER BY retailer_product_id, store_id, price_timestamp DESC
+    ON CONFLICT (retailer_product_id, store_id)
+    DO UPDATE SET
+        price = EXCLUDED.price,
+        price_timestamp = EXCLUDED.price_timestamp,
+        scraped_at = EXCLUDED.scraped_at
+    WHERE EXCLUDED.price_timestamp >= current_prices.price_timestamp
+"""
+
+
+def run_migration(rebuild: bool = False):
+    """Create current_prices and backfill it from the prices history"""
+    print(f"[{datetime.now().isoformat()}] Starting current_prices migration...")
+
+    try:
+        conn = psycopg2.connect(
+            dbname=DB_NAME,
+            user=DB_USER,
+            password=DB_PASSWORD,
+            host=DB_HOST,
+            port=DB_PORT
+        )
+        cur = conn.cursor()
+
+        print("Creating current_prices table and indexes...")
+        cur.execute(CREATE_TABLE_SQL)
+
+        if rebuild:
+            print("Truncating current_prices for a full rebuild...")
+            cur.execute("TRUNCATE current_prices")
+
+        print("Backfilling from prices history (this can take a few minutes)...")
+        cur.execute(BACKFILL_SQL)
+        print(f"  Rows written: {cur.rowcount:,}")
+
+        conn.commit()
+
+        cur.execute("ANALYZE current_prices")
+        conn.commit()
+
+        cur.execute("""
+            SELECT COUNT(*), COUNT(DISTINCT store_id), MAX(price_timestamp)
+            FROM current_prices
+        """)
+        total, stores, latest = cur.fetchone()
+        print("\n✅ Migration completed successfully!")
+        print(f"  Current prices: {total:,}")
+        print(f"  Stores covered: {stores:,}")
+        print(f"  Latest price timestamp: {latest}")
+
+        cur.close()
+        conn.close()
+        return True
+
+    except Exception as e:
+        print(f"\n❌ Migration failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create and backfill the current_prices table")
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Truncate current_prices and rebuild it from the full prices history"
+    )
+    args = parser.parse_args()
+
+    success = run_migration(rebuild=args.rebuild)
+    sys.exit(0 if success else 1)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Migration: creates the data_versions table
+
+Every ETL run inserts a row here when it finishes. The API polls
+MAX(version) and rebuilds its in-memory indexes and caches whenever it
+changes, so new prices and products show up without restarting the server.
+
+Each committed ETL batch also inserts a row listing the barcodes it touched
+(barcodes column), which the API uses to drop just those products from its
+product detail cache. Safe to re-run: adds the column to an existing table.
+"""
+
+import os
+import sys
+import psycopg2
+from datetime import datetime
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Database configuration
+DB_NAME = os.getenv("DB_NAME", "price_comparison_app_v2")
+DB_USER = os.getenv("DB_USER", "postgres")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "025655358")
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = os.getenv("DB_PORT", "5432")
+
+CREATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS data_versions (
+        version BIGSERIAL PRIMARY KEY,
+        source VARCHAR(100) NOT NULL,
+        retailer_id INTEGER,
+        barcodes TEXT[],
+        created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    );
+
+    -- Tables created before per-batch invalidation lack this column
+    ALTER TABLE data_versions ADD COLUMN IF NOT EXISTS barcodes TEXT[];
+"""
+
+
+def run_migration():
+    """Create data_versions and seed version 1"""
+    print(f"[{datetime.now().isoformat()}] Starting data_versions migration...")
+
+    try:
+        conn = psycopg2.connect(
+            dbname=DB_NAME,
+            user=DB_USER,
+            password=DB_PASSWORD,
+            host=DB_HOST,
+            port=DB_PORT
+        )
+        cur = conn.cursor()
+
+        cur.execute(CREATE_TABLE_SQL)
+
+        # Seed a first version so the API has something to compare against
+        cur.execute("""
+            INSERT INTO data_versions (source)
+            SELECT 'migration'
+            WHERE NOT EXISTS (SELECT 1 FROM data_versions)
+        """)
+        conn.commit()
+
+        cur.execute("SELECT MAX(version) FROM data_versions")
+        print("\n✅ Migration completed successfully!")
+        print(f"  Current data version: {cur.fetchone()[0]}")
+
+        cur.close()
+        conn.close()
+        return True
+
+    except Exception as e:
+        print(f"\n❌ Migration failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+if __name__ == "__main__":
+    success = run_migration()
+    sys.exit(0 if success else 1)
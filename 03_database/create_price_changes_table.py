@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Migration: creates the price_changes table
+
+The retailer ETLs compare every price they upsert into current_prices with the
+price it replaces and append one row here per (retailer product, store) whose
+price fell. /api/price-drops reads the last day or few from it through the
+detected_at indexes instead of diffing prices at request time. The ETLs prune
+rows older than PRICE_CHANGE_RETENTION_DAYS. Safe to re-run.
+"""
+
+import os
+import sys
+import psycopg2
+from datetime import datetime
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Database configuration
+DB_NAME = os.getenv("DB_NAME", "price_comparison_app_v2")
+DB_USER = os.getenv("DB_USER", "postgres")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "025655358")
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = os.getenv("DB_PORT", "5432")
+
+CREATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS price_changes (
+        change_id BIGSERIAL PRIMARY KEY,
+        retailer_id INTEGER NOT NULL,
+        retailer_product_id INTEGER NOT NULL,
+        store_id INTEGER NOT NULL,
+        old_price NUMERIC(10,2) NOT NULL,
+        new_price NUMERIC(10,2) NOT NULL,
+        price_timestamp TIMESTAMPTZ NOT NULL,
+        detected_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_price_changes_detected_at
+        ON price_changes (detected_at);
+
+    CREATE INDEX IF NOT EXISTS idx_price_changes_retailer_detected_at
+        ON price_changes (retailer_id, detected_at);
+"""
+
+
+def run_migration():
+    """Create price_changes"""
+    print(f"[{datetime.now().isoformat()}] Starting price_changes migration...")
+
+    try:
+        conn = psycopg2.connect(
+            dbname=DB_NAME,
+            user=DB_USER,
+            password=DB_PASSWORD,
+            host=DB_HOST,
+            port=DB_PORT
+        )
+        cur = conn.cursor()
+
+        cur.execute(CREATE_TABLE_SQL)
+        conn.commit()
+
+        cur.execute("SELECT COUNT(*) FROM price_changes")
+        print("\n✅ Migration completed successfully!")
+        print(f"  Recorded price drops: {cur.fetchone()[0]}")
+
+        cur.close()
+        conn.close()
+        return True
+
+    except Exception as e:
+        print(f"\n❌ Migration failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+if __name__ == "__main__":
+    success = run_migration()
+    sys.exit(0 if success else 1)
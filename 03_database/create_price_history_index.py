@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Migration: covering index for /api/products/{barcode}/history
+
+The price history endpoint aggregates every prices row of a product's
+retailer products inside a time window. The existing index on
+retailer_product_id alone finds the rows but must visit the heap for each one
+(and the ETLs write a row per file per store, so there are many);
+(retailer_product_id, price_timestamp) INCLUDE (price) narrows the scan to the
+window and answers it from the index alone.
+
+The index is built CONCURRENTLY, so the ETLs and the API keep running while
+this runs.
+"""
+
+import os
+import sys
+import psycopg2
+from datetime import datetime
+from dotenv import load_dotenv
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+# Load environment variables
+load_dotenv()
+
+# Database configuration
+DB_NAME = os.getenv("DB_NAME", "price_comparison_app_v2")
+DB_USER = os.getenv("DB_USER", "postgres")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "025655358")
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = os.getenv("DB_PORT", "5432")
+
+STATEMENTS = [
+    ("product/timestamp index", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_prices_product_timestamp
+        ON prices (retailer_product_id, price_timestamp) INCLUDE (price)
+    """),
+    # Index-only scans need the visibility map to be current
+    ("vacuum analyze", "VACUUM ANALYZE prices"),
+]
+
+
+def run_migration():
+    """Create the price history index"""
+    print(f"[{datetime.now().isoformat()}] Starting price history index migration...")
+
+    try:
+        conn = psycopg2.connect(
+            dbname=DB_NAME,
+            user=DB_USER,
+            password=DB_PASSWORD,
+            host=DB_HOST,
+            port=DB_PORT
+        )
+        # CREATE INDEX CONCURRENTLY and VACUUM cannot run inside a transaction block
+        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        cur = conn.cursor()
+
+        for label, statement in STATEMENTS:
+            print(f"  Running {label}...")
+            cur.execute(statement)
+
+        cur.execute("""
+            SELECT pg_size_pretty(pg_relation_size('idx_prices_product_timestamp'::regclass))
+        """)
+
+        print("\n✅ Migration completed successfully!")
+        print(f"  idx_prices_product_timestamp: {cur.fetchone()[0]}")
+
+        cur.close()
+        conn.close()
+        return True
+
+    except Exception as e:
+        print(f"\n❌ Migration failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+if __name__ == "__main__":
+    success = run_migration()
+    sys.exit(0 if success else 1)
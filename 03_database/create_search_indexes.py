@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Migration: trigram indexes for /api/search
+
+Enables pg_trgm and builds GIN trigram indexes on canonical_products.name and
+.brand, so the search endpoint's ILIKE '%q%' and fuzzy (%) matches are index
+scans instead of sequential scans. The indexes are partial on the same
+conditions every search query applies, which keeps them small.
+
+Indexes are built CONCURRENTLY, so the API keeps serving while this runs.
+
+Note: pg_trgm only extracts trigrams from characters the database locale
+considers alphanumeric. Hebrew is covered by any UTF-8 locale (the default on
+our hosted Postgres); with LC_CTYPE=C Hebrew names would not be indexed.
+"""
+
+import os
+import sys
+import psycopg2
+from datetime import datetime
+from dotenv import load_dotenv
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+# Load environment variables
+load_dotenv()
+
+# Database configuration
+DB_NAME = os.getenv("DB_NAME", "price_comparison_app_v2")
+DB_USER = os.getenv("DB_USER", "postgres")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "025655358")
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = os.getenv("DB_PORT", "5432")
+
+SEARCHABLE_PREDICATE = """
+    is_active = true
+    AND lowest_price IS NOT NULL
+    AND image_url IS NOT NULL
+    AND image_url NOT LIKE '%placeholder%'
+"""
+
+STATEMENTS = [
+    ("pg_trgm extension", "CREATE EXTENSION IF NOT EXISTS pg_trgm"),
+    ("name trigram index", f"""
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_canonical_products_name_trgm
+        ON canonical_products USING gin (name gin_trgm_ops)
+        WHERE {SEARCHABLE_PREDICATE}
+    """),
+    ("brand trigram index", f"""
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_canonical_products_brand_trgm
+        ON canonical_products USING gin (brand gin_trgm_ops)
+        WHERE {SEARCHABLE_PREDICATE}
+    """),
+    # category LIKE 'prefix%' needs text_pattern_ops to use a btree under non-C collations
+    ("category prefix index", f"""
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_canonical_products_category_prefix
+        ON canonical_products (category text_pattern_ops)
+        WHERE {SEARCHABLE_PREDICATE}
+    """),
+    ("analyze", "ANALYZE canonical_products"),
+]
+
+
+def run_migration():
+    """Create the search indexes"""
+    print(f"[{datetime.now().isoformat()}] Starting search index migration...")
+
+    try:
+        conn = psycopg2.connect(
+            dbname=DB_NAME,
+            user=DB_USER,
+            password=DB_PASSWORD,
+            host=DB_HOST,
+            port=DB_PORT
+        )
+        # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        cur = conn.cursor()
+
+        for label, statement in STATEMENTS:
+            print(f"  Creating {label}...")
+            cur.execute(statement)
+
+        cur.execute("""
+            SELECT indexname, pg_size_pretty(pg_relation_size(indexname::regclass))
+            FROM pg_indexes
+            WHERE tablename = 'canonical_products'
+              AND indexname IN (
+                  'idx_canonical_products_name_trgm',
+                  'idx_canonical_products_brand_trgm',
+                  'idx_canonical_products_category_prefix'
+              )
+            ORDER BY indexname
+        """)
+
+        print("\n✅ Migration completed successfully!")
+        for index_name, size in cur.fetchall():
+            print(f"  {index_name}: {size}")
+
+        cur.close()
+        conn.close()
+        return True
+
+    except Exception as e:
+        print(f"\n❌ Migration failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+if __name__ == "__main__":
+    success = run_migration()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Migration: creates the slow_queries table
+
+The ETLs (and the API with SLOW_QUERY_PERSIST=true) insert a row for every
+statement slower than their threshold: its duration, SQL and parameters and,
+when it was sampled, its EXPLAIN plan with flags for sequential scans on large
+tables and sorts or hashes that spilled to disk. See
+02_backend_api/slow_queries.py. Safe to re-run.
+
+Find regressions with e.g.:
+    SELECT captured_at, source, duration_ms, flags, left(query, 120)
+    FROM slow_queries WHERE flags <> '{}' ORDER BY captured_at DESC LIMIT 20;
+"""
+
+import os
+import sys
+import psycopg2
+from datetime import datetime
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Database configuration
+DB_NAME = os.getenv("DB_NAME", "price_comparison_app_v2")
+DB_USER = os.getenv("DB_USER", "postgres")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "025655358")
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = os.getenv("DB_PORT", "5432")
+
+CREATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS slow_queries (
+        id BIGSERIAL PRIMARY KEY,
+        captured_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        source VARCHAR(100) NOT NULL,
+        context TEXT,
+        duration_ms DOUBLE PRECISION NOT NULL,
+        query TEXT NOT NULL,
+        params TEXT,
+        plan JSONB,
+        analyzed BOOLEAN NOT NULL DEFAULT FALSE,
+        flags TEXT[] NOT NULL DEFAULT '{}',
+        explain_error TEXT
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_slow_queries_captured_at ON slow_queries (captured_at DESC);
+"""
+
+
+def run_migration():
+    """Create slow_queries"""
+    print(f"[{datetime.now().isoformat()}] Starting slow_queries migration...")
+
+    try:
+        conn = psycopg2.connect(
+            dbname=DB_NAME,
+            user=DB_USER,
+            password=DB_PASSWORD,
+            host=DB_HOST,
+            port=DB_PORT
+        )
+        cur = conn.cursor()
+
+        cur.execute(CREATE_TABLE_SQL)
+        conn.commit()
+
+        cur.execute("SELECT COUNT(*) FROM slow_queries")
+        print("\n✅ Migration completed successfully!")
+        print(f"  Slow queries recorded so far: {cur.fetchone()[0]}")
+
+        cur.close()
+        conn.close()
+        return True
+
+    except Exception as e:
+        print(f"\n❌ Migration failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+if __name__ == "__main__":
+    success = run_migration()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Migration: creates the user_recommendation_candidates table
+
+One row per user with their ranked recommendation candidates, materialized by
+the API (see 02_backend_api/recommendation_candidates.py) whenever the user's
+cart, favorites or preferences change, and again when a read finds the row
+older than the current data version. /api/recommendations reads it by
+primary key. Safe to re-run.
+"""
+
+import os
+import sys
+import psycopg2
+from datetime import datetime
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Database configuration
+DB_NAME = os.getenv("DB_NAME", "price_comparison_app_v2")
+DB_USER = os.getenv("DB_USER", "postgres")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "025655358")
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = os.getenv("DB_PORT", "5432")
+
+CREATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS user_recommendation_candidates (
+        user_id INTEGER PRIMARY KEY,
+        barcodes TEXT[] NOT NULL DEFAULT '{}',
+        data_version BIGINT NOT NULL DEFAULT 0,
+        computed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    );
+"""
+
+
+def run_migration():
+    """Create user_recommendation_candidates"""
+    print(f"[{datetime.now().isoformat()}] Starting user_recommendation_candidates migration...")
+
+    try:
+        conn = psycopg2.connect(
+            dbname=DB_NAME,
+            user=DB_USER,
+            password=DB_PASSWORD,
+            host=DB_HOST,
+            port=DB_PORT
+        )
+        cur = conn.cursor()
+
+        cur.execute(CREATE_TABLE_SQL)
+        conn.commit()
+
+        cur.execute("SELECT COUNT(*) FROM user_recommendation_candidates")
+        print("\n✅ Migration completed successfully!")
+        print(f"  Users with candidates: {cur.fetchone()[0]}")
+
+        cur.close()
+        conn.close()
+        return True
+
+    except Exception as e:
+        print(f"\n❌ Migration failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+if __name__ == "__main__":
+    success = run_migration()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Publishes the memory-mapped catalog snapshot the API workers share.
+
+The ETLs publish one after every run when CATALOG_SNAPSHOT_DIR is set (see
+02_backend_api/catalog_snapshot.py). Run this after catalog changes made
+outside the ETLs (the deactivation scripts) or to create the first snapshot;
+it is stamped with the current data version. Running API workers map it
+within CATALOG_SNAPSHOT_REFRESH_SECONDS. Safe to re-run.
+
+Usage:
+    CATALOG_SNAPSHOT_DIR=/var/lib/pharmmate/catalog python 04_utilities/build_catalog_snapshot.py
+"""
+
+import argparse
+import os
+import sys
+from datetime import datetime
+
+import psycopg2
+from dotenv import load_dotenv
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '02_backend_api'))
+from catalog_snapshot import write_catalog_snapshot
+
+# Load environment variables
+load_dotenv()
+
+# Database configuration
+DB_NAME = os.getenv("DB_NAME", "price_comparison_app_v2")
+DB_USER = os.getenv("DB_USER", "postgres")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "025655358")
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = os.getenv("DB_PORT", "5432")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish the catalog snapshot for the API workers")
+    parser.add_argument("--output-dir", default=os.getenv("CATALOG_SNAPSHOT_DIR"),
+                        help="Snapshot directory (default: CATALOG_SNAPSHOT_DIR)")
+    args = parser.parse_args()
+    if not args.output_dir:
+        print("❌ Set CATALOG_SNAPSHOT_DIR or pass --output-dir")
+        return False
+
+    print(f"[{datetime.now().isoformat()}] Publishing catalog snapshot...")
+    try:
+        conn = psycopg2.connect(
+            dbname=DB_NAME,
+            user=DB_USER,
+            password=DB_PASSWORD,
+            host=DB_HOST,
+            port=DB_PORT
+        )
+        with conn.cursor() as cur:
+            cur.execute("SELECT COALESCE(MAX(version), 0) FROM data_versions")
+            version = cur.fetchone()[0]
+        conn.rollback()
+
+        path = write_catalog_snapshot(conn, args.output_dir, version)
+        conn.close()
+    except Exception as e:
+        print(f"\n❌ Snapshot failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+    print(f"\n✅ Snapshot for data version {version} written to {path}")
+    return True
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Builds the item-to-item similarity model behind /api/recommendations.
+
+Every (user, product) pair in user_cart or user_favorites is one entry of a
+binary users x products matrix X. X^T X counts, for each pair of products, how
+many users hold both; dividing by sqrt(users holding a) * sqrt(users holding b)
+gives their cosine similarity. Pairs held together by fewer than --min-support
+users are dropped as noise, and each product keeps its --top-k most similar
+neighbours (ties by barcode, so rebuilding from the same data gives the same
+file).
+
+The result is written atomically to the file the API loads (see
+02_backend_api/item_similarity.py); running API workers pick it up within
+ITEM_SIMILARITY_REFRESH_SECONDS. Safe to re-run, e.g. nightly from cron.
+
+Usage:
+    python 04_utilities/build_item_similarity.py [--top-k 50] [--min-support 2] [--output PATH]
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import psycopg2
+from dotenv import load_dotenv
+from scipy import sparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '02_backend_api'))
+from item_similarity import DEFAULT_MODEL_PATH, save_model
+
+# Load environment variables
+load_dotenv()
+
+# Database configuration
+DB_NAME = os.getenv("DB_NAME", "price_comparison_app_v2")
+DB_USER = os.getenv("DB_USER", "postgres")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "025655358")
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = os.getenv("DB_PORT", "5432")
+
+MODEL_PATH = os.getenv("ITEM_SIMILARITY_PATH", DEFAULT_MODEL_PATH)
+
+# Inactive products would only take neighbour slots the API filters out anyway
+INTERACTIONS_QUERY = """
+    SELECT i.user_id, i.product_barcode
+    FROM (
+        SELECT user_id, product_barcode FROM user_cart
+        UNION
+        SELECT user_id, product_barcode FROM user_favorites
+    ) i
+    JOIN canonical_products cp ON cp.barcode = i.product_barcode
+    WHERE cp.is_active = TRUE
+"""
+
+
+def build_similarity(pairs, top_k: int, min_support: int):
+    """
+    Args:
+        pairs: (user_id, barcode) pairs, each at most once
+    Returns:
+        (items, indptr, neighbors, scores, users) in the layout save_model() expects
+    """
+    user_index = {}
+    item_index = {}
+    rows, cols = [], []
+    for user_id, barcode in pairs:
+        rows.append(user_index.setdefault(user_id, len(user_index)))
+        cols.append(item_index.setdefault(barcode, len(item_index)))
+    items = list(item_index)
+    n_items = len(items)
+
+    X = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+        shape=(len(user_index), n_items)
+    )
+    X.data[:] = 1.0  # Binary even if a pair slipped in twice
+
+    cooccurrence = (X.T @ X).tocsr()
+    cooccurrence.setdiag(0)
+    cooccurrence.data[cooccurrence.data < max(min_support, 1)] = 0
+    cooccurrence.eliminate_zeros()
+
+    inv_norms = 1.0 / np.sqrt(np.maximum(np.asarray(X.sum(axis=0)).ravel(), 1.0))
+    similarity = (sparse.diags(inv_norms) @ cooccurrence @ sparse.diags(inv_norms)).tocsr()
+    similarity.sort_indices()
+
+    barcodes = np.asarray(items, dtype=str)
+    indptr = [0]
+    neighbors, scores = [], []
+    for i in range(n_items):
+        start, end = similarity.indptr[i], similarity.indptr[i + 1]
+        cols_i = similarity.indices[start:end]
+        data_i = similarity.data[start:end]
+        # Highest score first, then barcode
+        order = np.lexsort((barcodes[cols_i], -data_i))[:top_k]
+        neighbors.append(cols_i[order])
+        scores.append(data_i[order])
+        indptr.append(indptr[-1] + len(order))
+
+    neighbors = np.concatenate(neighbors) if neighbors else np.zeros(0, dtype=np.int32)
+    scores = np.concatenate(scores) if scores else np.zeros(0, dtype=np.float32)
+    return items, indptr, neighbors, scores, len(user_index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the item similarity model for /api/recommendations")
+    parser.add_argument("--top-k", type=int, default=50, help="Neighbours kept per product")
+    parser.add_argument("--min-support", type=int, default=2, help="Users that must hold both products of a pair")
+    parser.add_argument("--output", default=MODEL_PATH, help="Model file the API loads")
+    args = parser.parse_args()
+
+    print(f"[{datetime.now().isoformat()}] Building item similarity model...")
+    started = time.monotonic()
+
+    try:
+        conn = psycopg2.connect(
+            dbname=DB_NAME,
+            user=DB_USER,
+            password=DB_PASSWORD,
+            host=DB_HOST,
+            port=DB_PORT
+        )
+        with conn.cursor() as cur:
+            cur.execute(INTERACTIONS_QUERY)
+            pairs = cur.fetchall()
+        conn.close()
+    except Exception as e:
+        print(f"\n❌ Could not read interactions: {e}")
+        return False
+
+    items, indptr, neighbors, scores, users = build_similarity(pairs, args.top_k, args.min_support)
+    save_model(args.output, items, indptr, neighbors, scores, meta={
+        'built_at': time.time(),
+        'users': users,
+        'top_k': args.top_k,
+        'min_support': args.min_support,
+    })
+
+    with_neighbors = sum(1 for i in range(len(items)) if indptr[i + 1] > indptr[i])
+    print(f"\n✅ Model written to {args.output}")
+    print(f"  Interactions: {len(pairs)} from {users} users")
+    print(f"  Products with neighbours: {with_neighbors} of {len(items)}")
+    print(f"  Neighbour pairs: {len(neighbors)}")
+    print(f"  Took {time.monotonic() - started:.1f}s")
+    return True
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -283,6 +283,14 @@ def main():
             conn.commit()
             logging.info("\n✅ Changes committed to database")
 
+            # Bump the data version so the API refreshes its in-memory product pools
+            try:
+                cursor.execute("INSERT INTO data_versions (source) VALUES (%s)", ('deactivate_products_without_images',))
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                logging.warning(f"Could not bump data version: {e}")
+
             # Analyze after
             analyze_after_deactivation(cursor)
 
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Check that PRICE_HISTORY_QUERY buckets prices by the local time the ETLs wrote.
+
+Inserts a price at 23:30 local time yesterday for an existing retailer product,
+runs the history query with the session TimeZone set to UTC (so a bucket taken
+in the session zone would land on the next day) and checks the price shows up
+in yesterday's day bucket. Everything runs in one transaction that is rolled back.
+"""
+
+import os
+import sys
+
+import psycopg2
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '02_backend_api'))
+from queries import PRICE_HISTORY_QUERY, price_history_params
+
+CATALOG_TIMEZONE = os.getenv("CATALOG_TIMEZONE", "Asia/Jerusalem")
+TEST_PRICE = 987.65
+
+conn = psycopg2.connect(
+    host=os.getenv("DB_HOST", "localhost"),
+    port=os.getenv("DB_PORT", "5432"),
+    database=os.getenv("DB_NAME", "price_comparison_app_v2"),
+    user=os.getenv("DB_USER", "postgres"),
+    password=os.getenv("DB_PASSWORD", "025655358")
+)
+cursor = conn.cursor()
+
+try:
+    cursor.execute("SET LOCAL TimeZone = 'UTC'")
+
+    cursor.execute("""
+        SELECT rp.barcode, p.retailer_product_id, p.store_id
+        FROM prices p
+        JOIN retailer_products rp ON p.retailer_product_id = rp.retailer_product_id
+        WHERE rp.barcode IS NOT NULL
+        LIMIT 1
+    """)
+    row = cursor.fetchone()
+    if row is None:
+        print("❌ No prices to test with")
+        sys.exit(1)
+    barcode, retailer_product_id, store_id = row
+
+    cursor.execute("SELECT ((NOW() AT TIME ZONE %s)::date - 1) + time '23:30'", (CATALOG_TIMEZONE,))
+    late_evening = cursor.fetchone()[0]
+    print(f"Inserting ₪{TEST_PRICE} for {barcode} at {late_evening} ({CATALOG_TIMEZONE})")
+
+    cursor.execute("""
+        INSERT INTO prices (retailer_product_id, store_id, price, price_timestamp)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT DO NOTHING
+    """, (retailer_product_id, store_id, TEST_PRICE, late_evening))
+
+    cursor.execute(PRICE_HISTORY_QUERY, price_history_params(barcode, 'day', 30, CATALOG_TIMEZONE))
+    buckets = {bucket_start for _, _, bucket_start, _, _, max_price, _ in cursor.fetchall() if max_price == TEST_PRICE}
+
+    if buckets == {late_evening.date()}:
+        print(f"✅ 23:30 price is in the {late_evening.date()} bucket")
+    else:
+        print(f"❌ Expected the {late_evening.date()} bucket, got {sorted(buckets)}")
+        sys.exit(1)
+finally:
+    conn.rollback()
+    cursor.close()
+    conn.close()